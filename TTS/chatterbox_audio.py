@@ -1,33 +1,68 @@
+import soundfile as sf
 import torchaudio
 from chatterbox.tts import ChatterboxTTS
 import os
 import argparse
 import sys
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.transport import read_payload
+from pipeline.workers import serve, serve_stdin
+
 chatterbox_model = None
 try:
     chatterbox_model = ChatterboxTTS.from_pretrained(device="cuda")
 except Exception as e:
     print(f"[ERROR] Chatterbox model could not be loaded: {e}", file=sys.stderr)
 
-def synthesize_chatterbox_audio(text: str, output_filepath: str) -> str:
+def synthesize_chatterbox_audio(text: str, output_filepath: str, append: bool = False) -> str:
     if chatterbox_model is None:
         return "[ERROR] Chatterbox model not loaded. Cannot synthesize audio."
 
     try:
         os.makedirs(os.path.dirname(output_filepath), exist_ok=True)
         audio = chatterbox_model.generate(text)
-        torchaudio.save(output_filepath, audio, chatterbox_model.sr)
+        if append and os.path.isfile(output_filepath):
+            with sf.SoundFile(output_filepath, 'r+') as f:
+                f.seek(0, sf.SEEK_END)
+                f.write(audio.squeeze(0).cpu().numpy())
+        else:
+            torchaudio.save(output_filepath, audio, chatterbox_model.sr)
         return output_filepath
     except Exception as e:
         return f"[ERROR] Failed to synthesize audio with Chatterbox: {e}"
 
+def handle_job(job: dict) -> str:
+    if job.get("prewarm"):
+        # the model is loaded at import: once this job runs, it is ready
+        if chatterbox_model is None:
+            raise RuntimeError("[ERROR] Chatterbox model not loaded.")
+        return ""
+    saved_path = synthesize_chatterbox_audio(text=job["text"], output_filepath=job["output"], append=job.get("append", False))
+    if "[ERROR]" in saved_path:
+        raise RuntimeError(saved_path)
+    return saved_path
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Chatterbox TTS audio generation.")
-    parser.add_argument('--text', required=True, help="The text to convert to speech.")
-    parser.add_argument('--output', required=True, help="The full path to the output .wav file.")
+    parser.add_argument('--text', help="The text to convert to speech.")
+    parser.add_argument('--text-from', help="Read the text from a payload spec ('-', 'file:<path>' or 'shm:<name>') instead.")
+    parser.add_argument('--output', help="The full path to the output .wav file.")
+    parser.add_argument('--serve', action='store_true', help="Keep the model loaded and serve jobs from main.py.")
+    parser.add_argument('--serve-stdin', action='store_true', help="Serve jobs from main.py over stdin/stdout.")
     args = parser.parse_args()
 
+    if args.serve_stdin:
+        serve_stdin(handle_job)
+        sys.exit(0)
+    if args.serve:
+        serve("chatterbox", handle_job)
+        sys.exit(0)
+    if not (args.text or args.text_from) or not args.output:
+        parser.error("--text (or --text-from) and --output are required unless --serve is given.")
+    if args.text_from:
+        args.text = read_payload(args.text_from)
+
     saved_path = synthesize_chatterbox_audio(
         text=args.text,
         output_filepath=args.output
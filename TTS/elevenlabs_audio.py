@@ -4,11 +4,16 @@ import sys
 from elevenlabs.client import ElevenLabs
 from dotenv import load_dotenv
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.transport import read_payload
+from pipeline.workers import serve, serve_stdin
+
 load_dotenv()
 
 DEFAULT_VOICE_ID = "EXAVITQu4vr4xnSDxMaL"
 
-def synthesize_audio(text: str, voice_id: str, output_path: str, model_id: str = "eleven_multilingual_v2") -> None:
+def synthesize_audio(text: str, voice_id: str, output_path: str, model_id: str = "eleven_multilingual_v2",
+                     append: bool = False) -> None:
     api_key = os.getenv("ELEVENLABS_API_KEY")
     if not api_key:
         raise ValueError("ELEVENLABS_API_KEY environment variable is not set.")
@@ -24,7 +29,8 @@ def synthesize_audio(text: str, voice_id: str, output_path: str, model_id: str =
         )
 
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        with open(output_path, "wb") as f:
+        # MP3 frames can be concatenated, so streamed segments are appended as-is
+        with open(output_path, "ab" if append else "wb") as f:
             for chunk in audio_stream:
                 if chunk:
                     f.write(chunk)
@@ -33,13 +39,37 @@ def synthesize_audio(text: str, voice_id: str, output_path: str, model_id: str =
         raise RuntimeError(f"Failed to synthesize audio with ElevenLabs: {e}")
 
 
+def handle_job(job: dict) -> str:
+    synthesize_audio(
+        text=job["text"],
+        voice_id=job.get("voice_id") or DEFAULT_VOICE_ID,
+        output_path=job["output"],
+        append=job.get("append", False)
+    )
+    return job["output"]
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="ElevenLabs TTS audio generation.")
-    parser.add_argument('--text', required=True, help="The text to convert to speech.")
-    parser.add_argument('--output', required=True, help="The full path to the output .mp3 file.")
+    parser.add_argument('--text', help="The text to convert to speech.")
+    parser.add_argument('--text-from', help="Read the text from a payload spec ('-', 'file:<path>' or 'shm:<name>') instead.")
+    parser.add_argument('--output', help="The full path to the output .mp3 file.")
     parser.add_argument('--voice_id', default=DEFAULT_VOICE_ID, help="The ElevenLabs voice ID to use.")
+    parser.add_argument('--serve', action='store_true', help="Keep the client loaded and serve jobs from main.py.")
+    parser.add_argument('--serve-stdin', action='store_true', help="Serve jobs from main.py over stdin/stdout.")
     args = parser.parse_args()
 
+    if args.serve_stdin:
+        serve_stdin(handle_job)
+        sys.exit(0)
+    if args.serve:
+        serve("elevenlabs_v2", handle_job)
+        sys.exit(0)
+    if not (args.text or args.text_from) or not args.output:
+        parser.error("--text (or --text-from) and --output are required unless --serve is given.")
+    if args.text_from:
+        args.text = read_payload(args.text_from)
+
     try:
         synthesize_audio(
             text=args.text,
@@ -1,150 +1,646 @@
 import argparse
+import contextlib
+import hashlib
 import logging
 import os
+import queue
+import re
 import sys
 import subprocess
-from ocr.pdf_parser import analyze_and_save
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+from nlp.nlp_settings import LECTURE_CHUNK_CHARS, OLLAMA_NUM_CTX, TRANSITION_MAX_TOKENS
+from ocr.ocr_settings import CRAFT_SETTINGS, PDF_OCR_WORKERS, PDF_SETTINGS, TROCR_SETTINGS
+from ocr.pdf_parser import PAGE_SEPARATOR, analyze_and_save
+from pipeline.cache import StageCache, cache_key, file_digest
+from pipeline.chunking import SentenceChunker, strip_root_tags
+from pipeline.trace import REPORT_FILE_ENV, Trace, read_report_file
+from pipeline.transport import export_payload, prepare_result
+from pipeline.workers import (PipeWorker, SocketWorker, WorkerError, WorkerUnavailable, call_worker,
+                              worker_available)
 
-def main():
-    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
 
-    parser = argparse.ArgumentParser(description="Lecture Synthesizer: Convert document to lecture audio.")
-    parser.add_argument('--input', '-i', required=True, help="Path to the input file (PDF or image)")
-    parser.add_argument('--tts', '-t', required=True, choices=['chatterbox', 'elevenlabs_v2', 'dia'],
-                        help="TTS engine to use: 'chatterbox', 'elevenlabs_v2', or 'dia'")
-    args = parser.parse_args()
+OCR_VENV = '.venv_ocr_craft'
+OLLAMA_VENV = '.venv_ollama'
+TROCR_SCRIPT = os.path.join(PROJECT_ROOT, 'ocr', 'trocr_craft.py')
+GENERATE_LECTURE_SCRIPT = os.path.join(PROJECT_ROOT, 'nlp', 'nlp_model.py')
 
-    input_path = args.input
-    tts_engine = args.tts
+# engine -> (venv, script, display name)
+TTS_ENGINES = {
+    'chatterbox': ('.venv_chatter', os.path.join(PROJECT_ROOT, 'TTS', 'chatterbox_audio.py'), 'Chatterbox'),
+    'elevenlabs_v2': ('.venv_elevenlabs', os.path.join(PROJECT_ROOT, 'TTS', 'elevenlabs_audio.py'), 'ElevenLabs'),
+    'dia': ('.venv_dia', os.path.join(PROJECT_ROOT, 'TTS', 'Dia_audio.py'), 'DIA'),
+}
+# engines whose model is loaded on this host, and so worth prewarming
+LOCAL_TTS_ENGINES = ('chatterbox', 'dia')
 
-    if not os.path.isfile(input_path):
-        logging.error(f"Input file not found: {input_path}")
-        sys.exit(1)
+NLP_OUTPUT_DIR = os.path.join(PROJECT_ROOT, 'step_outputs', 'llm_outputs')
+FINAL_OUTPUT_DIR = os.path.join(PROJECT_ROOT, 'Final_Output')
+CACHE_DIR = os.path.join(PROJECT_ROOT, '.cache', 'stages')
+TRACE_OUTPUT_DIR = os.path.join(PROJECT_ROOT, 'step_outputs', 'traces')
+# how text reaches one-shot stage subprocesses: 'stdin', 'file' or 'shm'
+STAGE_TRANSPORT = os.getenv("LECTURE_SYNTH_TRANSPORT", "stdin")
 
-    ext = os.path.splitext(input_path)[1].lower()
-    is_pdf = ext == '.pdf'
-    is_image = ext in ['.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff', '.webp']
-    if not is_pdf and not is_image:
-        logging.error("Unsupported file type. Please provide a PDF or image file as input.")
-        sys.exit(1)
 
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    project_root = script_dir
+class PipelineError(RuntimeError):
+    pass
 
+
+def venv_python(venv: str) -> str:
     if sys.platform == "win32":
-        ocr_env_python = os.path.join(project_root, '.venv_ocr_craft', 'Scripts', 'python.exe')
-        ollama_env_python = os.path.join(project_root, '.venv_ollama', 'Scripts', 'python.exe')
-        chatter_env_python = os.path.join(project_root, '.venv_chatter', 'Scripts', 'python.exe')
-        elevenlabs_env_python = os.path.join(project_root, '.venv_elevenlabs', 'Scripts', 'python.exe')
-        dia_env_python = os.path.join(project_root, '.venv_dia', 'Scripts', 'python.exe')
-    else:
-        ocr_env_python = os.path.join(project_root, '.venv_ocr_craft', 'bin', 'python')
-        ollama_env_python = os.path.join(project_root, '.venv_ollama', 'bin', 'python')
-        chatter_env_python = os.path.join(project_root, '.venv_chatter', 'bin', 'python')
-        elevenlabs_env_python = os.path.join(project_root, '.venv_elevenlabs', 'bin', 'python')
-        dia_env_python = os.path.join(project_root, '.venv_dia', 'bin', 'python')
-
-    trocr_script = os.path.join(project_root, 'ocr', 'trocr_craft.py')
-    generate_lecture_script = os.path.join(project_root, 'nlp', 'nlp_model.py')
-    chatterbox_script = os.path.join(project_root, 'TTS', 'chatterbox_audio.py')
-    elevenlabs_script = os.path.join(project_root, 'TTS', 'elevenlabs_audio.py')
-    dia_script = os.path.join(project_root, 'TTS', 'Dia_audio.py')
-
-    nlp_output_dir = os.path.join(project_root, 'step_outputs', 'llm_outputs')
-    final_output_dir = os.path.join(project_root, 'Final_Output')
-    os.makedirs(nlp_output_dir, exist_ok=True)
-    os.makedirs(final_output_dir, exist_ok=True)
+        return os.path.join(PROJECT_ROOT, venv, 'Scripts', 'python.exe')
+    return os.path.join(PROJECT_ROOT, venv, 'bin', 'python')
 
-    logging.info(f"Processing input file: {input_path}")
-    text_content = ""
 
-    if is_pdf:
-        logging.info("Input is a PDF. Extracting text using PDF parser...")
+def stage_python(venv: str, script: str, label: str) -> str:
+    python_exe = venv_python(venv)
+    if not os.path.exists(python_exe):
+        raise PipelineError(f"{label} Python executable not found at '{python_exe}'. Please ensure {venv} is set up.")
+    if not os.path.exists(script):
+        raise PipelineError(f"{label} script not found at '{script}'. Please ensure {os.path.basename(script)} exists.")
+    return python_exe
+
+
+def open_stage(worker_name: str, venv: str, script: str, label: str, env: Optional[dict] = None):
+    """
+    Returns a client that can take several jobs: the warm worker if one is
+    listening, otherwise a stage process kept alive over stdin/stdout (`env`
+    adds environment variables for it).
+    """
+    if worker_available(worker_name):
+        logging.info(f"{label} handled by warm '{worker_name}' worker.")
+        return SocketWorker(worker_name)
+    return PipeWorker([stage_python(venv, script, label), script], worker_name, env)
+
+
+class PrewarmedStage:
+    """
+    A stage client opened once a document is known to need the models (a
+    cache miss). A {"prewarm": True, ...} job is sent on a background
+    thread so the model loads while OCR runs: Ollama loads the LLM and
+    keeps it resident, a local TTS process loads its model at start-up.
+    client() waits for the warm-up and returns the client for the real
+    jobs; the stage keeps owning it until close().
+    """
+
+    def __init__(self, worker_name: str, venv: str, script: str, label: str, job: dict):
+        self.label = label
+        self.record = {}
+        self._client = open_stage(worker_name, venv, script, label)
+        self._thread = threading.Thread(target=self._prewarm, args=({**job, "prewarm": True},), daemon=True)
+        self._thread.start()
+
+    def _prewarm(self, job: dict) -> None:
+        started = time.time()
         try:
-            text_content = analyze_and_save(input_path)
-        except Exception as e:
-            logging.error(f"Failed to extract text from PDF: {e}")
-            sys.exit(1)
-    elif is_image:
-        logging.info("Input is an image. Extracting text using OCR (TrOCR + CRAFT)...")
-        if not os.path.exists(ocr_env_python):
-            logging.error(f"OCR Python executable not found at '{ocr_env_python}'. Please ensure .venv_trocr is set up.")
-            sys.exit(1)
-        if not os.path.exists(trocr_script):
-            logging.error(f"OCR script not found at '{trocr_script}'. Please ensure trocr_craft.py exists.")
-            sys.exit(1)
+            self._client.call(job, self.record.setdefault("process", {}))
+        except (WorkerError, WorkerUnavailable) as e:
+            # the real job will report the failure (or fall back) if it persists
+            self.record["error"] = str(e)
+            logging.warning(f"{self.label} prewarm failed: {e}")
+        self.record["wall_s"] = round(time.time() - started, 4)
+
+    def client(self):
+        self._thread.join()
+        return self._client
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            # never used (e.g. the rest came from the cache or a stage
+            # failed): stop the load instead of waiting for it
+            self.record["terminated"] = True
+            self._client.terminate()
+        else:
+            self._client.close()
+
+
+def prewarm_stages(ollama_model_name: str, tts_engine: str) -> dict:
+    """Starts warming up the LLM stage and, for local engines, the TTS stage."""
+    stages = [("llm", "llm", OLLAMA_VENV, GENERATE_LECTURE_SCRIPT, "NLP", {"model": ollama_model_name})]
+    if tts_engine in LOCAL_TTS_ENGINES:
+        venv, script, label = TTS_ENGINES[tts_engine]
+        stages.append(("tts", tts_engine, venv, script, f"{label} TTS", {}))
+
+    prewarmed = {}
+    for stage, worker_name, venv, script, label, job in stages:
+        try:
+            prewarmed[stage] = PrewarmedStage(worker_name, venv, script, label, job)
+        except PipelineError as e:
+            logging.warning(f"{label} prewarm skipped: {e}")
+    return prewarmed
+
+
+def call_stage(client, job: dict, label: str, trace: dict, fallback: Callable[[], str]) -> str:
+    """
+    Runs a job on an already opened stage client (see PrewarmedStage). If
+    the client's warm worker has stopped since, `fallback` runs the job
+    instead (run_stage, i.e. a one-shot subprocess).
+    """
+    process_report = {}
+    trace.update({"runner": "prewarmed", "process": process_report})
+    try:
+        return client.call(job, process_report)
+    except WorkerUnavailable as e:
+        logging.warning(f"{label} worker is gone ({e}); running the stage in a subprocess.")
+        return fallback()
+    except WorkerError as e:
+        raise PipelineError(f"{label} failed: {e}")
+
+
+def run_stage(worker_name: str, job: dict, venv: str, script: str, args: list, label: str,
+              payload: Optional[str] = None, wants_result: bool = True, trace: Optional[dict] = None,
+              env: Optional[dict] = None) -> str:
+    """
+    Runs a stage on its warm worker if one is listening, otherwise falls back
+    to a one-shot subprocess in the stage's virtual environment. In the
+    subprocess case, `payload` is handed over with --text-from and the text
+    result comes back through --result-to, using STAGE_TRANSPORT. If `trace`
+    is given, it receives the runner used and the stage process's report.
+    `env` adds environment variables for the subprocess.
+    """
+    trace = {} if trace is None else trace
+    try:
+        process_report = {}
+        trace.update({"runner": "worker", "process": process_report})
+        result = call_worker(worker_name, job, process_report)
+        logging.info(f"{label} handled by warm '{worker_name}' worker.")
+        return result
+    except WorkerUnavailable:
+        pass
+    except WorkerError as e:
+        raise PipelineError(f"{label} worker failed: {e}")
+
+    python_exe = stage_python(venv, script, label)
+    report_fd, report_path = tempfile.mkstemp(prefix="lecture-synth-", suffix=".trace.json")
+    os.close(report_fd)
+    cleanups = [lambda: os.path.exists(report_path) and os.remove(report_path)]
+    stdin_data = None
+    trace.update({"runner": "subprocess", "process": {}})
+    try:
+        if payload is not None:
+            spec, stdin_data, cleanup = export_payload(payload, STAGE_TRANSPORT)
+            cleanups.append(cleanup)
+            args = ["--text-from", spec] + args
+        if wants_result:
+            result_spec, collect, cleanup = prepare_result(STAGE_TRANSPORT)
+            cleanups.append(cleanup)
+            args = ["--result-to", result_spec] + args
+
         try:
             result = subprocess.run(
-                [ocr_env_python, trocr_script, input_path],
+                [python_exe, script] + args,
+                input=stdin_data,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
-                text=True,
+                env={**os.environ, **(env or {}), REPORT_FILE_ENV: report_path},
                 check=True
             )
-            text_content = result.stdout.strip()
-            if result.stderr:
-                logging.info(f"OCR Subprocess Stderr: {result.stderr.strip()}")
         except FileNotFoundError as e:
-            logging.error(f"OCR execution failed: {e}. Ensure OCR virtual environment and script exist.")
-            sys.exit(1)
+            raise PipelineError(f"{label} execution failed: {e}. Ensure the virtual environment and script exist.")
         except subprocess.CalledProcessError as e:
-            logging.error(f"OCR script returned error code {e.returncode}. Stderr: {e.stderr.strip()}")
-            sys.exit(1)
+            stderr = e.stderr.decode("utf-8", errors="replace").strip()
+            raise PipelineError(f"{label} script returned error code {e.returncode}. Stderr: {stderr}")
+
+        stderr = result.stderr.decode("utf-8", errors="replace").strip()
+        if stderr:
+            logging.info(f"{label} Subprocess Stderr: {stderr}")
+        if not wants_result:
+            return result.stdout.decode("utf-8", errors="replace").strip()
+        try:
+            return collect(result.stdout).strip()
+        except (OSError, ValueError) as e:
+            raise PipelineError(f"{label} script did not return a result: {e}")
+    finally:
+        trace["process"] = read_report_file(report_path)
+        for cleanup in cleanups:
+            cleanup()
+
+
+class PdfPageOcr:
+    """
+    Rasterizes PDF pages (0-based) in the OCR stage and returns their text.
+    Each calling thread (analyze_and_save runs up to PDF_OCR_WORKERS) opens
+    one stage client and keeps it for every page it gets, so CRAFT and
+    TrOCR load once per slot rather than once per page. `traces` receives
+    a record per 1-based page number.
+    """
+
+    def __init__(self, pdf_path: str, traces: dict):
+        self.pdf_path = os.path.abspath(pdf_path)
+        self.traces = traces
+        self._local = threading.local()
+        self._clients = []
+        self._lock = threading.Lock()
+
+    def _client(self):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            # slots run in parallel processes: split the cores between them
+            threads = max(1, (os.cpu_count() or 1) // PDF_OCR_WORKERS)
+            client = open_stage("ocr", OCR_VENV, TROCR_SCRIPT, "OCR", env={"OMP_NUM_THREADS": str(threads)})
+            self._local.client = client
+            with self._lock:
+                self._clients.append(client)
+        return client
+
+    def __call__(self, page: int) -> str:
+        trace = self.traces.setdefault(page + 1, {})
+        job = {"pdf_path": self.pdf_path, "page": page, "dpi": PDF_SETTINGS["ocr_dpi"]}
+        try:
+            try:
+                return self._call(job, trace)
+            except WorkerUnavailable:
+                # the warm worker stopped: reopen, i.e. start a stage process
+                self._local.client = None
+                return self._call(job, trace)
+        except (WorkerError, WorkerUnavailable) as e:
+            raise PipelineError(f"OCR (page {page + 1}) failed: {e}")
+
+    def _call(self, job: dict, trace: dict) -> str:
+        client = self._client()
+        process_report = {}
+        trace.update({"runner": "worker" if isinstance(client, SocketWorker) else "pipe", "process": process_report})
+        return client.call(job, process_report).strip()
+
+    def close(self) -> None:
+        for client in self._clients:
+            client.close()
+
+
+def extract_text(input_path: str, is_pdf: bool, cache: Optional[StageCache] = None,
+                 trace: Optional[dict] = None, on_miss: Optional[Callable[[], None]] = None) -> str:
+    """Returns the document's text. `on_miss` is called before extraction runs (cache miss)."""
+    trace = {} if trace is None else trace
+    if cache is not None:
+        # scanned pages of a PDF go through OCR, so its settings count too
+        settings = {"craft": CRAFT_SETTINGS, "trocr": TROCR_SETTINGS}
+        if is_pdf:
+            settings = {"parser": "PyPDF2", "page_separator": PAGE_SEPARATOR, "pdf": PDF_SETTINGS, **settings}
+        key = cache_key("ocr", file_digest(input_path), settings)
+        cached = cache.get_text("ocr", key)
+        if cached is not None:
+            logging.info("Extracted text found in stage cache. Skipping text extraction.")
+            trace["runner"] = "cache"
+            return cached
+
+    if on_miss is not None:
+        on_miss()
+
+    if is_pdf:
+        logging.info("Input is a PDF. Extracting text using PDF parser, OCR for pages without a text layer...")
+        page_traces = {}
+        trace["ocr_pages"] = page_traces
+        ocr_page = PdfPageOcr(input_path, page_traces)
+        try:
+            text_content = analyze_and_save(input_path, ocr_page=ocr_page, ocr_workers=PDF_OCR_WORKERS)
         except Exception as e:
-            logging.error(f"An unexpected error occurred during OCR subprocess execution: {e}")
-            sys.exit(1)
+            raise PipelineError(f"Failed to extract text from PDF: {e}")
+        finally:
+            ocr_page.close()
     else:
-        logging.error("Unknown input file type.")
-        sys.exit(1)
+        logging.info("Input is an image. Extracting text using OCR (TrOCR + CRAFT)...")
+        text_content = run_stage(
+            "ocr",
+            {"image_path": os.path.abspath(input_path)},
+            OCR_VENV,
+            TROCR_SCRIPT,
+            [input_path],
+            "OCR",
+            trace=trace,
+        )
+
+    if cache is not None and text_content:
+        cache.put_text("ocr", key, text_content)
+    return text_content
+
+
+def lecture_cache_key(text_content: str, ollama_model_name: str, system_prompt_type: str) -> str:
+    # how the notes are split into sections changes the script too
+    settings = {"num_ctx": OLLAMA_NUM_CTX, "chunk_chars": LECTURE_CHUNK_CHARS, "transition_tokens": TRANSITION_MAX_TOKENS}
+    return cache_key("lecture", text_content, ollama_model_name, system_prompt_type, settings)
+
+
+def audio_cache_key(lecture_script: str, tts_engine: str, voice_id: Optional[str]) -> str:
+    if tts_engine != 'elevenlabs_v2':
+        voice_id = None
+    return cache_key("audio", lecture_script, tts_engine, voice_id)
+
+
+def generate_lecture(text_content: str, ollama_model_name: str, system_prompt_type: str,
+                     cache: Optional[StageCache] = None, trace: Optional[dict] = None, llm=None) -> str:
+    trace = {} if trace is None else trace
+    if cache is not None:
+        key = lecture_cache_key(text_content, ollama_model_name, system_prompt_type)
+        cached = cache.get_text("lecture", key)
+        if cached is not None:
+            logging.info("Lecture script found in stage cache. Skipping the Ollama call.")
+            trace["runner"] = "cache"
+            return cached
+
+    job = {"notes": text_content, "model": ollama_model_name, "prompt_type": system_prompt_type}
+
+    def run() -> str:
+        return run_stage(
+            "llm",
+            job,
+            OLLAMA_VENV,
+            GENERATE_LECTURE_SCRIPT,
+            [ollama_model_name, system_prompt_type],
+            "NLP",
+            payload=text_content,
+            trace=trace,
+        )
+
+    lecture_script = (call_stage(llm, job, "NLP", trace, run) if llm is not None else run()).strip()
+
+    if "[ERROR]" in lecture_script:
+        raise PipelineError(f"Lecture generation failed: {lecture_script}")
+
+    if cache is not None:
+        cache.put_text("lecture", key, lecture_script)
+    return lecture_script
+
+
+def synthesize_speech(lecture_script: str, tts_engine: str, final_audio_path: str,
+                      voice_id: Optional[str] = None, cache: Optional[StageCache] = None,
+                      trace: Optional[dict] = None, tts=None) -> None:
+    trace = {} if trace is None else trace
+    if tts_engine not in TTS_ENGINES:
+        raise PipelineError(f"Unknown TTS engine: {tts_engine}")
+
+    audio_suffix = os.path.splitext(final_audio_path)[1]
+    if cache is not None:
+        key = audio_cache_key(lecture_script, tts_engine, voice_id)
+        if cache.get_file("audio", key, final_audio_path, audio_suffix):
+            logging.info("Lecture audio found in stage cache. Skipping speech synthesis.")
+            trace["runner"] = "cache"
+            return
+
+    venv, script, label = TTS_ENGINES[tts_engine]
+    job = {"text": lecture_script, "output": final_audio_path}
+    args = ["--output", final_audio_path]
+    if voice_id and tts_engine == 'elevenlabs_v2':
+        job["voice_id"] = voice_id
+        args += ["--voice_id", voice_id]
+
+    def run() -> str:
+        return run_stage(tts_engine, job, venv, script, args, f"{label} TTS", payload=lecture_script,
+                         wants_result=False, trace=trace)
+
+    if tts is not None:
+        call_stage(tts, job, f"{label} TTS", trace, run)
+    else:
+        run()
+
+    if not os.path.isfile(final_audio_path):
+        raise PipelineError("TTS process completed, but no audio file was found.")
+
+    if cache is not None:
+        cache.put_file("audio", key, final_audio_path, audio_suffix)
+
+
+def prepare_tts_chunk(chunk: str, tts_engine: str) -> str:
+    text = strip_root_tags(chunk)
+    if tts_engine == 'elevenlabs_v2':
+        return f"<speak>{text}</speak>"
+    if tts_engine == 'dia' and not re.match(r"\[S\d\]", text):
+        return f"[S1] {text}"
+    return text
+
+
+def stream_lecture_to_speech(text_content: str, ollama_model_name: str, system_prompt_type: str,
+                             tts_engine: str, final_audio_path: str, voice_id: Optional[str] = None,
+                             cache: Optional[StageCache] = None, trace: Optional[dict] = None,
+                             llm=None, tts=None) -> str:
+    """
+    Streams the lecture script from Ollama and synthesizes it sentence by
+    sentence while generation continues, appending each segment to the
+    output file in order. Returns the full lecture script. `llm` and `tts`
+    are already opened clients to use (and leave open) instead of opening
+    the stages here.
+    """
+    trace = {} if trace is None else trace
+    if tts_engine not in TTS_ENGINES:
+        raise PipelineError(f"Unknown TTS engine: {tts_engine}")
+
+    venv, script, label = TTS_ENGINES[tts_engine]
+    opened = []
+    if llm is None:
+        llm = open_stage("llm", OLLAMA_VENV, GENERATE_LECTURE_SCRIPT, "NLP")
+        opened.append(llm)
+    if tts is None:
+        try:
+            tts = open_stage(tts_engine, venv, script, f"{label} TTS")
+        except PipelineError:
+            for client in opened:
+                client.close()
+            raise
+        opened.append(tts)
+
+    if os.path.exists(final_audio_path):
+        os.remove(final_audio_path)
+
+    started = time.time()
+    segments = queue.Queue()
+    tts_errors = []
+    llm_report = {}
+    tts_reports = []
+    trace.update({"runner": "stream", "process": {"llm": llm_report, "tts_segments": tts_reports}})
+
+    def reopen(worker_name: str, venv: str, script: str, label: str):
+        # the warm worker stopped before taking a job: carry on with a stage
+        # process (or a restarted worker)
+        logging.warning(f"{label} worker is gone; reopening the stage.")
+        client = open_stage(worker_name, venv, script, label)
+        opened.append(client)
+        return client
+
+    def llm_tokens(job: dict):
+        nonlocal llm
+        try:
+            yield from llm.stream(job, llm_report)
+        except WorkerUnavailable:
+            # raised on connecting, before any token
+            llm = reopen("llm", OLLAMA_VENV, GENERATE_LECTURE_SCRIPT, "NLP")
+            yield from llm.stream(job, llm_report)
+
+    def synthesize_segments():
+        nonlocal tts
+        segment_count = 0
+        while True:
+            chunk = segments.get()
+            if chunk is None:
+                return
+            if tts_errors:
+                continue
+            job = {"text": prepare_tts_chunk(chunk, tts_engine), "output": final_audio_path, "append": True}
+            if voice_id and tts_engine == 'elevenlabs_v2':
+                job["voice_id"] = voice_id
+            segment_report = {}
+            tts_reports.append(segment_report)
+            try:
+                try:
+                    tts.call(job, segment_report)
+                except WorkerUnavailable:
+                    tts = reopen(tts_engine, venv, script, f"{label} TTS")
+                    tts.call(job, segment_report)
+            except (WorkerError, WorkerUnavailable, PipelineError) as e:
+                tts_errors.append(e)
+                continue
+            segment_count += 1
+            if segment_count == 1:
+                trace["first_audio_s"] = round(time.time() - started, 4)
+                logging.info(f"First audio segment written after {time.time() - started:.1f}s.")
+
+    synthesizer = threading.Thread(target=synthesize_segments, daemon=True)
+    synthesizer.start()
+
+    chunker = SentenceChunker()
+    tokens = []
+    try:
+        job = {"notes": text_content, "model": ollama_model_name, "prompt_type": system_prompt_type, "stream": True}
+        for token in llm_tokens(job):
+            tokens.append(token)
+            for chunk in chunker.feed(token):
+                segments.put(chunk)
+            if tts_errors:
+                break
+        for chunk in chunker.flush():
+            segments.put(chunk)
+    except WorkerError as e:
+        raise PipelineError(f"Lecture generation failed: {e}")
+    finally:
+        segments.put(None)
+        synthesizer.join()
+        for client in opened:
+            client.close()
+
+    if tts_errors:
+        raise PipelineError(f"{label} TTS failed: {tts_errors[0]}")
+    if not os.path.isfile(final_audio_path):
+        raise PipelineError("TTS process completed, but no audio file was found.")
+
+    lecture_script = "".join(tokens).strip()
+    if cache is not None:
+        cache.put_text("lecture", lecture_cache_key(text_content, ollama_model_name, system_prompt_type),
+                       lecture_script)
+        cache.put_file("audio", audio_cache_key(lecture_script, tts_engine, voice_id), final_audio_path,
+                       os.path.splitext(final_audio_path)[1])
+    return lecture_script
+
+
+SUPPORTED_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff', '.webp', '.pdf']
+OLLAMA_MODEL_NAME = "llama3:8b"
+
+
+def process_document(input_path: str, tts_engine: str, voice_id: Optional[str] = None,
+                     cache: Optional[StageCache] = None, stream: bool = False,
+                     stage_slots: Optional[dict] = None, trace_dir: Optional[str] = TRACE_OUTPUT_DIR,
+                     prewarm: bool = True, output_name: Optional[str] = None) -> str:
+    """
+    Runs one document through PDF parsing/OCR, lecture generation and TTS and
+    returns the path of the final audio. `stage_slots` maps "ocr", "llm" and
+    "tts" to semaphores bounding how many documents may be in each stage at
+    once (batch mode); without it every stage runs unbounded. With `prewarm`,
+    the LLM and local TTS models are loaded while OCR runs. A JSON trace
+    of per-stage timings and resource usage is written to `trace_dir`.
+    The audio, lecture script and trace files are named after `output_name`
+    (default: the input's file name without its extension).
+    """
+    trace = Trace(input=input_path, tts_engine=tts_engine, stream=stream)
+    base_name = output_name or os.path.splitext(os.path.basename(input_path))[0]
+    prewarmed = {}
+    try:
+        return _process_document(input_path, tts_engine, voice_id, cache, stream, stage_slots or {}, trace,
+                                 base_name, prewarmed if prewarm else None)
+    finally:
+        for stage in prewarmed.values():
+            stage.close()
+        if prewarmed:
+            trace.meta["prewarm"] = {name: stage.record for name, stage in prewarmed.items()}
+        if trace_dir:
+            trace_path = os.path.join(trace_dir, f"{base_name}_{tts_engine}.json")
+            try:
+                trace.write(trace_path)
+            except OSError as e:
+                logging.error(f"Failed to write trace to {trace_path}: {e}")
+            else:
+                logging.info(f"Stage trace saved to {trace_path}")
+
+
+def _process_document(input_path: str, tts_engine: str, voice_id: Optional[str], cache: Optional[StageCache],
+                      stream: bool, slots: dict, trace: Trace, base_name: str,
+                      prewarmed: Optional[dict] = None) -> str:
+    def slot(stage: str):
+        return slots.get(stage) or contextlib.nullcontext()
+
+    def prewarmed_client(stage: str):
+        return prewarmed[stage].client() if prewarmed and stage in prewarmed else None
+
+    prewarm_started = False
+
+    def start_prewarm():
+        # only once the models are needed (OCR or lecture cache miss); loads
+        # overlap with OCR and are closed by process_document
+        nonlocal prewarm_started
+        if prewarmed is not None and not prewarm_started:
+            prewarm_started = True
+            prewarmed.update(prewarm_stages(OLLAMA_MODEL_NAME, tts_engine))
+
+    if not os.path.isfile(input_path):
+        raise PipelineError(f"Input file not found: {input_path}")
+
+    ext = os.path.splitext(input_path)[1].lower()
+    if ext not in SUPPORTED_EXTENSIONS:
+        raise PipelineError("Unsupported file type. Please provide a PDF or image file as input.")
+    is_pdf = ext == '.pdf'
+
+    logging.info(f"Processing input file: {input_path}")
+    with slot("ocr"), trace.stage("pdf_parse" if is_pdf else "ocr") as record:
+        text_content = extract_text(input_path, is_pdf, cache, record, start_prewarm)
 
     if not text_content:
-        logging.error("No text was extracted from the input file. Exiting.")
-        sys.exit(1)
+        raise PipelineError("No text was extracted from the input file. Exiting.")
 
     logging.info(f"Extracted text length: {len(text_content)} characters.")
 
-    logging.info("Generating lecture script using NLP model (Ollama llama3:8b)...")
-    ollama_model_name = "llama3:8b"
+    logging.info(f"Generating lecture script using NLP model (Ollama {OLLAMA_MODEL_NAME})...")
+    ollama_model_name = OLLAMA_MODEL_NAME
     system_prompt_type = tts_engine
-    
-    if not os.path.exists(ollama_env_python):
-        logging.error(f"Ollama client Python executable not found at '{ollama_env_python}'. Please ensure .venv_ollama is set up.")
-        sys.exit(1)
-    if not os.path.exists(generate_lecture_script):
-        logging.error(f"Lecture generation script not found at '{generate_lecture_script}'. Please ensure generate_lecture.py exists.")
-        sys.exit(1)
 
-    try:
-        result = subprocess.run(
-            [ollama_env_python, generate_lecture_script, text_content, ollama_model_name, system_prompt_type],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            check=True
-        )
-        lecture_script = result.stdout.strip()
-        if result.stderr:
-            logging.info(f"NLP Subprocess Stderr: {result.stderr.strip()}")
+    final_ext = 'mp3' if tts_engine == 'elevenlabs_v2' else 'wav'
+    final_audio_filename = f"{base_name}_{tts_engine}.{final_ext}"
+    final_audio_path = os.path.join(FINAL_OUTPUT_DIR, final_audio_filename)
+
+    # generate_lecture reads the script itself; this only decides on the prewarm
+    lecture_cached = (
+        cache is not None
+        and cache.has_text("lecture", lecture_cache_key(text_content, ollama_model_name, system_prompt_type))
+    )
+    if not lecture_cached:
+        start_prewarm()
+    # a cached script is already complete, so there is nothing to overlap with
+    streamed = stream and not lecture_cached
+
+    if streamed:
+        logging.info(f"Streaming lecture script into speech synthesis with TTS engine: {tts_engine}")
+        with slot("llm"), slot("tts"), trace.stage("llm+tts") as record:
+            lecture_script = stream_lecture_to_speech(text_content, ollama_model_name, system_prompt_type,
+                                                      tts_engine, final_audio_path, voice_id, cache, record,
+                                                      prewarmed_client("llm"), prewarmed_client("tts"))
+    else:
+        with slot("llm"), trace.stage("llm") as record:
+            lecture_script = generate_lecture(text_content, ollama_model_name, system_prompt_type, cache, record,
+                                              prewarmed_client("llm"))
 
-        if "[ERROR]" in lecture_script:
-            logging.error(f"Lecture generation failed: {lecture_script}")
-            sys.exit(1)
-            
-    except FileNotFoundError as e:
-        logging.error(f"NLP model generation failed: {e}. Ensure Ollama client virtual environment and script exist.")
-        sys.exit(1)
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Ollama script returned error code {e.returncode}. Stderr: {e.stderr.strip()}")
-        sys.exit(1)
-    except Exception as e:
-        logging.error(f"An unexpected error occurred during NLP model generation: {e}")
-        sys.exit(1)
-    
     logging.info("Lecture script generation completed.")
 
-    base_name = os.path.splitext(os.path.basename(input_path))[0]
     lecture_text_filename = f"{base_name}_{ollama_model_name.replace(':', '-')}_{tts_engine}.txt"
-    lecture_text_path = os.path.join(nlp_output_dir, lecture_text_filename)
+    lecture_text_path = os.path.join(NLP_OUTPUT_DIR, lecture_text_filename)
     try:
         with open(lecture_text_path, 'w', encoding='utf-8') as f:
             f.write(lecture_script)
@@ -153,62 +649,172 @@ def main():
     else:
         logging.info(f"Lecture script saved to {lecture_text_path}")
 
-    final_ext = 'mp3' if tts_engine == 'elevenlabs_v2' else 'wav'
-    final_audio_filename = f"{base_name}_{tts_engine}.{final_ext}"
-    final_audio_path = os.path.join(final_output_dir, final_audio_filename)
-    logging.info(f"Converting lecture script to speech using TTS engine: {tts_engine}")
+    if not streamed:
+        logging.info(f"Converting lecture script to speech using TTS engine: {tts_engine}")
+        with slot("tts"), trace.stage("tts") as record:
+            synthesize_speech(lecture_script, tts_engine, final_audio_path, voice_id, cache, record,
+                              prewarmed_client("tts"))
 
-    try:
-        if tts_engine == 'chatterbox':
-            if not os.path.exists(chatter_env_python):
-                logging.error(f"Chatterbox Python executable not found at '{chatter_env_python}'. Please ensure .venv_chatter is set up.")
-                sys.exit(1)
-            if not os.path.exists(chatterbox_script):
-                logging.error(f"Chatterbox script not found at '{chatterbox_script}'. Please ensure chatterbox_audio.py exists.")
-                sys.exit(1)
-            cmd = [chatter_env_python, chatterbox_script, "--text", lecture_script, "--output", final_audio_path]
-            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
-            if result.stderr:
-                logging.info(f"Chatterbox TTS Subprocess Stderr: {result.stderr.strip()}")
-        elif tts_engine == 'elevenlabs_v2':
-            if not os.path.exists(elevenlabs_env_python):
-                logging.error(f"ElevenLabs Python executable not found at '{elevenlabs_env_python}'. Please ensure .venv_elevenlabs is set up.")
-                sys.exit(1)
-            if not os.path.exists(elevenlabs_script):
-                logging.error(f"ElevenLabs script not found at '{elevenlabs_script}'. Please ensure elevenlabs_audio.py exists.")
-                sys.exit(1)
-            cmd = [elevenlabs_env_python, elevenlabs_script, "--text", lecture_script, "--output", final_audio_path]
-            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
-            if result.stderr:
-                logging.info(f"ElevenLabs TTS Subprocess Stderr: {result.stderr.strip()}")
-        elif tts_engine == 'dia':
-            if not os.path.exists(dia_env_python):
-                logging.error(f"DIA Python executable not found at '{dia_env_python}'. Please ensure .venv_dia is set up.")
-                sys.exit(1)
-            if not os.path.exists(dia_script):
-                logging.error(f"DIA script not found at '{dia_script}'. Please ensure dia_audio.py exists.")
-                sys.exit(1)
-            cmd = [dia_env_python, dia_script, "--text", lecture_script, "--output", final_audio_path]
-            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
-            if result.stderr:
-                logging.info(f"DIA TTS Subprocess Stderr: {result.stderr.strip()}")
+    logging.info(f"Audio output saved to {final_audio_path}")
+    return final_audio_path
+
+
+def collect_batch_inputs(batch_path: str) -> list:
+    """
+    Lists the documents of a batch: every supported file in a directory
+    (sorted by name), or the paths in a manifest file, one per line, relative
+    to the manifest. Blank lines and lines starting with '#' are skipped.
+    """
+    if os.path.isdir(batch_path):
+        return [
+            os.path.join(batch_path, name)
+            for name in sorted(os.listdir(batch_path))
+            if os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS
+            and os.path.isfile(os.path.join(batch_path, name))
+        ]
+
+    if not os.path.isfile(batch_path):
+        raise PipelineError(f"Batch directory or manifest not found: {batch_path}")
+
+    manifest_dir = os.path.dirname(os.path.abspath(batch_path))
+    inputs = []
+    seen = set()
+    with open(batch_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                path = line if os.path.isabs(line) else os.path.join(manifest_dir, line)
+                # the same document twice would write the same output files at once
+                if os.path.normcase(os.path.abspath(path)) in seen:
+                    logging.warning(f"Skipping duplicate batch input: {line}")
+                    continue
+                seen.add(os.path.normcase(os.path.abspath(path)))
+                inputs.append(path)
+    return inputs
+
+
+def batch_output_names(inputs: list) -> list:
+    """
+    Output names for the documents of a batch: the file name without its
+    extension, plus a short hash of the path for names shared by several
+    inputs (e.g. week1/notes.pdf and week2/notes.pdf), so their audio,
+    lecture and trace files don't overwrite each other.
+    """
+    base_names = [os.path.splitext(os.path.basename(path))[0] for path in inputs]
+    names = []
+    for path, base_name in zip(inputs, base_names):
+        if base_names.count(base_name) > 1:
+            path_hash = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:8]
+            base_name = f"{base_name}-{path_hash}"
+        names.append(base_name)
+    return names
+
+
+def run_batch(inputs: list, tts_engine: str, stage_workers: dict, voice_id: Optional[str] = None,
+              cache: Optional[StageCache] = None, stream: bool = False,
+              trace_dir: Optional[str] = TRACE_OUTPUT_DIR, prewarm: bool = False) -> list:
+    """
+    Pipelines documents across stages: each stage admits at most
+    stage_workers[stage] documents at once, so while one document is in TTS
+    the next ones can be in the LLM and OCR stages. Returns one
+    (input_path, audio_path, error, seconds) tuple per document, in input order.
+    Prewarming is off by default here: every document in flight would start
+    its own TTS process.
+    """
+    stage_slots = {stage: threading.BoundedSemaphore(count) for stage, count in stage_workers.items()}
+
+    def run_one(input_path: str, output_name: str):
+        started = time.time()
+        try:
+            audio_path = process_document(input_path, tts_engine, voice_id, cache, stream, stage_slots, trace_dir,
+                                          prewarm, output_name)
+        except PipelineError as e:
+            logging.error(f"{input_path}: {e}")
+            return input_path, None, str(e), time.time() - started
+        except Exception as e:
+            logging.error(f"{input_path}: unexpected error: {e}")
+            return input_path, None, f"Unexpected error: {e}", time.time() - started
+        return input_path, audio_path, None, time.time() - started
+
+    # enough threads to keep every stage busy; the semaphores do the bounding
+    with ThreadPoolExecutor(max_workers=sum(stage_workers.values())) as executor:
+        return list(executor.map(run_one, inputs, batch_output_names(inputs)))
+
+
+def log_batch_summary(results: list) -> None:
+    succeeded = [r for r in results if r[2] is None]
+    logging.info(f"Batch summary: {len(succeeded)}/{len(results)} documents succeeded.")
+    for input_path, audio_path, error, seconds in results:
+        if error is None:
+            logging.info(f"  OK     {input_path} -> {audio_path} ({seconds:.1f}s)")
         else:
-            logging.error(f"Unknown TTS engine: {tts_engine}")
+            logging.info(f"  FAILED {input_path} ({seconds:.1f}s): {error}")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+
+    parser = argparse.ArgumentParser(description="Lecture Synthesizer: Convert document to lecture audio.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--input', '-i', help="Path to the input file (PDF or image)")
+    source.add_argument('--batch', '-b',
+                        help="Directory of input files, or a manifest listing one input path per line")
+    parser.add_argument('--tts', '-t', required=True, choices=['chatterbox', 'elevenlabs_v2', 'dia'],
+                        help="TTS engine to use: 'chatterbox', 'elevenlabs_v2', or 'dia'")
+    parser.add_argument('--voice-id', default=None,
+                        help="Voice ID for the TTS engine (ElevenLabs only; defaults to the engine's voice)")
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help="Directory of the stage cache")
+    parser.add_argument('--cache-size-mb', type=int, default=2048,
+                        help="Maximum size of the stage cache before least recently used entries are evicted")
+    parser.add_argument('--no-cache', action='store_true', help="Run every stage without consulting the cache")
+    parser.add_argument('--stream', action='store_true',
+                        help="Synthesize the lecture sentence by sentence while the LLM is still generating it")
+    parser.add_argument('--trace-dir', default=TRACE_OUTPUT_DIR,
+                        help="Directory for the per-document JSON stage traces")
+    parser.add_argument('--no-prewarm', action='store_true',
+                        help="Don't load the LLM and local TTS models while OCR runs (always off in batch mode)")
+    parser.add_argument('--ollama-keep-alive', default=None,
+                        help="How long Ollama keeps the model loaded, e.g. '30m', '3600' (seconds) or '-1' "
+                             "(forever); sets OLLAMA_KEEP_ALIVE for the LLM stage")
+    parser.add_argument('--ocr-workers', type=int, default=1, help="Batch mode: documents in OCR at once")
+    parser.add_argument('--llm-workers', type=int, default=1, help="Batch mode: documents in the LLM at once")
+    parser.add_argument('--tts-workers', type=int, default=1, help="Batch mode: documents in TTS at once")
+    args = parser.parse_args()
+
+    if min(args.ocr_workers, args.llm_workers, args.tts_workers) < 1:
+        parser.error("--ocr-workers, --llm-workers and --tts-workers must be at least 1.")
+
+    if args.ollama_keep_alive is not None:
+        # inherited by the LLM stage processes; warm workers read it at their own start
+        os.environ["OLLAMA_KEEP_ALIVE"] = args.ollama_keep_alive
+
+    os.makedirs(NLP_OUTPUT_DIR, exist_ok=True)
+    os.makedirs(FINAL_OUTPUT_DIR, exist_ok=True)
+    cache = None if args.no_cache else StageCache(args.cache_dir, args.cache_size_mb * 1024 * 1024)
+
+    if args.batch:
+        try:
+            inputs = collect_batch_inputs(args.batch)
+        except PipelineError as e:
+            logging.error(str(e))
+            sys.exit(1)
+        if not inputs:
+            logging.error(f"No input files found in batch: {args.batch}")
             sys.exit(1)
-    except FileNotFoundError as e:
-        logging.error(f"TTS execution failed: {e}. Ensure the correct virtual environment and TTS script exist.")
-        sys.exit(1)
-    except subprocess.CalledProcessError as e:
-        logging.error(f"TTS script returned error code {e.returncode}. Stderr: {e.stderr.strip()}")
-        sys.exit(1)
-    except Exception as e:
-        logging.error(f"An unexpected error occurred during TTS conversion: {e}")
-        sys.exit(1)
 
-    if os.path.isfile(final_audio_path):
-        logging.info(f"Audio output saved to {final_audio_path}")
-    else:
-        logging.error("TTS process completed, but no audio file was found.")
+        logging.info(f"Processing batch of {len(inputs)} documents...")
+        stage_workers = {"ocr": args.ocr_workers, "llm": args.llm_workers, "tts": args.tts_workers}
+        results = run_batch(inputs, args.tts, stage_workers, args.voice_id, cache, args.stream, args.trace_dir)
+        log_batch_summary(results)
+        if any(error is not None for _, _, error, _ in results):
+            sys.exit(1)
+        return
+
+    try:
+        process_document(args.input, args.tts, args.voice_id, cache, args.stream, trace_dir=args.trace_dir,
+                         prewarm=not args.no_prewarm)
+    except PipelineError as e:
+        logging.error(str(e))
         sys.exit(1)
 
     logging.info("Processing complete. Lecture audio is ready.")
@@ -1,11 +1,41 @@
 import requests
+import json
 import os
+import re
 import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nlp_settings import LECTURE_CHUNK_CHARS, LECTURE_CONCURRENCY, OLLAMA_NUM_CTX, TRANSITION_MAX_TOKENS
+from pipeline.chunking import strip_root_tags
+from pipeline.trace import report
+from pipeline.transport import read_payload, write_result
+from pipeline.workers import serve, serve_stdin
 
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434").rstrip("/")
 OLLAMA_URL = f"{OLLAMA_HOST}/api/generate"
+# (connect, read) timeouts in seconds. The read timeout bounds the wait for
+# each streamed chunk, the first of which includes loading the model.
+OLLAMA_TIMEOUT = (float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5")), float(os.getenv("OLLAMA_READ_TIMEOUT", "300")))
+# Failed connections, timeouts and these statuses are retried with
+# exponential backoff, but only until the first chunk has been received.
+OLLAMA_RETRIES = 3
+OLLAMA_BACKOFF_S = 0.5
+OLLAMA_RETRY_STATUSES = {429, 502, 503, 504}
+# How long Ollama keeps the model loaded after a request: a duration ("30m")
+# or seconds, -1 to never unload. Its own default unloads after 5 minutes.
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# One keep-alive connection pool per process, shared by every request
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=max(4, LECTURE_CONCURRENCY + 1)))
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=max(4, LECTURE_CONCURRENCY + 1)))
 
-sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 try:
     from system_prompts import SYSTEM_PROMPTS_MAP
 except ImportError:
@@ -13,44 +43,378 @@ except ImportError:
           "Please ensure system_prompts.py exists in the same directory and defines SYSTEM_PROMPTS_MAP.", file=sys.stderr)
     sys.exit(1)
 
+# Timing fields of Ollama's final response, in nanoseconds
+OLLAMA_DURATIONS = ("total_duration", "load_duration", "prompt_eval_duration", "eval_duration")
+
+
+def report_ollama_stats(body: dict) -> None:
+    stats = {name.replace("_duration", "_s"): round(body[name] / 1e9, 4) for name in OLLAMA_DURATIONS if name in body}
+    for name in ("prompt_eval_count", "eval_count"):
+        if name in body:
+            stats[name] = body[name]
+    if stats:
+        report("ollama", stats)
+
+
+def open_stream(payload: dict) -> requests.Response:
+    """Posts a streaming generate request, retrying until Ollama starts answering."""
+    delay = OLLAMA_BACKOFF_S
+    for attempt in range(OLLAMA_RETRIES + 1):
+        last_attempt = attempt == OLLAMA_RETRIES
+        try:
+            response = session.post(OLLAMA_URL, json={**payload, "stream": True}, stream=True, timeout=OLLAMA_TIMEOUT)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if last_attempt:
+                raise
+        else:
+            if response.status_code not in OLLAMA_RETRY_STATUSES or last_attempt:
+                if response.ok:
+                    return response
+                # closed before raising, or the streamed connection leaks from the pool
+                with response:
+                    response.raise_for_status()
+            # read the body so the connection goes back to the pool
+            with response:
+                response.content
+        print(f"[WARN] Ollama request failed, retrying in {delay:.1f}s "
+              f"({attempt + 1}/{OLLAMA_RETRIES}).", file=sys.stderr)
+        time.sleep(delay)
+        delay *= 2
+
+
+def iter_ollama_tokens(payload: dict):
+    """
+    Yields the text of each chunk of Ollama's NDJSON stream as it arrives
+    and reports the timing stats of the final chunk.
+    """
+    with open_stream(payload) as response:
+        try:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if "error" in chunk:
+                    raise RuntimeError(f"Ollama returned an error: {chunk['error']}")
+                if chunk.get("response"):
+                    yield chunk["response"]
+                if chunk.get("done"):
+                    # no break: reading to the end of the stream lets the
+                    # connection be reused
+                    report_ollama_stats(chunk)
+        # requests raises a read timeout inside iter_lines as ConnectionError;
+        # here Ollama was reached and had started answering, so say so
+        except (requests.exceptions.ConnectionError, requests.exceptions.ReadTimeout,
+                requests.exceptions.ChunkedEncodingError) as e:
+            raise RuntimeError(f"Ollama at {OLLAMA_URL} stopped streaming after the connection was made "
+                               f"(no data for {OLLAMA_TIMEOUT[1]:g}s, or the stream was cut off): {e}")
+
+
+def keep_alive_value(keep_alive: str):
+    # Ollama wants a number for plain seconds, and a string only with a unit
+    try:
+        return int(keep_alive)
+    except ValueError:
+        return keep_alive
+
+
+def prewarm_model(ollama_model_name: str) -> str:
+    """
+    Loads the model into Ollama with a prompt-less request and sets how long
+    it stays resident, so the lecture request doesn't wait for the load.
+    """
+    payload = {
+        "model": ollama_model_name,
+        "keep_alive": keep_alive_value(OLLAMA_KEEP_ALIVE),
+        "options": {"num_ctx": OLLAMA_NUM_CTX},
+    }
+    try:
+        for _ in iter_ollama_tokens(payload):
+            pass
+    except requests.RequestException as e:
+        raise RuntimeError(f"Could not load model '{ollama_model_name}' in Ollama at {OLLAMA_URL}: {e}")
+    return ollama_model_name
+
+
+def split_notes(notes: str, max_chars: int = LECTURE_CHUNK_CHARS) -> list:
+    """
+    Splits the notes into chunks of at most `max_chars`, at blank lines
+    (paragraph, section and page breaks) where possible and at line ends
+    inside longer blocks. A single line longer than `max_chars` is a chunk
+    of its own.
+    """
+    pieces = []
+    for block in re.split(r"\n\s*\n", notes.strip()):
+        if len(block) <= max_chars:
+            pieces.append(("\n\n", block))
+        else:
+            lines = [line for line in block.splitlines() if line.strip()]
+            pieces.extend((("\n\n" if i == 0 else "\n"), line) for i, line in enumerate(lines))
+
+    chunks = []
+    current = ""
+    for separator, piece in pieces:
+        if current and len(current) + len(separator) + len(piece) > max_chars:
+            chunks.append(current)
+            current = piece
+        else:
+            current = f"{current}{separator}{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def is_refusal(section: str) -> bool:
+    # the system prompts answer unusable notes with "**ERROR: Unable to generate lecture ...**"
+    return "ERROR: Unable to generate lecture" in section
+
+
+def generate_section(system_prompt: str, chunk: str, index: int, count: int, ollama_model_name: str) -> str:
+    if index == 0:
+        position = "Open the lecture and cover this part only; do not conclude, the next part follows."
+    elif index == count - 1:
+        position = "Continue the lecture without greeting or introducing it again, and conclude it."
+    else:
+        position = ("Continue the lecture without greeting or introducing it again; "
+                    "do not conclude, the next part follows.")
+    payload = {
+        "model": ollama_model_name,
+        "prompt": f"{system_prompt}\n\nThese lecture notes are part {index + 1} of {count} of a longer document. "
+                  f"{position}\n\nLecture Notes:\n{chunk}\n\nLecture Script:",
+        "keep_alive": keep_alive_value(OLLAMA_KEEP_ALIVE),
+        "options": {"num_ctx": OLLAMA_NUM_CTX},
+    }
+    return strip_root_tags("".join(iter_ollama_tokens(payload)))
+
+
+def generate_transition(previous: str, following: str, ollama_model_name: str) -> str:
+    payload = {
+        "model": ollama_model_name,
+        "prompt": "You are a university professor giving a spoken lecture. Write one or two short spoken "
+                  "sentences that lead from the end of one part of the lecture to the start of the next. "
+                  "Output only those sentences, without tags, quotes or formatting.\n\n"
+                  f"End of the previous part:\n{previous[-600:]}\n\n"
+                  f"Start of the next part:\n{following[:600]}\n\nTransition:",
+        "keep_alive": keep_alive_value(OLLAMA_KEEP_ALIVE),
+        "options": {"num_ctx": OLLAMA_NUM_CTX, "num_predict": TRANSITION_MAX_TOKENS},
+    }
+    return strip_root_tags("".join(iter_ollama_tokens(payload)))
+
+
+class LectureSections:
+    """
+    Runs the requests of a sectioned lecture on LECTURE_CONCURRENCY threads.
+    Sections start in order; the transition between two kept sections
+    (refused ones are skipped over) is requested as soon as both are done,
+    ahead of the sections still waiting for a thread, so the consumer
+    rarely waits for one. section() and transition() block until the
+    result is there and re-raise the request's error.
+    """
+
+    def __init__(self, system_prompt: str, chunks: list, ollama_model_name: str):
+        self.system_prompt = system_prompt
+        self.chunks = chunks
+        self.model = ollama_model_name
+        self.workers = max(1, LECTURE_CONCURRENCY)
+        self.section_times = [None] * len(chunks)  # seconds, by section index
+        self._sections = {}  # index -> text or exception
+        self._transitions = {}  # (previous, following) -> text or exception, None while pending
+        self._waiting = deque(range(len(chunks)))
+        self._ready = deque()  # transitions whose sections are done
+        self._running = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        with self._condition:
+            self._schedule()
+
+    def _schedule(self) -> None:
+        while not self._closed and self._running < self.workers and (self._ready or self._waiting):
+            task = ("transition", self._ready.popleft()) if self._ready else ("section", self._waiting.popleft())
+            self._running += 1
+            self._executor.submit(self._run, *task)
+
+    def _queue_transitions(self) -> None:
+        previous = None
+        for index in range(len(self.chunks)):
+            section = self._sections.get(index)
+            if section is None or isinstance(section, Exception):
+                previous = None
+            elif not is_refusal(section) and section:
+                if previous is not None and (previous, index) not in self._transitions:
+                    self._transitions[(previous, index)] = None
+                    self._ready.append((previous, index))
+                previous = index
+
+    def _run(self, kind: str, key) -> None:
+        started = time.perf_counter()
+        try:
+            if kind == "section":
+                result = generate_section(self.system_prompt, self.chunks[key], key, len(self.chunks), self.model)
+            else:
+                result = generate_transition(self._sections[key[0]], self._sections[key[1]], self.model)
+        except Exception as e:
+            result = e
+        with self._condition:
+            self._running -= 1
+            if kind == "section":
+                self._sections[key] = result
+                self.section_times[key] = round(time.perf_counter() - started, 4)
+                self._queue_transitions()
+            else:
+                self._transitions[key] = result
+            self._schedule()
+            self._condition.notify_all()
+
+    def _wait(self, results: dict, key) -> str:
+        with self._condition:
+            self._condition.wait_for(lambda: results.get(key) is not None)
+            result = results[key]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def section(self, index: int) -> str:
+        return self._wait(self._sections, index)
+
+    def transition(self, previous: int, following: int) -> str:
+        return self._wait(self._transitions, (previous, following))
+
+    def close(self) -> None:
+        # an early stop drops the requests that haven't started
+        with self._condition:
+            self._closed = True
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_sectioned_lecture(system_prompt: str, chunks: list, ollama_model_name: str, wrap_speak: bool):
+    """
+    Map-reduce over the chunks of long notes: lecture sections are generated
+    concurrently (see LectureSections) and yielded in order as soon as each
+    one and its predecessors are done, joined by short generated
+    transitions. Sections the model refused are dropped.
+    """
+    started = time.perf_counter()
+    sections = LectureSections(system_prompt, chunks, ollama_model_name)
+    try:
+        previous = None
+        refusal = None
+        for index in range(len(chunks)):
+            section = sections.section(index)
+            if is_refusal(section) or not section:
+                refusal = refusal or section
+                continue
+            if previous is None:
+                if wrap_speak:
+                    yield "<speak>"
+            else:
+                yield "\n\n" + sections.transition(previous, index) + "\n\n"
+            yield section
+            previous = index
+        if previous is None:
+            yield refusal or ""
+        elif wrap_speak:
+            yield "</speak>"
+    finally:
+        sections.close()
+    report("lecture_sections", {
+        "chunks": len(chunks),
+        "concurrency": LECTURE_CONCURRENCY,
+        "num_ctx": OLLAMA_NUM_CTX,
+        "chunk_chars": LECTURE_CHUNK_CHARS,
+        "section_s": sections.section_times,
+        "total_s": round(time.perf_counter() - started, 4),
+    })
+
 
 def generate_professor_lecture(notes: str, ollama_model_name: str, system_prompt_type: str) -> str:
+    try:
+        return "".join(stream_professor_lecture(notes, ollama_model_name, system_prompt_type)).strip()
+    except (ValueError, RuntimeError) as e:
+        return f"[ERROR] {e}"
+
+
+def stream_professor_lecture(notes: str, ollama_model_name: str, system_prompt_type: str):
+    """
+    Yields the lecture script token by token as Ollama generates it, or
+    section by section for notes split by split_notes. Unlike
+    generate_professor_lecture, failures are raised rather than returned,
+    since part of the script may already have been consumed.
+    """
     system_prompt = SYSTEM_PROMPTS_MAP.get(system_prompt_type)
 
     if not system_prompt:
-        return f"[ERROR] Invalid system_prompt_type: '{system_prompt_type}'. " \
-               f"Available types: {list(SYSTEM_PROMPTS_MAP.keys())}"
+        raise ValueError(f"Invalid system_prompt_type: '{system_prompt_type}'. "
+                         f"Available types: {list(SYSTEM_PROMPTS_MAP.keys())}")
 
     payload = {
         "model": ollama_model_name,
         "prompt": f"{system_prompt}\n\nLecture Notes:\n{notes}\n\nLecture Script:",
-        "stream": False
+        "keep_alive": keep_alive_value(OLLAMA_KEEP_ALIVE),
+        "options": {"num_ctx": OLLAMA_NUM_CTX},
     }
+    chunks = split_notes(notes)
 
     try:
-        response = requests.post(OLLAMA_URL, json=payload)
-        response.raise_for_status()
-        return response.json()["response"].strip()
-    
+        if len(chunks) > 1:
+            # SSML output is a single <speak> document: sections come without it
+            wrap_speak = system_prompt_type == "elevenlabs_v2"
+            yield from iter_sectioned_lecture(system_prompt, chunks, ollama_model_name, wrap_speak)
+        else:
+            yield from iter_ollama_tokens(payload)
     except requests.exceptions.ConnectionError:
-        return f"[ERROR] Could not connect to Ollama at {OLLAMA_URL}. Is Ollama running and accessible?"
+        raise RuntimeError(f"Could not connect to Ollama at {OLLAMA_URL}. Is Ollama running and accessible?")
     except requests.RequestException as e:
-        return f"[ERROR] Failed with model '{ollama_model_name}' and prompt type '{system_prompt_type}': {e}"
-    except KeyError:
-        return f"[ERROR] Unexpected response format from Ollama. Response: {response.text}"
+        raise RuntimeError(f"Failed with model '{ollama_model_name}' and prompt type '{system_prompt_type}': {e}")
+
+
+def handle_job(job: dict):
+    if job.get("prewarm"):
+        return prewarm_model(job["model"])
+    if job.get("stream"):
+        return stream_professor_lecture(job["notes"], job["model"], job["prompt_type"])
+    return generate_professor_lecture(job["notes"], job["model"], job["prompt_type"])
+
 
 if __name__ == "__main__":
-    if len(sys.argv) < 4:
-        print("Usage: python generate_lecture.py <notes_text> <ollama_model_name> <system_prompt_type>", file=sys.stderr)
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        serve("llm", handle_job)
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve-stdin":
+        serve_stdin(handle_job)
+        sys.exit(0)
+    if len(sys.argv) > 2 and sys.argv[1] == "--prewarm":
+        try:
+            prewarm_model(sys.argv[2])
+        except RuntimeError as e:
+            print(f"[ERROR] {e}", file=sys.stderr)
+            sys.exit(1)
+        sys.exit(0)
+
+    # --text-from/--result-to move the notes and the script off argv and stdout capture
+    args = sys.argv[1:]
+    options = {}
+    while len(args) > 1 and args[0] in ("--text-from", "--result-to"):
+        options[args[0]], args = args[1], args[2:]
+    if "--text-from" in options:
+        args = [None] + args
+
+    if len(args) < 3:
+        print("Usage: python generate_lecture.py [--text-from <spec>] [--result-to <spec>] [<notes_text>] "
+              "<ollama_model_name> <system_prompt_type> | --prewarm <ollama_model_name> | --serve", file=sys.stderr)
         sys.exit(1)
     
-    notes_text = sys.argv[1]
-    ollama_model_name = sys.argv[2]
-    system_prompt_type = sys.argv[3]
+    notes_text = args[0]
+    ollama_model_name = args[1]
+    system_prompt_type = args[2]
     
     try:
+        if notes_text is None:
+            notes_text = read_payload(options["--text-from"])
         generated_lecture = generate_professor_lecture(notes_text, ollama_model_name, system_prompt_type)
-        print(generated_lecture)
+        if "--result-to" in options:
+            write_result(options["--result-to"], generated_lecture)
+        else:
+            print(generated_lecture)
     except Exception as e:
         print(f"Error during lecture generation: {e}", file=sys.stderr)
         sys.exit(1)
@@ -0,0 +1,24 @@
+# Settings shared by nlp_model.py and main.py. Kept free of heavy imports
+# so the main venv can fingerprint them for the lecture cache.
+import os
+
+# Context window requested from Ollama for every lecture request (and the
+# prewarm, so the model is loaded with it once). Its own default is smaller
+# than llama3's 8k.
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "8192"))
+
+# Notes longer than this many characters are lectured in sections, one
+# request per chunk of notes. By default a chunk takes about a quarter of the
+# context (at ~4 characters per token), leaving the rest for the system
+# prompt and the generated section.
+CHARS_PER_TOKEN = 4
+LECTURE_CHUNK_CHARS = int(os.getenv("LECTURE_CHUNK_CHARS", str(OLLAMA_NUM_CTX // 4 * CHARS_PER_TOKEN)))
+
+# Section and transition requests in flight at once (Ollama runs them in
+# parallel up to its OLLAMA_NUM_PARALLEL). Speed only, so it is kept out of
+# the cache key.
+LECTURE_CONCURRENCY = int(os.getenv("LECTURE_CONCURRENCY", "2"))
+
+# Tokens allowed for a transition between two sections
+TRANSITION_MAX_TOKENS = 80
+
@@ -0,0 +1,108 @@
+"""
+Compares the fp32 OCR models with the quantized mode (fused CRAFT convs +
+int8 TrOCR) on the test documents: latency per image and how far the
+quantized text drifts from the fp32 text (character error rate).
+
+    .venv_ocr_craft/bin/python ocr/compare_quantization.py [image_dir] [--json results.json]
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import trocr_craft
+from ocr_settings import CRAFT_SETTINGS, OCR_BACKEND, TROCR_SETTINGS
+from trocr_torch import TorchTrOCR
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_IMAGE_DIR = os.path.join(PROJECT_ROOT, "OCR_test_documents")
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tiff", ".webp"}
+
+
+def edit_distance(a: str, b: str) -> int:
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def model_size_mb(model) -> float:
+    # serialized size; quantized layers keep their weights in packed params
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / (1024 * 1024)
+
+
+def run_variant(craft, recognizer, image_path: str, output_dir: str):
+    trocr_craft.craft, trocr_craft.recognizer = craft, recognizer
+    start = time.perf_counter()
+    text = trocr_craft.run_ocr(image_path, output_dir=output_dir)
+    return text, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy/latency comparison of fp32 and quantized OCR.")
+    parser.add_argument('image_dir', nargs='?', default=DEFAULT_IMAGE_DIR, help="Directory of test images.")
+    parser.add_argument('--json', help="Also write the per-image results to this file.")
+    args = parser.parse_args()
+
+    images = sorted(
+        os.path.join(args.image_dir, name) for name in os.listdir(args.image_dir)
+        if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+    )
+    if not images:
+        print(f"[ERROR] No images found in {args.image_dir}", file=sys.stderr)
+        sys.exit(1)
+
+    # reuse whatever the import already loaded for the matching variant
+    loaded = (trocr_craft.craft, trocr_craft.recognizer)
+    loaded_quantized = OCR_BACKEND == "torch" and CRAFT_SETTINGS["fuse_conv_bn"] and TROCR_SETTINGS["quantize"]
+    loaded_fp32 = OCR_BACKEND == "torch" and not CRAFT_SETTINGS["fuse_conv_bn"] and not TROCR_SETTINGS["quantize"]
+    variants = {
+        "fp32": loaded if loaded_fp32 else (trocr_craft.load_craft(False, "torch"), TorchTrOCR(False)),
+        "int8": loaded if loaded_quantized else (trocr_craft.load_craft(True, "torch"), TorchTrOCR(True)),
+    }
+    for name, (_, recognizer) in variants.items():
+        print(f"TrOCR {name}: {model_size_mb(recognizer.model):.0f} MB of weights", file=sys.stderr)
+
+    results = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        # first inference pays for lazy initialization in both variants
+        for craft, recognizer in variants.values():
+            run_variant(craft, recognizer, images[0], output_dir)
+
+        for image_path in images:
+            fp32_text, fp32_s = run_variant(*variants["fp32"], image_path, output_dir)
+            int8_text, int8_s = run_variant(*variants["int8"], image_path, output_dir)
+            results.append({
+                "image": os.path.basename(image_path),
+                "fp32_s": round(fp32_s, 3),
+                "int8_s": round(int8_s, 3),
+                "speedup": round(fp32_s / int8_s, 2),
+                "cer_vs_fp32": round(edit_distance(fp32_text, int8_text) / max(len(fp32_text), 1), 4),
+            })
+
+    print(f"{'image':<24}{'fp32 s':>9}{'int8 s':>9}{'speedup':>9}{'CER':>9}")
+    for r in results:
+        print(f"{r['image']:<24}{r['fp32_s']:>9.2f}{r['int8_s']:>9.2f}{r['speedup']:>8.2f}x{r['cer_vs_fp32']:>9.2%}")
+    total_fp32 = sum(r["fp32_s"] for r in results)
+    total_int8 = sum(r["int8_s"] for r in results)
+    mean_cer = sum(r["cer_vs_fp32"] for r in results) / len(results)
+    print(f"{'total':<24}{total_fp32:>9.2f}{total_int8:>9.2f}{total_fp32 / total_int8:>8.2f}x{mean_cer:>9.2%}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -17,6 +17,7 @@ __all__ = [
     "load_craftnet_model",
     "load_refinenet_model",
     "get_prediction",
+    "get_prediction_batch",
     "export_detected_regions",
     "export_extra_results",
     "empty_cuda_cache",
@@ -27,6 +28,7 @@ read_image = image_utils.read_image
 load_craftnet_model = craft_utils.load_craftnet_model
 load_refinenet_model = craft_utils.load_refinenet_model
 get_prediction = predict.get_prediction
+get_prediction_batch = predict.get_prediction_batch
 export_detected_regions = file_utils.export_detected_regions
 export_extra_results = file_utils.export_extra_results
 empty_cuda_cache = torch_utils.empty_cuda_cache
@@ -47,6 +49,14 @@ class Craft:
         crop_type="poly",
         weight_path_craft_net: Optional[str] = None,
         weight_path_refine_net: Optional[str] = None,
+        fuse_conv_bn=False,
+        backend="torch",
+        box_only=False,
+        tile_size=None,
+        tile_overlap=64,
+        tile_batch_size=4,
+        tile_workers=1,
+        mmap_weights=False,
     ):
         """
         Arguments:
@@ -60,7 +70,27 @@ class Craft:
             long_size: desired longest image size for inference
             refiner: enable link refiner
             crop_type: crop regions by detected boxes or polys ("poly" or "box")
+            fuse_conv_bn: fold BatchNorm layers into convolutions (CPU only)
+            backend: "torch", or "onnx" to run graphs exported with
+                ocr/export_onnx.py on ONNX Runtime (CPU only, weight paths
+                then point to the .onnx files)
+            box_only: detect boxes only: no polygon fitting and no heatmap
+                rendering (unless exported); polys are the boxes. Combine
+                with refiner=False to also skip the RefineNet forward pass
+            tile_size: detect on overlapping tiles of this size (multiple
+                of 32) and stitch the score maps; bounds memory for large
+                long_size values
+            tile_overlap: overlap between tiles (multiple of 32)
+            tile_batch_size: tiles per forward pass
+            tile_workers: tile batches run concurrently
+            mmap_weights: memory-map converted copies of the .pth weights
+                (CPU, torch backend), shared between processes
         """
+        if backend not in ("torch", "onnx"):
+            raise ValueError("backend can be only 'torch' or 'onnx'")
+        if backend == "onnx" and cuda:
+            raise ValueError("the onnx backend runs on CPU only")
+
         self.craft_net = None
         self.refine_net = None
         self.output_dir = output_dir
@@ -73,6 +103,16 @@ class Craft:
         self.long_size = long_size
         self.refiner = refiner
         self.crop_type = crop_type
+        self.fuse_conv_bn = fuse_conv_bn
+        self.mmap_weights = mmap_weights
+        self.backend = backend
+        self.box_only = box_only
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.tile_batch_size = tile_batch_size
+        self.tile_workers = tile_workers
+        # preprocessing buffers, reused across detect_text calls
+        self.input_buffer = image_utils.InputBuffer()
 
         # load craftnet
         self.load_craftnet_model(weight_path_craft_net)
@@ -84,13 +124,23 @@ class Craft:
         """
         Loads craftnet model
         """
-        self.craft_net = load_craftnet_model(self.cuda, weight_path=weight_path)
+        if self.backend == "onnx":
+            self.craft_net = craft_utils.load_craftnet_onnx(weight_path)
+            return
+        self.craft_net = load_craftnet_model(
+            self.cuda, weight_path=weight_path, fuse=self.fuse_conv_bn, mmap=self.mmap_weights
+        )
 
     def load_refinenet_model(self, weight_path: Optional[str] = None):
         """
         Loads refinenet model
         """
-        self.refine_net = load_refinenet_model(self.cuda, weight_path=weight_path)
+        if self.backend == "onnx":
+            self.refine_net = craft_utils.load_refinenet_onnx(weight_path)
+            return
+        self.refine_net = load_refinenet_model(
+            self.cuda, weight_path=weight_path, fuse=self.fuse_conv_bn, mmap=self.mmap_weights
+        )
 
     def unload_craftnet_model(self):
         """
@@ -137,10 +187,59 @@ class Craft:
             low_text=self.low_text,
             cuda=self.cuda,
             long_size=self.long_size,
+            poly=not self.box_only,
+            heatmaps=not self.box_only or (self.output_dir is not None and self.export_extra),
+            tile_size=self.tile_size,
+            tile_overlap=self.tile_overlap,
+            tile_batch_size=self.tile_batch_size,
+            tile_workers=self.tile_workers,
+            input_buffer=self.input_buffer,
         )
 
+        self._export(image, prediction_result)
+
+        # return prediction results
+        return prediction_result
+
+    def detect_text_batch(self, images, batch_size=4):
+        """
+        Arguments:
+            images: list of paths to images or numpy arrays or PIL images
+            batch_size: maximum number of images per forward pass
+
+        Output:
+            list of detect_text outputs, one per image. Images that resize to
+            the same padded size share CraftNet/RefineNet forward passes;
+            with tile_size set, each image is detected on its own.
+        """
+        if self.tile_size:
+            return [self.detect_text(image) for image in images]
+
+        prediction_results = get_prediction_batch(
+            images=images,
+            craft_net=self.craft_net,
+            refine_net=self.refine_net,
+            text_threshold=self.text_threshold,
+            link_threshold=self.link_threshold,
+            low_text=self.low_text,
+            cuda=self.cuda,
+            long_size=self.long_size,
+            poly=not self.box_only,
+            heatmaps=not self.box_only or (self.output_dir is not None and self.export_extra),
+            batch_size=batch_size,
+            input_buffer=self.input_buffer,
+        )
+        for image, prediction_result in zip(images, prediction_results):
+            self._export(image, prediction_result)
+        return prediction_results
+
+    def _export(self, image, prediction_result):
+        """
+        Adds "text_crop_paths" to a prediction result, exporting the regions
+        (and extra results) if output_dir is given.
+        """
         # arange regions
-        if self.crop_type == "box":
+        if self.crop_type == "box" or self.box_only:
             regions = prediction_result["boxes"]
         elif self.crop_type == "poly":
             regions = prediction_result["polys"]
@@ -173,6 +272,3 @@ class Craft:
                     file_name=file_name,
                     output_dir=self.output_dir,
                 )
-
-        # return prediction results
-        return prediction_result
@@ -8,6 +8,7 @@ import cv2
 import numpy as np
 
 import craft_text_detector.file_utils as file_utils
+import craft_text_detector.onnx_utils as onnx_utils
 import craft_text_detector.torch_utils as torch_utils
 
 CRAFT_GDRIVE_URL = "https://drive.google.com/uc?id=1bupFXqT-VU6Jjeul13XP7yx2Sg5IHr4J"
@@ -34,9 +35,65 @@ def copyStateDict(state_dict):
     return new_state_dict
 
 
+def mmap_weight_path(weight_path: str) -> str:
+    # converted copy next to the .pth: keys without the "module." prefix,
+    # saved in torch's zip format, which torch.load can memory-map
+    return os.path.splitext(weight_path)[0] + ".mmap.pt"
+
+
+def load_state_dict_mmap(weight_path: str):
+    """
+    Memory-maps the converted copy of a .pth checkpoint, creating it on first
+    use. The tensors are backed by the page cache: nothing is deserialized
+    or copied, and processes loading the same weights share the memory.
+    """
+    mmap_path = mmap_weight_path(weight_path)
+    if not os.path.isfile(mmap_path):
+        state_dict = copyStateDict(torch_utils.load(weight_path, map_location="cpu"))
+        tmp_path = "{}.{}.tmp".format(mmap_path, os.getpid())
+        torch_utils.save(state_dict, tmp_path)
+        os.replace(tmp_path, mmap_path)
+    return torch_utils.load(mmap_path, map_location="cpu", mmap=True, weights_only=True)
+
+
+def fuse_conv_bn(module):
+    """
+    Folds every BatchNorm2d that directly follows a Conv2d inside a Sequential
+    into the conv's weights, so inference runs one op instead of two. Only
+    valid in eval mode; outputs match the unfused model up to float rounding.
+    """
+    if isinstance(module, torch_utils.Sequential):
+        children = list(module.named_children())
+        for (name, child), (next_name, next_child) in zip(children, children[1:]):
+            if isinstance(child, torch_utils.Conv2d) and isinstance(next_child, torch_utils.BatchNorm2d):
+                setattr(module, name, torch_utils.fuse_conv_bn_eval(child, next_child))
+                setattr(module, next_name, torch_utils.Identity())
+    for child in module.children():
+        fuse_conv_bn(child)
+    return module
+
+
+def default_weight_path(file_name: str) -> Path:
+    return Path(Path.home(), ".craft_text_detector", "weights", file_name)
+
+
+def load_craftnet_onnx(weight_path: Optional[Union[str, Path]] = None):
+    if weight_path is None:
+        weight_path = default_weight_path("craft_mlt_25k.onnx")
+    return onnx_utils.load_onnx_model(weight_path)
+
+
+def load_refinenet_onnx(weight_path: Optional[Union[str, Path]] = None):
+    if weight_path is None:
+        weight_path = default_weight_path("craft_refiner_CTW1500.onnx")
+    return onnx_utils.load_onnx_model(weight_path)
+
+
 def load_craftnet_model(
         cuda: bool = False,
-        weight_path: Optional[Union[str, Path]] = None
+        weight_path: Optional[Union[str, Path]] = None,
+        fuse: bool = False,
+        mmap: bool = False
 ):
     # get craft net path
     if weight_path is None:
@@ -54,7 +111,14 @@ def load_craftnet_model(
     # load craft net
     from craft_text_detector.models.craftnet import CraftNet
 
-    craft_net = CraftNet()  # initialize
+    # with mmap the parameters are assigned from the mapped file (CPU only),
+    # so they are not initialized first
+    mmap = mmap and not cuda
+    if mmap:
+        with torch_utils.device("meta"):
+            craft_net = CraftNet()
+    else:
+        craft_net = CraftNet()  # initialize
 
     # check if weights are already downloaded, if not download
     url = CRAFT_GDRIVE_URL
@@ -70,17 +134,23 @@ def load_craftnet_model(
         craft_net = craft_net.cuda()
         craft_net = torch_utils.DataParallel(craft_net)
         torch_utils.cudnn_benchmark = False
+    elif mmap:
+        craft_net.load_state_dict(load_state_dict_mmap(weight_path), assign=True)
     else:
         craft_net.load_state_dict(
             copyStateDict(torch_utils.load(weight_path, map_location="cpu"))
         )
     craft_net.eval()
+    if fuse and not cuda:
+        fuse_conv_bn(craft_net)
     return craft_net
 
 
 def load_refinenet_model(
         cuda: bool = False,
-        weight_path: Optional[Union[str, Path]] = None
+        weight_path: Optional[Union[str, Path]] = None,
+        fuse: bool = False,
+        mmap: bool = False
 ):
     # get refine net path
     if weight_path is None:
@@ -98,7 +168,14 @@ def load_refinenet_model(
     # load refine net
     from craft_text_detector.models.refinenet import RefineNet
 
-    refine_net = RefineNet()  # initialize
+    # with mmap the parameters are assigned from the mapped file (CPU only),
+    # so they are not initialized first
+    mmap = mmap and not cuda
+    if mmap:
+        with torch_utils.device("meta"):
+            refine_net = RefineNet()
+    else:
+        refine_net = RefineNet()  # initialize
 
     # check if weights are already downloaded, if not download
     url = REFINENET_GDRIVE_URL
@@ -114,11 +191,15 @@ def load_refinenet_model(
         refine_net = refine_net.cuda()
         refine_net = torch_utils.DataParallel(refine_net)
         torch_utils.cudnn_benchmark = False
+    elif mmap:
+        refine_net.load_state_dict(load_state_dict_mmap(weight_path), assign=True)
     else:
         refine_net.load_state_dict(
             copyStateDict(torch_utils.load(weight_path, map_location="cpu"))
         )
     refine_net.eval()
+    if fuse and not cuda:
+        fuse_conv_bn(refine_net)
     return refine_net
 
 
@@ -137,6 +218,9 @@ def getDetBoxes_core(textmap, linkmap, text_threshold, link_threshold, low_text)
         text_score_comb.astype(np.uint8), connectivity=4
     )
 
+    # link pixels that are not text, removed from every segmentation map
+    link_area = np.logical_and(link_score == 1, text_score == 0)
+
     det = []
     mapper = []
     for k in range(1, nLabels):
@@ -145,19 +229,14 @@ def getDetBoxes_core(textmap, linkmap, text_threshold, link_threshold, low_text)
         if size < 10:
             continue
 
-        # thresholding
-        if np.max(textmap[labels == k]) < text_threshold:
-            continue
-
-        # make segmentation map
-        segmap = np.zeros(textmap.shape, dtype=np.uint8)
-        segmap[labels == k] = 255
-
-        # remove link area
-        segmap[np.logical_and(link_score == 1, text_score == 0)] = 0
-
         x, y = stats[k, cv2.CC_STAT_LEFT], stats[k, cv2.CC_STAT_TOP]
         w, h = stats[k, cv2.CC_STAT_WIDTH], stats[k, cv2.CC_STAT_HEIGHT]
+
+        # thresholding (component k lies inside its bounding box)
+        component = labels[y:y + h, x:x + w] == k
+        if np.max(textmap[y:y + h, x:x + w][component]) < text_threshold:
+            continue
+
         niter = int(math.sqrt(size * min(w, h) / (w * h)) * 2)
         sx, ex, sy, ey = (x - niter, x + w + niter + 1, y - niter, y + h + niter + 1)
         # boundary check
@@ -169,12 +248,21 @@ def getDetBoxes_core(textmap, linkmap, text_threshold, link_threshold, low_text)
             ex = img_w
         if ey >= img_h:
             ey = img_h
+
+        # make segmentation map of the dilation window only; nothing outside
+        # it can become non-zero
+        segmap = np.zeros((ey - sy, ex - sx), dtype=np.uint8)
+        segmap[y - sy:y - sy + h, x - sx:x - sx + w][component] = 255
+
+        # remove link area
+        segmap[link_area[sy:ey, sx:ex]] = 0
+
         kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1 + niter, 1 + niter))
-        segmap[sy:ey, sx:ex] = cv2.dilate(segmap[sy:ey, sx:ex], kernel)
+        segmap = cv2.dilate(segmap, kernel)
 
         # make box
-        np_temp = np.roll(np.array(np.where(segmap != 0)), 1, axis=0)
-        np_contours = np_temp.transpose().reshape(-1, 2)
+        ys, xs = np.where(segmap != 0)
+        np_contours = np.stack([xs + sx, ys + sy], axis=1)
         rectangle = cv2.minAreaRect(np_contours)
         box = cv2.boxPoints(rectangle)
 
@@ -209,6 +297,81 @@ def getDetBoxes_core(textmap, linkmap, text_threshold, link_threshold, low_text)
     return det, labels, mapper
 
 
+def _pivot_points(cp_x, cp_sy, cp_ey, seg_w, tot_seg, num_cp):
+    """
+    Splits the column contours into tot_seg segments of width seg_w and
+    returns the mean centre point of each segment, and for every odd segment
+    the centre of its tallest column (pivot point) and that column's height.
+    Matches the original column-by-column scan, which moves on by at most
+    one segment per column.
+    """
+    pp = [None] * num_cp
+    seg_height = [0] * num_cp
+    cp_section = [[0, 0]] * tot_seg
+    if len(cp_x) == 0:
+        return cp_section, pp, seg_height
+
+    cp_cy = (cp_sy + cp_ey) * 0.5
+    cp_h = cp_ey - cp_sy + 1
+    boundaries = np.arange(1, tot_seg + 1) * seg_w
+    seg = np.searchsorted(boundaries, cp_x, side="right")
+    if seg[0] != 0:
+        # the scan stops at once when the first column is past segment 0
+        return cp_section, pp, seg_height
+    if (np.diff(seg) > 1).any():
+        # a gap wider than a segment: the scan lags behind, replay it
+        seg = np.zeros(len(cp_x), dtype=np.intp)
+        seg_num = 0
+        for i, x in enumerate(cp_x.tolist()):
+            if (seg_num + 1) * seg_w <= x:
+                seg_num += 1
+            seg[i] = seg_num
+
+    # seg is non-decreasing: segment i is cp[starts[i]:starts[i + 1]]
+    starts = np.searchsorted(seg, np.arange(tot_seg + 1)).tolist()
+    last = int(seg[-1])
+    # sums of integers and halves, exact as in the scan
+    sum_x = np.concatenate(([0], np.cumsum(cp_x))).tolist()
+    sum_cy = np.concatenate(([0.0], np.cumsum(cp_cy))).tolist()
+    cp_section = []
+    for i in range(tot_seg):
+        start, end = starts[i], starts[i + 1]
+        if start == end:
+            cp_section.append([0, 0])
+        elif i == last and last != tot_seg - 1:
+            # the scan only averages the last segment when it is the final one
+            cp_section.append([sum_x[end] - sum_x[start], sum_cy[end] - sum_cy[start]])
+        else:
+            count = end - start
+            cp_section.append([(sum_x[end] - sum_x[start]) / count, (sum_cy[end] - sum_cy[start]) / count])
+    if last != tot_seg - 1:
+        cp_section[-1] = [0.0, 0.0]
+
+    for j in range(num_cp):
+        start, end = starts[2 * j + 1], starts[2 * j + 2]
+        if start < end:
+            i = start + int(cp_h[start:end].argmax())
+            pp[j] = (int(cp_x[i]), float(cp_cy[i]))
+            seg_height[j] = int(cp_h[i])
+    return cp_section, pp, seg_height
+
+
+def _line_hits(word_label, p):
+    """
+    Whether the 1px line p[0:2] -> p[2:4] drawn by cv2.line crosses the
+    word. Rasterizes only the line's bounding box instead of a full mask.
+    """
+    x0, y0, x1, y1 = int(p[0]), int(p[1]), int(p[2]), int(p[3])
+    h, w = word_label.shape
+    left, top = max(min(x0, x1), 0), max(min(y0, y1), 0)
+    right, bottom = min(max(x0, x1) + 1, w), min(max(y0, y1) + 1, h)
+    if left >= right or top >= bottom:
+        return False
+    line_img = np.zeros((bottom - top, right - left), dtype=np.uint8)
+    cv2.line(line_img, (x0 - left, y0 - top), (x1 - left, y1 - top), 1, thickness=1)
+    return bool(word_label[top:bottom, left:right][line_img != 0].any())
+
+
 def getPoly_core(boxes, labels, mapper, linkmap):
     # configs
     num_cp = 5
@@ -239,22 +402,16 @@ def getPoly_core(boxes, labels, mapper, linkmap):
             continue
 
         # binarization for selected label
-        cur_label = mapper[k]
-        word_label[word_label != cur_label] = 0
-        word_label[word_label > 0] = 1
+        word_label = word_label == mapper[k]
 
         """ Polygon generation """
-        # find top/bottom contours
-        cp = []
-        max_len = -1
-        for i in range(w):
-            region = np.where(word_label[:, i] != 0)[0]
-            if len(region) < 2:
-                continue
-            cp.append((i, region[0], region[-1]))
-            length = region[-1] - region[0] + 1
-            if length > max_len:
-                max_len = length
+        # find top/bottom contours of all columns with at least two pixels
+        column_size = word_label.sum(axis=0)
+        cp_x = np.flatnonzero(column_size >= 2)
+        cp_sy = word_label.argmax(axis=0)[cp_x]
+        cp_ey = h - 1 - word_label[::-1].argmax(axis=0)[cp_x]
+        cp_h = cp_ey - cp_sy + 1
+        max_len = cp_h.max() if len(cp_x) else -1
 
         # pass if max_len is similar to h
         if h * max_len_ratio < max_len:
@@ -264,48 +421,7 @@ def getPoly_core(boxes, labels, mapper, linkmap):
         # get pivot points with fixed length
         tot_seg = num_cp * 2 + 1
         seg_w = w / tot_seg  # segment width
-        pp = [None] * num_cp  # init pivot points
-        cp_section = [[0, 0]] * tot_seg
-        seg_height = [0] * num_cp
-        seg_num = 0
-        num_sec = 0
-        prev_h = -1
-        for i in range(0, len(cp)):
-            (x, sy, ey) = cp[i]
-            if (seg_num + 1) * seg_w <= x and seg_num <= tot_seg:
-                # average previous segment
-                if num_sec == 0:
-                    break
-                cp_section[seg_num] = [
-                    cp_section[seg_num][0] / num_sec,
-                    cp_section[seg_num][1] / num_sec,
-                ]
-                num_sec = 0
-
-                # reset variables
-                seg_num += 1
-                prev_h = -1
-
-            # accumulate center points
-            cy = (sy + ey) * 0.5
-            cur_h = ey - sy + 1
-            cp_section[seg_num] = [
-                cp_section[seg_num][0] + x,
-                cp_section[seg_num][1] + cy,
-            ]
-            num_sec += 1
-
-            if seg_num % 2 == 0:
-                continue  # No polygon area
-
-            if prev_h < cur_h:
-                pp[int((seg_num - 1) / 2)] = (x, cy)
-                seg_height[int((seg_num - 1) / 2)] = cur_h
-                prev_h = cur_h
-
-        # processing last segment
-        if num_sec != 0:
-            cp_section[-1] = [cp_section[-1][0] / num_sec, cp_section[-1][1] / num_sec]
+        cp_section, pp, seg_height = _pivot_points(cp_x, cp_sy, cp_ey, seg_w, tot_seg, num_cp)
 
         # pass if num of pivots is not sufficient or segment widh
         # is smaller than character height
@@ -339,37 +455,15 @@ def getPoly_core(boxes, labels, mapper, linkmap):
         for r in np.arange(0.5, max_r, step_r):
             dx = 2 * half_char_h * r
             if not isSppFound:
-                line_img = np.zeros(word_label.shape, dtype=np.uint8)
                 dy = grad_s * dx
                 p = np.array(new_pp[0]) - np.array([dx, dy, dx, dy])
-                cv2.line(
-                    line_img,
-                    (int(p[0]), int(p[1])),
-                    (int(p[2]), int(p[3])),
-                    1,
-                    thickness=1,
-                )
-                if (
-                    np.sum(np.logical_and(word_label, line_img)) == 0
-                    or r + 2 * step_r >= max_r
-                ):
+                if not _line_hits(word_label, p) or r + 2 * step_r >= max_r:
                     spp = p
                     isSppFound = True
             if not isEppFound:
-                line_img = np.zeros(word_label.shape, dtype=np.uint8)
                 dy = grad_e * dx
                 p = np.array(new_pp[-1]) + np.array([dx, dy, dx, dy])
-                cv2.line(
-                    line_img,
-                    (int(p[0]), int(p[1])),
-                    (int(p[2]), int(p[3])),
-                    1,
-                    thickness=1,
-                )
-                if (
-                    np.sum(np.logical_and(word_label, line_img)) == 0
-                    or r + 2 * step_r >= max_r
-                ):
+                if not _line_hits(word_label, p) or r + 2 * step_r >= max_r:
                     epp = p
                     isEppFound = True
             if isSppFound and isEppFound:
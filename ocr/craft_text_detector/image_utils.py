@@ -82,6 +82,83 @@ def resize_aspect_ratio(img, long_size, interpolation):
     return resized, ratio, size_heatmap
 
 
+def target_size(height, width, long_size):
+    """
+    Scale ratio, resized (h, w) and padded (h, w) (multiples of 32) used by
+    resize_aspect_ratio for an image of the given size.
+    """
+    ratio = long_size / max(height, width)
+    target_h, target_w = int(height * ratio), int(width * ratio)
+    return ratio, (target_h, target_w), (target_h + (-target_h % 32), target_w + (-target_w % 32))
+
+
+def normalization_lut(mean=(0.485, 0.456, 0.406), variance=(0.229, 0.224, 0.225)):
+    # normalizeMeanVariance of every uint8 value per channel, [3, 256];
+    # looking values up gives bit-identical results to normalizing
+    values = np.repeat(np.arange(256, dtype=np.uint8)[:, np.newaxis], 3, axis=1)
+    return np.ascontiguousarray(normalizeMeanVariance(values, mean, variance).T)
+
+
+def normalize_into(img, lut, out):
+    """
+    Normalizes uint8 [h, w, c] `img` into float32 [c, h, w] `out` with a
+    single lookup pass per channel.
+    """
+    for c in range(out.shape[0]):
+        np.take(lut[c], img[:, :, c], out=out[c])
+    return out
+
+
+class InputBuffer:
+    """
+    Reusable CraftNet input for one worker. resize() scales a uint8 image
+    straight into a padded staging buffer and normalizes it into a
+    [1, 3, h, w] float32 array. Both buffers grow to the largest page seen
+    and are reused for later pages. The returned array is overwritten by the
+    next call, so one buffer must not be shared between threads.
+    """
+
+    def __init__(self, mean=(0.485, 0.456, 0.406), variance=(0.229, 0.224, 0.225)):
+        self.lut = normalization_lut(mean, variance)
+        self._staging = np.empty(0, dtype=np.uint8)
+        self._input = np.empty(0, dtype=np.float32)
+
+    def _view(self, name, shape):
+        buffer = getattr(self, name)
+        size = int(np.prod(shape))
+        if buffer.size < size:
+            buffer = np.empty(size, dtype=buffer.dtype)
+            setattr(self, name, buffer)
+        return buffer[:size].reshape(shape)
+
+    def batch(self, batch_size, height, width):
+        """The reused float32 input viewed as [batch_size, 3, height, width]."""
+        return self._view("_input", (batch_size, 3, height, width))
+
+    def resize(self, img, long_size, interpolation, out=None):
+        """
+        Same sizes and values as resize_aspect_ratio + normalizeMeanVariance.
+        Writes into `out` ([3, h, w] of the padded size) if given, otherwise
+        into the buffer's own [1, 3, h, w] input.
+        """
+        height, width, channel = img.shape
+        ratio, (target_h, target_w), (target_h32, target_w32) = target_size(height, width, long_size)
+
+        staging = self._view("_staging", (target_h32, target_w32, channel))
+        cv2.resize(img, (target_w, target_h), dst=staging[:target_h, :target_w], interpolation=interpolation)
+        staging[target_h:] = 0
+        staging[:target_h, target_w:] = 0
+
+        if out is None:
+            x = self.batch(1, target_h32, target_w32)
+            normalize_into(staging, self.lut, x[0])
+        else:
+            x = normalize_into(staging, self.lut, out)
+
+        size_heatmap = (int(target_w32 / 2), int(target_h32 / 2))
+        return x, ratio, size_heatmap
+
+
 def cvt2HeatmapImg(img):
     img = (np.clip(img, 0, 1) * 255).astype(np.uint8)
     img = cv2.applyColorMap(img, cv2.COLORMAP_JET)
@@ -0,0 +1,77 @@
+import os
+from pathlib import Path
+from typing import Optional, Union
+
+# Exported graphs take and return the same tensors as the torch modules, with
+# batch and spatial dimensions left dynamic so any image size can be run.
+CRAFTNET_IO = {
+    "input_names": ["image"],
+    "output_names": ["y", "feature"],
+    "dynamic_axes": {
+        "image": {0: "batch", 2: "height", 3: "width"},
+        "y": {0: "batch", 1: "map_height", 2: "map_width"},
+        "feature": {0: "batch", 2: "map_height", 3: "map_width"},
+    },
+}
+REFINENET_IO = {
+    "input_names": ["y", "feature"],
+    "output_names": ["y_refiner"],
+    "dynamic_axes": {
+        "y": {0: "batch", 1: "map_height", 2: "map_width"},
+        "feature": {0: "batch", 2: "map_height", 3: "map_width"},
+        "y_refiner": {0: "batch", 1: "map_height", 2: "map_width"},
+    },
+}
+OPSET_VERSION = 17
+CRAFTNET_FILE = "craftnet.onnx"
+REFINENET_FILE = "refinenet.onnx"
+
+
+class OnnxModel:
+    """
+    Runs an exported CraftNet/RefineNet graph with ONNX Runtime on the CPU.
+    Called like the torch module, but takes and returns numpy arrays.
+    """
+
+    def __init__(self, path: Union[str, Path], num_threads: Optional[int] = None):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            str(path), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def __call__(self, *inputs):
+        outputs = self.session.run(None, dict(zip(self.input_names, inputs)))
+        return outputs[0] if len(outputs) == 1 else tuple(outputs)
+
+
+def load_onnx_model(weight_path: Union[str, Path]) -> OnnxModel:
+    if not os.path.isfile(weight_path):
+        raise FileNotFoundError(
+            "ONNX graph not found at {}. Export it first with ocr/export_onnx.py".format(weight_path)
+        )
+    return OnnxModel(weight_path)
+
+
+def export_craftnet(craft_net, path: Union[str, Path], sample_size=(384, 384)):
+    import torch
+
+    image = torch.zeros(1, 3, *sample_size)
+    with torch.no_grad():
+        torch.onnx.export(
+            craft_net, (image,), str(path), opset_version=OPSET_VERSION, dynamo=False, **CRAFTNET_IO
+        )
+
+
+def export_refinenet(refine_net, craft_net, path: Union[str, Path], sample_size=(384, 384)):
+    import torch
+
+    with torch.no_grad():
+        y, feature = craft_net(torch.zeros(1, 3, *sample_size))
+        torch.onnx.export(
+            refine_net, (y, feature), str(path), opset_version=OPSET_VERSION, dynamo=False, **REFINENET_IO
+        )
@@ -1,5 +1,6 @@
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
 import numpy as np
@@ -7,6 +8,7 @@ import numpy as np
 import craft_text_detector.craft_utils as craft_utils
 import craft_text_detector.image_utils as image_utils
 import craft_text_detector.torch_utils as torch_utils
+from craft_text_detector.onnx_utils import OnnxModel
 
 
 def get_prediction(
@@ -19,6 +21,12 @@ def get_prediction(
     cuda: bool = False,
     long_size: int = 1280,
     poly: bool = True,
+    heatmaps: bool = True,
+    tile_size: int = None,
+    tile_overlap: int = 64,
+    tile_batch_size: int = 4,
+    tile_workers: int = 1,
+    input_buffer: image_utils.InputBuffer = None,
 ):
     """
     Arguments:
@@ -33,52 +41,282 @@ def get_prediction(
         canvas_size: image size for inference
         long_size: desired longest image size for inference
         poly: enable polygon type
+        heatmaps: render the score maps as heatmap images
+        tile_size: run CraftNet/RefineNet on overlapping square tiles of this
+            size (multiple of 32) instead of the whole resized image, so
+            memory stays bounded however large long_size is
+        tile_overlap: overlap between neighbouring tiles (multiple of 32)
+        tile_batch_size: tiles per forward pass
+        tile_workers: micro-batches of tiles run concurrently
+        input_buffer: image_utils.InputBuffer reused across calls (untiled)
     Output:
         {"masks": lists of predicted masks 2d as bool array,
          "boxes": list of coords of points of predicted boxes,
          "boxes_as_ratios": list of coords of points of predicted boxes as ratios of image size,
          "polys_as_ratios": list of coords of points of predicted polys as ratios of image size,
-         "heatmaps": visualizations of the detected characters/links,
+         "heatmaps": visualizations of the detected characters/links (None if not rendered),
          "times": elapsed times of the sub modules, in seconds}
     """
     t0 = time.time()
 
     # read/convert image
     image = image_utils.read_image(image)
+    read_time = time.time() - t0
 
-    # resize
-    img_resized, target_ratio, size_heatmap = image_utils.resize_aspect_ratio(
-        image, long_size, interpolation=cv2.INTER_LINEAR
+    if tile_size:
+        score_text, score_link, target_ratio, times = _forward_tiled(
+            image, craft_net, refine_net, cuda, long_size,
+            tile_size, tile_overlap, tile_batch_size, tile_workers,
+        )
+    else:
+        score_text, score_link, target_ratio, times = _forward(
+            image, craft_net, refine_net, cuda, long_size, input_buffer
+        )
+    times["resize_time"] += read_time
+    return _postprocess(
+        image, score_text, score_link, target_ratio, times,
+        text_threshold, link_threshold, low_text, poly, heatmaps,
     )
-    ratio_h = ratio_w = 1 / target_ratio
-    resize_time = time.time() - t0
+
+
+def get_prediction_batch(
+    images,
+    craft_net,
+    refine_net=None,
+    text_threshold: float = 0.7,
+    link_threshold: float = 0.4,
+    low_text: float = 0.4,
+    cuda: bool = False,
+    long_size: int = 1280,
+    poly: bool = True,
+    heatmaps: bool = True,
+    batch_size: int = 4,
+    input_buffer: image_utils.InputBuffer = None,
+):
+    """
+    get_prediction for several images. Images that resize to the same padded
+    size (multiples of 32) are stacked into one CraftNet/RefineNet forward
+    pass, up to batch_size at a time. Returns one result per image, in the
+    order of `images`; the times of a shared forward pass are split evenly.
+    """
     t0 = time.time()
+    images = [image_utils.read_image(image) for image in images]
+    read_time = (time.time() - t0) / max(len(images), 1)
+    if input_buffer is None:
+        input_buffer = image_utils.InputBuffer()
+    thresholds = (text_threshold, link_threshold, low_text)
+
+    # bucket by padded input size
+    buckets = {}
+    for index, image in enumerate(images):
+        _, _, padded_size = image_utils.target_size(image.shape[0], image.shape[1], long_size)
+        key = padded_size if image.dtype == np.uint8 else index
+        buckets.setdefault(key, []).append(index)
+
+    results = [None] * len(images)
+    for key, indices in buckets.items():
+        if not isinstance(key, tuple):
+            # not uint8: no table lookup, predict on its own
+            image = images[key]
+            score_text, score_link, target_ratio, times = _forward(
+                image, craft_net, refine_net, cuda, long_size
+            )
+            times["resize_time"] += read_time
+            results[key] = _postprocess(
+                image, score_text, score_link, target_ratio, times, *thresholds, poly, heatmaps
+            )
+            continue
+
+        for start in range(0, len(indices), batch_size):
+            batch = indices[start:start + batch_size]
+            t0 = time.time()
+            x = input_buffer.batch(len(batch), *key)
+            ratios = [
+                input_buffer.resize(images[index], long_size, cv2.INTER_LINEAR, out=x[i])[1]
+                for i, index in enumerate(batch)
+            ]
+            resize_time = time.time() - t0
+
+            score_text, score_link, batch_times = _run_nets(x, craft_net, refine_net, cuda)
+            batch_times["resize_time"] = resize_time
+            for i, index in enumerate(batch):
+                times = {name: seconds / len(batch) for name, seconds in batch_times.items()}
+                times["resize_time"] += read_time
+                results[index] = _postprocess(
+                    images[index], score_text[i], score_link[i], ratios[i], times,
+                    *thresholds, poly, heatmaps,
+                )
+    return results
+
+
+def _run_nets(batch, craft_net, refine_net, cuda):
+    """
+    Runs CraftNet (and RefineNet) on a batch of normalized [b, c, h, w]
+    float32 images. Returns the text and link score maps as [b, h/2, w/2]
+    arrays.
+    """
+    times = {}
+    t0 = time.time()
+
+    # ONNX Runtime graphs take and return numpy arrays
+    onnx = isinstance(craft_net, OnnxModel)
 
     # preprocessing
-    x = image_utils.normalizeMeanVariance(img_resized)
-    x = torch_utils.from_numpy(x).permute(2, 0, 1)  # [h, w, c] to [c, h, w]
-    x = torch_utils.Variable(x.unsqueeze(0))  # [c, h, w] to [b, c, h, w]
-    if cuda:
-        x = x.cuda()
-    preprocessing_time = time.time() - t0
+    if onnx:
+        x = batch
+    else:
+        x = torch_utils.Variable(torch_utils.from_numpy(batch))
+        if cuda:
+            x = x.cuda()
+    times["preprocessing_time"] = time.time() - t0
     t0 = time.time()
 
     # forward pass
-    with torch_utils.no_grad():
+    if onnx:
         y, feature = craft_net(x)
-    craftnet_time = time.time() - t0
+    else:
+        with torch_utils.no_grad():
+            y, feature = craft_net(x)
+    times["craftnet_time"] = time.time() - t0
     t0 = time.time()
 
     # make score and link map
-    score_text = y[0, :, :, 0].cpu().data.numpy()
-    score_link = y[0, :, :, 1].cpu().data.numpy()
+    if onnx:
+        score_text = y[:, :, :, 0]
+        score_link = y[:, :, :, 1]
+    else:
+        score_text = y[:, :, :, 0].cpu().data.numpy()
+        score_link = y[:, :, :, 1].cpu().data.numpy()
 
     # refine link
     if refine_net is not None:
-        with torch_utils.no_grad():
-            y_refiner = refine_net(y, feature)
-        score_link = y_refiner[0, :, :, 0].cpu().data.numpy()
-    refinenet_time = time.time() - t0
+        if onnx:
+            score_link = refine_net(y, feature)[:, :, :, 0]
+        else:
+            with torch_utils.no_grad():
+                y_refiner = refine_net(y, feature)
+            score_link = y_refiner[:, :, :, 0].cpu().data.numpy()
+    times["refinenet_time"] = time.time() - t0
+
+    return score_text, score_link, times
+
+
+def _forward(image, craft_net, refine_net, cuda, long_size, input_buffer=None):
+    t0 = time.time()
+
+    if image.dtype == np.uint8:
+        # resize into the padded buffer and normalize by table lookup
+        if input_buffer is None:
+            input_buffer = image_utils.InputBuffer()
+        x, target_ratio, size_heatmap = input_buffer.resize(
+            image, long_size, interpolation=cv2.INTER_LINEAR
+        )
+        resize_time = time.time() - t0
+        normalize_time = 0.0
+    else:
+        img_resized, target_ratio, size_heatmap = image_utils.resize_aspect_ratio(
+            image, long_size, interpolation=cv2.INTER_LINEAR
+        )
+        resize_time = time.time() - t0
+        t0 = time.time()
+        x = image_utils.normalizeMeanVariance(img_resized)
+        x = np.ascontiguousarray(x.transpose(2, 0, 1)[np.newaxis])  # [h, w, c] to [b, c, h, w]
+        normalize_time = time.time() - t0
+
+    score_text, score_link, times = _run_nets(x, craft_net, refine_net, cuda)
+    times["resize_time"] = resize_time
+    times["preprocessing_time"] += normalize_time
+    return score_text[0], score_link[0], target_ratio, times
+
+
+def _tile_starts(length, tile_size, tile_overlap):
+    return list(range(0, max(length - tile_overlap, 1), tile_size - tile_overlap))
+
+
+def _forward_tiled(
+    image, craft_net, refine_net, cuda, long_size,
+    tile_size, tile_overlap, tile_batch_size, tile_workers,
+):
+    """
+    Same maps as _forward, computed tile by tile. Each tile contributes the
+    part of its maps that is closer to its own centre than to a neighbour's,
+    so the seams fall in the middle of the overlaps, away from tile borders.
+    """
+    if tile_size % 32 or tile_overlap % 32 or not 0 <= tile_overlap < tile_size:
+        raise ValueError(
+            "tile_size and tile_overlap must be multiples of 32, with tile_overlap < tile_size"
+        )
+    t0 = time.time()
+
+    # resize without padding to a float canvas: tiles are padded one by one
+    height, width = image.shape[:2]
+    target_ratio = long_size / max(height, width)
+    target_h, target_w = int(height * target_ratio), int(width * target_ratio)
+    img_resized = cv2.resize(image, (target_w, target_h), interpolation=cv2.INTER_LINEAR)
+    lut = image_utils.normalization_lut()
+    map_h, map_w = -(-target_h // 32) * 16, -(-target_w // 32) * 16
+    score_text = np.zeros((map_h, map_w), dtype=np.float32)
+    score_link = np.zeros((map_h, map_w), dtype=np.float32)
+    times = {
+        "resize_time": time.time() - t0,
+        "preprocessing_time": 0.0,
+        "craftnet_time": 0.0,
+        "refinenet_time": 0.0,
+    }
+
+    def own_range(start, starts, length):
+        # part of a tile's map written to the page map, in map coordinates
+        lo = start + tile_overlap // 2 if start else 0
+        hi = start + tile_size - tile_overlap // 2 if start != starts[-1] else length
+        return lo // 2, hi // 2, (lo - start) // 2
+
+    rows = _tile_starts(target_h, tile_size, tile_overlap)
+    cols = _tile_starts(target_w, tile_size, tile_overlap)
+    tiles = [(y0, x0) for y0 in rows for x0 in cols]
+
+    def run_batch(batch):
+        t0 = time.time()
+        tile = np.zeros((tile_size, tile_size, 3), dtype=img_resized.dtype)
+        x = np.empty((len(batch), 3, tile_size, tile_size), dtype=np.float32)
+        for i, (y0, x0) in enumerate(batch):
+            crop = img_resized[y0:y0 + tile_size, x0:x0 + tile_size]
+            tile[:crop.shape[0], :crop.shape[1]] = crop
+            tile[crop.shape[0]:] = 0
+            tile[:, crop.shape[1]:] = 0
+            if tile.dtype == np.uint8:
+                image_utils.normalize_into(tile, lut, x[i])
+            else:
+                x[i] = image_utils.normalizeMeanVariance(tile).transpose(2, 0, 1)
+        normalize_time = time.time() - t0
+
+        batch_text, batch_link, batch_times = _run_nets(x, craft_net, refine_net, cuda)
+        batch_times["preprocessing_time"] += normalize_time
+        for i, (y0, x0) in enumerate(batch):
+            top, bottom, ty = own_range(y0, rows, map_h * 2)
+            left, right, tx = own_range(x0, cols, map_w * 2)
+            score_text[top:bottom, left:right] = batch_text[i, ty:ty + bottom - top, tx:tx + right - left]
+            score_link[top:bottom, left:right] = batch_link[i, ty:ty + bottom - top, tx:tx + right - left]
+        return batch_times
+
+    batches = [tiles[i:i + tile_batch_size] for i in range(0, len(tiles), tile_batch_size)]
+    if tile_workers > 1:
+        # tiles write disjoint parts of the maps, so batches can run in any order
+        with ThreadPoolExecutor(max_workers=tile_workers) as pool:
+            batch_times = list(pool.map(run_batch, batches))
+    else:
+        batch_times = [run_batch(batch) for batch in batches]
+    for batch_time in batch_times:
+        for name, seconds in batch_time.items():
+            times[name] += seconds
+
+    return score_text, score_link, target_ratio, times
+
+
+def _postprocess(
+    image, score_text, score_link, target_ratio, times,
+    text_threshold, link_threshold, low_text, poly, heatmaps,
+):
+    ratio_h = ratio_w = 1 / target_ratio
     t0 = time.time()
 
     # Post-processing
@@ -109,27 +347,21 @@ def get_prediction(
         polys_as_ratio.append(poly / [img_width, img_height])
     polys_as_ratio = np.array(polys_as_ratio)
 
-    text_score_heatmap = image_utils.cvt2HeatmapImg(score_text)
-    link_score_heatmap = image_utils.cvt2HeatmapImg(score_link)
+    if heatmaps:
+        heatmaps = {
+            "text_score_heatmap": image_utils.cvt2HeatmapImg(score_text),
+            "link_score_heatmap": image_utils.cvt2HeatmapImg(score_link),
+        }
+    else:
+        heatmaps = None
 
-    postprocess_time = time.time() - t0
-
-    times = {
-        "resize_time": resize_time,
-        "preprocessing_time": preprocessing_time,
-        "craftnet_time": craftnet_time,
-        "refinenet_time": refinenet_time,
-        "postprocess_time": postprocess_time,
-    }
+    times["postprocess_time"] = time.time() - t0
 
     return {
         "boxes": boxes,
         "boxes_as_ratios": boxes_as_ratio,
         "polys": polys,
         "polys_as_ratios": polys_as_ratio,
-        "heatmaps": {
-            "text_score_heatmap": text_score_heatmap,
-            "link_score_heatmap": link_score_heatmap,
-        },
+        "heatmaps": heatmaps,
         "times": times,
     }
@@ -1,5 +1,14 @@
-from torch import from_numpy, load, no_grad
-from torch.autograd import Variable
-from torch.backends.cudnn import benchmark as cudnn_benchmark
-from torch.cuda import empty_cache as empty_cuda_cache
-from torch.nn import DataParallel
+try:
+    from torch import device, from_numpy, load, no_grad, save
+    from torch.autograd import Variable
+    from torch.backends.cudnn import benchmark as cudnn_benchmark
+    from torch.cuda import empty_cache as empty_cuda_cache
+    from torch.nn import BatchNorm2d, Conv2d, DataParallel, Identity, Sequential
+    from torch.nn.utils.fusion import fuse_conv_bn_eval
+except ImportError:
+    # torch is optional when the ONNX Runtime backend is used
+    device = from_numpy = load = no_grad = save = Variable = cudnn_benchmark = DataParallel = None
+    BatchNorm2d = Conv2d = Identity = Sequential = fuse_conv_bn_eval = None
+
+    def empty_cuda_cache():
+        pass
@@ -0,0 +1,266 @@
+"""
+Exports CraftNet, RefineNet and the TrOCR encoder/decoder to ONNX for the
+ONNX Runtime backend (OCR_BACKEND = "onnx" in ocr_settings.py). Runs in the
+OCR venv, which has torch and transformers; the exported graphs don't.
+
+    .venv_ocr_craft/bin/python ocr/export_onnx.py [--output-dir DIR] [--skip-craft] [--skip-trocr]
+
+After exporting, each graph is run next to its torch module on random input
+and the largest output difference is printed; the TrOCR decoders must match
+transformers within DECODER_TOLERANCE, the cached one over several steps.
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import torch
+from transformers import TrOCRProcessor, VisionEncoderDecoderModel
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from craft_text_detector import craft_utils, onnx_utils
+from craft_text_detector.onnx_utils import CRAFTNET_FILE, REFINENET_FILE
+from ocr_settings import ONNX_MODEL_DIR, TROCR_SETTINGS
+from trocr_onnx import CONFIG_FILE, DECODER_FILE, DECODER_WITH_PAST_FILE, ENCODER_FILE, TOKENIZER_FILE
+
+
+class TrOCREncoder(torch.nn.Module):
+    """Image encoder plus the projection VisionEncoderDecoderModel applies before the decoder."""
+
+    def __init__(self, model: VisionEncoderDecoderModel):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        hidden_states = self.model.encoder(pixel_values=pixel_values).last_hidden_state
+        if (self.model.encoder.config.hidden_size != self.model.decoder.config.hidden_size
+                and self.model.decoder.config.cross_attention_hidden_size is None):
+            hidden_states = self.model.enc_to_dec_proj(hidden_states)
+        return hidden_states
+
+
+class TrOCRDecoderStep(torch.nn.Module):
+    """
+    Logits of the next token for every sequence, plus the decoder cache: the
+    self- and cross-attention keys/values of every layer, flattened. The
+    search loop lives in trocr_onnx.py.
+    """
+
+    def __init__(self, model: VisionEncoderDecoderModel):
+        super().__init__()
+        self.decoder = model.decoder
+
+    def forward(self, input_ids, encoder_hidden_states):
+        output = self.decoder(input_ids=input_ids, encoder_hidden_states=encoder_hidden_states, use_cache=True)
+        return (output.logits[:, -1, :],) + tuple(state for layer in output.past_key_values for state in layer)
+
+
+class TrOCRDecoderStepWithPast(torch.nn.Module):
+    """
+    Next-token logits from the last token of each sequence and the cache of
+    the previous steps; returns the self-attention keys/values grown by one
+    position. The cross-attention keys/values stay the same for every step.
+    """
+
+    def __init__(self, model: VisionEncoderDecoderModel):
+        super().__init__()
+        self.decoder = model.decoder
+
+    def forward(self, input_ids, encoder_hidden_states, *past):
+        past_key_values = tuple(past[i:i + 4] for i in range(0, len(past), 4))
+        # the cross-attention reads its cached keys/values, but the decoder
+        # still gets the real encoder output: it may check its shape or build
+        # the encoder attention mask from it
+        output = self.decoder(input_ids=input_ids, encoder_hidden_states=encoder_hidden_states,
+                              past_key_values=past_key_values, use_cache=True)
+        return (output.logits[:, -1, :],) + tuple(state for layer in output.past_key_values for state in layer[:2])
+
+
+# largest logit difference accepted between the exported decoders and the
+# transformers decoder
+DECODER_TOLERANCE = 1e-3
+
+# greedy steps checked with the cached decoder
+CHECK_STEPS = 5
+
+
+def decoder_cache_names(prefix: str, num_layers: int, cross: bool = True) -> list:
+    # same naming as Hugging Face Optimum's decoder exports
+    kinds = ("decoder", "encoder") if cross else ("decoder",)
+    return [f"{prefix}.{layer}.{kind}.{part}" for layer in range(num_layers) for kind in kinds for part in ("key", "value")]
+
+
+def run_onnx(path: str, inputs: dict):
+    return onnx_utils.OnnxModel(path)(*inputs.values())
+
+
+def export_craft(output_dir: str) -> None:
+    craft_net = craft_utils.load_craftnet_model(cuda=False)
+    refine_net = craft_utils.load_refinenet_model(cuda=False)
+    craftnet_path = os.path.join(output_dir, CRAFTNET_FILE)
+    refinenet_path = os.path.join(output_dir, REFINENET_FILE)
+    onnx_utils.export_craftnet(craft_net, craftnet_path)
+    onnx_utils.export_refinenet(refine_net, craft_net, refinenet_path)
+
+    # check on a different size than the export sample: the axes are dynamic
+    image = torch.randn(1, 3, 512, 320)
+    with torch.no_grad():
+        y, feature = craft_net(image)
+        y_refiner = refine_net(y, feature)
+    onnx_y, onnx_feature = run_onnx(craftnet_path, {"image": image.numpy()})
+    onnx_y_refiner = run_onnx(refinenet_path, {"y": y.numpy(), "feature": feature.numpy()})
+    print(f"CraftNet  -> {craftnet_path} (max diff {np.abs(onnx_y - y.numpy()).max():.2e})")
+    print(f"RefineNet -> {refinenet_path} (max diff {np.abs(onnx_y_refiner - y_refiner.numpy()).max():.2e})")
+
+
+def export_trocr(output_dir: str) -> None:
+    model_name = TROCR_SETTINGS["model_name"]
+    processor = TrOCRProcessor.from_pretrained(model_name)
+    model = VisionEncoderDecoderModel.from_pretrained(model_name).to('cpu').eval()
+    image_processor = processor.image_processor
+    tokenizer = processor.tokenizer
+
+    encoder = TrOCREncoder(model).eval()
+    pixel_values = torch.randn(2, 3, image_processor.size["height"], image_processor.size["width"])
+    input_ids = torch.full((2, 3), tokenizer.cls_token_id, dtype=torch.long)
+    encoder_path = os.path.join(output_dir, ENCODER_FILE)
+    with torch.no_grad():
+        encoder_hidden_states = encoder(pixel_values)
+        torch.onnx.export(
+            encoder, (pixel_values,), encoder_path,
+            input_names=["pixel_values"], output_names=["encoder_hidden_states"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "encoder_hidden_states": {0: "batch"}},
+            opset_version=onnx_utils.OPSET_VERSION, dynamo=False,
+        )
+    export_trocr_decoder(model, input_ids, encoder_hidden_states, output_dir)
+
+    tokenizer.backend_tokenizer.save(os.path.join(output_dir, TOKENIZER_FILE))
+    config = {
+        "model_name": model_name,
+        "image_size": [image_processor.size["width"], image_processor.size["height"]],
+        "image_mean": list(image_processor.image_mean),
+        "image_std": list(image_processor.image_std),
+        "rescale_factor": image_processor.rescale_factor,
+        "resample": int(image_processor.resample),
+        "decoder_start_token_id": tokenizer.cls_token_id,
+        "eos_token_id": tokenizer.sep_token_id,
+        "pad_token_id": tokenizer.pad_token_id,
+        "clean_up_tokenization_spaces": bool(tokenizer.clean_up_tokenization_spaces),
+    }
+    with open(os.path.join(output_dir, CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+
+    onnx_hidden_states = run_onnx(encoder_path, {"pixel_values": pixel_values.numpy()})
+    print(f"TrOCR encoder -> {encoder_path} "
+          f"(max diff {np.abs(onnx_hidden_states - encoder_hidden_states.numpy()).max():.2e})")
+
+
+def export_trocr_decoder(model: VisionEncoderDecoderModel, input_ids, encoder_hidden_states, output_dir: str) -> None:
+    """
+    Exports the decoder twice: DECODER_FILE runs the first step on the whole
+    prompt and returns the cache, DECODER_WITH_PAST_FILE runs every later
+    step on the last token only, so decoding no longer recomputes all
+    previous positions at each step.
+    """
+    decoder = TrOCRDecoderStep(model).eval()
+    decoder_with_past = TrOCRDecoderStepWithPast(model).eval()
+    num_layers = model.decoder.config.decoder_layers
+    present_names = decoder_cache_names("present", num_layers)
+    past_names = decoder_cache_names("past_key_values", num_layers)
+    self_present_names = decoder_cache_names("present", num_layers, cross=False)
+    decoder_path = os.path.join(output_dir, DECODER_FILE)
+    decoder_with_past_path = os.path.join(output_dir, DECODER_WITH_PAST_FILE)
+    cache_axes = {0: "batch", 2: "past_sequence"}
+
+    with torch.no_grad():
+        logits, *past = decoder(input_ids, encoder_hidden_states)
+        next_ids = logits.argmax(dim=-1, keepdim=True)
+        torch.onnx.export(
+            decoder, (input_ids, encoder_hidden_states), decoder_path,
+            input_names=["input_ids", "encoder_hidden_states"], output_names=["logits"] + present_names,
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "encoder_hidden_states": {0: "batch"},
+                "logits": {0: "batch"},
+                **{name: cache_axes for name in present_names},
+            },
+            opset_version=onnx_utils.OPSET_VERSION, dynamo=False,
+        )
+        torch.onnx.export(
+            decoder_with_past, (next_ids, encoder_hidden_states, *past), decoder_with_past_path,
+            input_names=["input_ids", "encoder_hidden_states"] + past_names,
+            output_names=["logits"] + self_present_names,
+            dynamic_axes={
+                "input_ids": {0: "batch"},
+                "encoder_hidden_states": {0: "batch"},
+                "logits": {0: "batch"},
+                **{name: cache_axes for name in past_names + self_present_names},
+            },
+            opset_version=onnx_utils.OPSET_VERSION, dynamo=False,
+        )
+
+    onnx_logits, *onnx_past = run_onnx(decoder_path, {
+        "input_ids": input_ids.numpy(),
+        "encoder_hidden_states": encoder_hidden_states.numpy(),
+    })
+    diff = np.abs(onnx_logits - logits.numpy()).max()
+    print(f"TrOCR decoder -> {decoder_path} (max diff {diff:.2e})")
+    if diff > DECODER_TOLERANCE:
+        raise RuntimeError(f"Exported TrOCR decoder differs from transformers by {diff:.2e}")
+
+    diffs = check_decoder_with_past(model, decoder_with_past_path, input_ids, encoder_hidden_states, onnx_past)
+    print(f"TrOCR decoder with past -> {decoder_with_past_path} "
+          f"(max diff over {len(diffs)} steps {max(diffs):.2e})")
+    if max(diffs) > DECODER_TOLERANCE:
+        raise RuntimeError(f"Exported TrOCR decoder with past differs from transformers by {diffs} over the steps")
+
+
+def check_decoder_with_past(model: VisionEncoderDecoderModel, decoder_with_past_path: str, input_ids,
+                            encoder_hidden_states, past: list) -> list:
+    """
+    Decodes CHECK_STEPS greedy tokens with the exported cached decoder and
+    compares each step's logits with the transformers decoder run without a
+    cache on the whole sequence. Returns the largest difference per step.
+    """
+    decoder_with_past = onnx_utils.OnnxModel(decoder_with_past_path)
+    num_layers = model.decoder.config.decoder_layers
+    past_names = decoder_cache_names("past_key_values", num_layers)
+    self_cache = [i for i, name in enumerate(past_names) if ".decoder." in name]
+    sequences = input_ids
+    next_ids = None
+    diffs = []
+    with torch.no_grad():
+        for _ in range(CHECK_STEPS):
+            reference = model.decoder(input_ids=sequences, encoder_hidden_states=encoder_hidden_states).logits[:, -1, :]
+            if next_ids is not None:
+                # fed by name: the exporter drops inputs a graph doesn't read
+                inputs = {"input_ids": next_ids.numpy(), "encoder_hidden_states": encoder_hidden_states.numpy(),
+                          **dict(zip(past_names, past))}
+                logits, *present = decoder_with_past.session.run(
+                    None, {name: inputs[name] for name in decoder_with_past.input_names})
+                # only the self-attention keys/values grow; the cross ones stay
+                for i, state in zip(self_cache, present):
+                    past[i] = state
+                diffs.append(float(np.abs(logits - reference.numpy()).max()))
+            next_ids = reference.argmax(dim=-1, keepdim=True)
+            sequences = torch.cat([sequences, next_ids], dim=1)
+    return diffs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the OCR models to ONNX.")
+    parser.add_argument('--output-dir', default=ONNX_MODEL_DIR, help="Where to write the graphs.")
+    parser.add_argument('--skip-craft', action='store_true', help="Don't export CraftNet/RefineNet.")
+    parser.add_argument('--skip-trocr', action='store_true', help="Don't export the TrOCR encoder/decoder.")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    if not args.skip_craft:
+        export_craft(args.output_dir)
+    if not args.skip_trocr:
+        export_trocr(args.output_dir)
+
+
+if __name__ == "__main__":
+    main()
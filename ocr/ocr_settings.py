@@ -0,0 +1,80 @@
+# Settings shared by trocr_craft.py and main.py. Kept free of heavy imports
+# so the main venv can fingerprint them for the stage cache.
+import os
+
+CRAFT_SETTINGS = {
+    "text_threshold": 0.8,
+    "link_threshold": 0.4,
+    "low_text": 0.4,
+    "cuda": False,
+    # link refinement with RefineNet; False skips its forward pass (faster,
+    # but links come straight from CraftNet, so boxes can differ)
+    "refiner": True,
+    # fold BatchNorm into the convolutions of CraftNet/RefineNet (CPU only)
+    "fuse_conv_bn": False,
+    # longest side the page is resized to for detection. Small handwriting on
+    # high-dpi scans needs more than 1280; pair larger values with tile_size
+    # (e.g. 2560 and 768) so CraftNet runs on overlapping tiles and memory
+    # stays bounded
+    "long_size": 1280,
+    "tile_size": None,
+    "tile_overlap": 64,
+}
+
+TROCR_SETTINGS = {
+    "model_name": "microsoft/trocr-base-handwritten",
+    "num_beams": 5,
+    "early_stopping": True,
+    "max_length": 80,
+    "no_repeat_ngram_size": 3,
+    "length_penalty": 2.0,
+    # "beam": beam search on every line. "greedy": greedy decoding only.
+    # "adaptive": greedy first, then beam search only for lines whose mean
+    # token probability is below min_confidence. Adaptive is opt-in: lines
+    # above the threshold keep their greedy text, which can differ from the
+    # beam output, and min_confidence hasn't been calibrated against beam
+    # search on real pages yet. Compare the outputs (trocr_escalated_lines and
+    # trocr_line_decode_s in the OCR trace) before making it the default.
+    "decoding": "beam",
+    "min_confidence": 0.8,
+    # dynamic int8 quantization of the encoder/decoder Linear layers (CPU)
+    "quantize": False,
+}
+
+# Pages of a PDF without a text layer are rendered at this resolution and
+# go through CRAFT + TrOCR like an image.
+PDF_SETTINGS = {
+    "ocr_dpi": 300,
+}
+
+# Number of text lines recognized per TrOCR forward pass. Only affects speed
+# and memory, so it is kept out of TROCR_SETTINGS (and the cache key).
+TROCR_BATCH_SIZE = 8
+
+# Lines per forward pass when TROCR_SETTINGS["quantize"] is on. int8 beam
+# search peaked at 3.9 GB RSS with 4 lines and was OOM-killed with 8 on a
+# 5.7 GB host (the dequantized activations outweigh the smaller weights), so
+# the quantized mode runs smaller batches. Needs about 4 GB free.
+TROCR_QUANTIZED_BATCH_SIZE = 4
+
+# Tiles per CraftNet forward pass and tile batches run concurrently when
+# CRAFT_SETTINGS["tile_size"] is set. Speed/memory only, like TROCR_BATCH_SIZE.
+CRAFT_TILE_BATCH_SIZE = 4
+CRAFT_TILE_WORKERS = max(1, min(4, (os.cpu_count() or 1) // 2))
+
+# Scanned PDF pages OCR'd concurrently: each slot keeps one OCR process
+# (loading the models once) for all the pages it gets, or queues them on the
+# warm worker. Speed only.
+PDF_OCR_WORKERS = max(1, min(4, (os.cpu_count() or 1) // 2))
+
+# Inference backend: "torch", or "onnx" to run the graphs exported by
+# ocr/export_onnx.py on ONNX Runtime. Produces the same boxes and texts, so
+# it is kept out of the cache key as well.
+OCR_BACKEND = "torch"
+
+# Load the torch weights from converted copies memory-mapped from disk (made
+# on first use next to the originals): no unpickling or key-rewriting copies
+# at start-up, and OCR workers on one host share the pages. Same weights, so
+# outside the cache key too.
+MMAP_WEIGHTS = True
+ONNX_MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "onnx")
@@ -1,20 +1,93 @@
+import argparse
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from PyPDF2 import PdfReader
 
-def is_text_pdf(pdf_path):
+# Text extraction is pure Python and CPU bound, so long documents are split
+# into runs of consecutive pages extracted in separate processes. Shorter
+# documents aren't worth starting a pool for.
+PDF_WORKERS = max(1, min(4, os.cpu_count() or 1))
+PAGES_PER_WORKER = 16
+# Page texts are joined with a blank line, so page breaks stay visible to
+# whatever splits the text later (e.g. the lecture sections of nlp_model).
+PAGE_SEPARATOR = "\n\n"
+
+def parse_page_range(spec, page_count):
+    """
+    "1-3,7,10-" -> [0, 1, 2, 6, 9, ..., page_count - 1]. Pages are 1-based in
+    the spec and 0-based in the result; pages past the end are dropped.
+    """
+    pages = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, dash, last = part.partition("-")
+        first = int(first) if first else 1
+        last = (int(last) if last else page_count) if dash else first
+        if first < 1 or last < first:
+            raise ValueError(f"Invalid page range: {part}")
+        pages.extend(range(first - 1, min(last, page_count)))
+    return pages
+
+def _extract_pages(pdf_path, page_numbers):
+    # runs in the pool: each worker opens the file itself, PdfReader can't be pickled
     reader = PdfReader(pdf_path)
-    return any(page.extract_text() for page in reader.pages)
+    return [reader.pages[i].extract_text() for i in page_numbers]
 
-def extract_text_from_pdf(pdf_path):
+def iter_page_texts(pdf_path, pages=None, workers=None):
+    """
+    Yields (page_number, text) in page order, extracting each page only when
+    it is needed: stop iterating and the remaining pages are never read.
+    `pages` selects 0-based page numbers (default: all pages). With more than
+    one worker, runs of PAGES_PER_WORKER pages are extracted in a process
+    pool ahead of the consumer.
+    """
     reader = PdfReader(pdf_path)
-    all_text = ""
-    for page in reader.pages:
-        page_text = page.extract_text()
-        if page_text:
-            all_text += page_text + "\n"
-    return all_text.strip()
-
-def analyze_and_save(pdf_path):
+    if pages is None:
+        pages = range(len(reader.pages))
+    pages = list(pages)
+    if workers is None:
+        workers = min(PDF_WORKERS, len(pages) // PAGES_PER_WORKER)
+
+    if workers <= 1:
+        for i in pages:
+            yield i, reader.pages[i].extract_text()
+        return
+
+    runs = [pages[i:i + PAGES_PER_WORKER] for i in range(0, len(pages), PAGES_PER_WORKER)]
+    # spawned, not forked: in --batch mode main.py calls this from a thread
+    # pool, and forking a threaded process can deadlock the child
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        futures = [executor.submit(_extract_pages, pdf_path, run) for run in runs]
+        for run, future in zip(runs, futures):
+            yield from zip(run, future.result())
+    finally:
+        # an early stop drops the runs that haven't started
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def has_text(text):
+    # pages with no text layer (scans, pasted images) extract as "" or whitespace
+    return bool(text and text.strip())
+
+def is_text_pdf(pdf_path):
+    # stops at the first page with text
+    return any(text for _, text in iter_page_texts(pdf_path, workers=1))
+
+def extract_text_from_pdf(pdf_path, pages=None, workers=None):
+    texts = [text for _, text in iter_page_texts(pdf_path, pages, workers) if text]
+    return PAGE_SEPARATOR.join(text.strip() for text in texts).strip()
+
+def analyze_and_save(pdf_path, pages=None, workers=None, ocr_page=None, ocr_workers=1):
+    """
+    Extracts the text layer page by page. Pages without one are passed to
+    `ocr_page(page_number)`, which returns their text (e.g. by rasterizing
+    and running CRAFT + TrOCR), up to `ocr_workers` at a time; the page
+    texts are merged in page order. Without `ocr_page` those pages are
+    skipped.
+    """
     root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
     output_folder = os.path.join(root_dir, "OCR_outputs/printed_text_output")
     os.makedirs(output_folder, exist_ok=True)
@@ -23,18 +96,46 @@ def analyze_and_save(pdf_path):
     output_filename = os.path.splitext(pdf_filename)[0] + ".txt"
     output_path = os.path.join(output_folder, output_filename)
 
-    extracted_text = ""
+    # pages are OCR'd as soon as extraction reaches them, while the rest of
+    # the document is still being extracted
+    page_texts = {}
+    ocr_futures = {}
+    executor = ThreadPoolExecutor(max_workers=max(1, ocr_workers)) if ocr_page is not None else None
+    try:
+        for page, text in iter_page_texts(pdf_path, pages, workers):
+            page_texts[page] = text
+            if executor is not None and not has_text(text):
+                ocr_futures[page] = executor.submit(ocr_page, page)
+        if ocr_futures:
+            print(f"OCR for {len(ocr_futures)} of {len(page_texts)} pages without a text layer.")
+        for page, future in ocr_futures.items():
+            page_texts[page] = future.result()
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    scanned = [page for page, text in page_texts.items() if not has_text(text)]
+    if scanned and ocr_page is None:
+        print(f"⚠️ {len(scanned)} of {len(page_texts)} pages do not contain extractable text. Use OCR instead.")
 
-    if is_text_pdf(pdf_path):
-        extracted_text = extract_text_from_pdf(pdf_path)
+    extracted_text = PAGE_SEPARATOR.join(text.strip() for text in page_texts.values() if has_text(text)).strip()
+
+    if extracted_text:
         with open(output_path, "w", encoding="utf-8") as f:
             f.write(extracted_text)
         print(f"✅ Text extracted and saved to: {output_path}")
-    else:
-        print("⚠️ This PDF does not contain extractable text. Use OCR instead.")
-    
+
     return extracted_text
 
 
-if __name__ == "__main__":  
-    analyze_and_save("OCR_test_documents/test_printed.pdf")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract the text layer of a PDF.")
+    parser.add_argument('pdf_path', nargs='?', default="OCR_test_documents/test_printed.pdf")
+    parser.add_argument('--pages', help="Pages to extract, e.g. 1-3,7,10- (default: all).")
+    parser.add_argument('--workers', type=int, help="Extraction processes (default: by page count).")
+    args = parser.parse_args()
+
+    pages = None
+    if args.pages:
+        pages = parse_page_range(args.pages, len(PdfReader(args.pdf_path).pages))
+    analyze_and_save(args.pdf_path, pages, args.workers)
@@ -1,41 +1,135 @@
 import cv2
-from PIL import Image
-from transformers import TrOCRProcessor, VisionEncoderDecoderModel
-import torch
 import sys
 import os
+import time
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from craft_text_detector import Craft
-
-craft = Craft(
-    output_dir=None,
-    text_threshold=0.8,
-    link_threshold=0.4,
-    low_text=0.4,
-    cuda=False
+from craft_text_detector.onnx_utils import CRAFTNET_FILE, REFINENET_FILE
+from ocr_settings import (
+    CRAFT_SETTINGS, CRAFT_TILE_BATCH_SIZE, CRAFT_TILE_WORKERS, MMAP_WEIGHTS, OCR_BACKEND,
+    ONNX_MODEL_DIR, PDF_SETTINGS, TROCR_BATCH_SIZE, TROCR_QUANTIZED_BATCH_SIZE, TROCR_SETTINGS,
 )
-
-processor = TrOCRProcessor.from_pretrained('microsoft/trocr-base-handwritten')
-model = VisionEncoderDecoderModel.from_pretrained('microsoft/trocr-base-handwritten').to('cpu')
-
-model.config.num_beams = 5
-model.config.early_stopping = True
-model.config.max_length = 80
-model.config.no_repeat_ngram_size = 3
-model.config.length_penalty = 2.0
-model.config.decoder_start_token_id = processor.tokenizer.cls_token_id
-model.config.eos_token_id = processor.tokenizer.sep_token_id
-model.config.pad_token_id = processor.tokenizer.pad_token_id
-
-def run_ocr(image_path: str, output_dir: str = "step_outputs/OCR_outputs") -> str:
+from pipeline.trace import report
+from pipeline.transport import write_result
+from pipeline.workers import serve, serve_stdin
+
+def load_craft(fuse_conv_bn: bool = CRAFT_SETTINGS["fuse_conv_bn"], backend: str = OCR_BACKEND) -> Craft:
+    onnx = backend == "onnx"
+    return Craft(
+        output_dir=None,
+        text_threshold=CRAFT_SETTINGS["text_threshold"],
+        link_threshold=CRAFT_SETTINGS["link_threshold"],
+        low_text=CRAFT_SETTINGS["low_text"],
+        cuda=CRAFT_SETTINGS["cuda"],
+        refiner=CRAFT_SETTINGS["refiner"],
+        box_only=True,
+        long_size=CRAFT_SETTINGS["long_size"],
+        tile_size=CRAFT_SETTINGS["tile_size"],
+        tile_overlap=CRAFT_SETTINGS["tile_overlap"],
+        tile_batch_size=CRAFT_TILE_BATCH_SIZE,
+        tile_workers=CRAFT_TILE_WORKERS,
+        fuse_conv_bn=fuse_conv_bn,
+        mmap_weights=MMAP_WEIGHTS,
+        backend=backend,
+        weight_path_craft_net=os.path.join(ONNX_MODEL_DIR, CRAFTNET_FILE) if onnx else None,
+        weight_path_refine_net=os.path.join(ONNX_MODEL_DIR, REFINENET_FILE) if onnx else None
+    )
+
+def load_recognizer(quantize: bool = TROCR_SETTINGS["quantize"], backend: str = OCR_BACKEND):
+    """TrOCR with preprocess/beam_decode/greedy_decode, on torch or ONNX Runtime."""
+    if backend == "onnx":
+        from trocr_onnx import OnnxTrOCR
+        return OnnxTrOCR(ONNX_MODEL_DIR, TROCR_SETTINGS)
+    from trocr_torch import TorchTrOCR
+    return TorchTrOCR(quantize, MMAP_WEIGHTS)
+
+craft = load_craft()
+recognizer = load_recognizer()
+
+def recognize_lines(line_images: list, batch_size: int = None) -> list:
+    """
+    Runs TrOCR over the line crops (RGB arrays) in micro-batches and returns
+    the texts in the order of `line_images`. Lines are batched by similar
+    width, a proxy for text length, so short lines don't wait on long beam
+    searches. `batch_size` defaults to TROCR_BATCH_SIZE, or
+    TROCR_QUANTIZED_BATCH_SIZE for an int8 recognizer.
+    """
+    if batch_size is None:
+        batch_size = TROCR_QUANTIZED_BATCH_SIZE if recognizer.quantized else TROCR_BATCH_SIZE
+    decoding = TROCR_SETTINGS["decoding"]
+    order = sorted(range(len(line_images)), key=lambda i: line_images[i].shape[1])
+    texts = [None] * len(line_images)
+    # per-line share of its batch's decode time, in reading order; lines
+    # escalated to beam search also get their share of the beam pass
+    line_times = [None] * len(line_images)
+    batch_times = []
+    escalated = 0
+
+    for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
+        batch_start = time.perf_counter()
+        pixel_values = recognizer.preprocess([line_images[i] for i in batch])
+
+        beam_lines, beam_s = [], 0.0
+        if decoding == "beam":
+            batch_texts = recognizer.beam_decode(pixel_values)
+        else:
+            batch_texts, confidences = recognizer.greedy_decode(pixel_values)
+            uncertain = [j for j, confidence in enumerate(confidences)
+                         if confidence < TROCR_SETTINGS["min_confidence"]]
+            if decoding == "adaptive" and uncertain:
+                beam_start = time.perf_counter()
+                for j, text in zip(uncertain, recognizer.beam_decode(pixel_values[uncertain])):
+                    batch_texts[j] = text
+                beam_lines, beam_s = uncertain, time.perf_counter() - beam_start
+                escalated += len(uncertain)
+
+        batch_s = time.perf_counter() - batch_start
+        for j, (i, text) in enumerate(zip(batch, batch_texts)):
+            texts[i] = text
+            line_s = (batch_s - beam_s) / len(batch)
+            if j in beam_lines:
+                line_s += beam_s / len(beam_lines)
+            line_times[i] = round(line_s, 4)
+        batch_times.append(round(batch_s, 4))
+
+    if decoding == "adaptive":
+        print(f"{escalated}/{len(line_images)} lines escalated to beam search.", file=sys.stderr)
+        report("trocr_escalated_lines", escalated)
+    report("trocr_decoding", decoding)
+    report("trocr_batch_size", batch_size)
+    report("trocr_batch_decode_s", batch_times)
+    report("trocr_line_decode_s", line_times)
+    report("trocr_lines", len(line_images))
+    return texts
+
+def read_image(image_path: str):
+    # decoded once; CRAFT and the line crops share this RGB buffer
     image = cv2.imread(image_path)
     if image is None:
-        print(f"Error: Could not read image from {image_path}. Please check the path and file integrity.", file=sys.stderr)
-        sys.exit(1)
-
-    result = craft.detect_text(image_path)
+        raise ValueError(f"Could not read image from {image_path}. Please check the path and file integrity.")
+    cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)
+    return image
+
+def render_pdf_page(pdf_path: str, page: int, dpi: int = PDF_SETTINGS["ocr_dpi"]):
+    """Rasterizes one page (0-based) of a PDF as an RGB array."""
+    import pypdfium2
+
+    pdf = pypdfium2.PdfDocument(pdf_path)
+    try:
+        bitmap = pdf[page].render(scale=dpi / 72, rev_byteorder=True)
+        # the array is a view of pdfium's buffer, which is freed with the document
+        return bitmap.to_numpy().copy()
+    finally:
+        pdf.close()
+
+def ocr_image(image, name: str, output_dir: str = "step_outputs/OCR_outputs") -> str:
+    """Detects and recognizes the text lines of an RGB array; the text is also saved as <name>.txt."""
+    result = craft.detect_text(image)
     boxes = result["boxes"]
+    report("craft_times", {name: round(seconds, 4) for name, seconds in result["times"].items()})
 
     rects = []
     for poly in boxes:
@@ -78,8 +172,7 @@ def run_ocr(image_path: str, output_dir: str = "step_outputs/OCR_outputs") -> st
     for line in lines:
         line.sort(key=lambda r: r[0])
 
-    recognized_lines = []
-    pil_image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    line_images = []
 
     for line in lines:
         x_min = min([r[0] for r in line])
@@ -93,39 +186,65 @@ def run_ocr(image_path: str, output_dir: str = "step_outputs/OCR_outputs") -> st
         x_max = min(image.shape[1], x_max + pad)
         y_max = min(image.shape[0], y_max + pad)
 
-        line_img = pil_image.crop((x_min, y_min, x_max, y_max))
+        # views into `image`, rounded the way PIL's crop rounds
+        x_min, y_min, x_max, y_max = (int(round(v)) for v in (x_min, y_min, x_max, y_max))
+        line_images.append(image[y_min:y_max, x_min:x_max])
 
-        pixel_values = processor(line_img, return_tensors="pt").pixel_values.to('cpu')
-
-        with torch.no_grad():
-            generated_ids = model.generate(pixel_values)
-        
-        text = processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
-        recognized_lines.append(text)
+    recognized_lines = recognize_lines(line_images)
 
     final_text = "\n".join(recognized_lines)
 
-    image_filename = os.path.basename(image_path)
-    image_name, _ = os.path.splitext(image_filename)
-    output_filename = f"{image_name}.txt"
+    output_filename = f"{name}.txt"
 
     os.makedirs(output_dir, exist_ok=True)
     with open(os.path.join(output_dir, output_filename), "w", encoding="utf-8") as f:
         f.write(final_text)
 
-    print(f"OCR done for: {image_filename}. Text saved to {os.path.join(output_dir, output_filename)}", file=sys.stderr)
+    print(f"OCR done for: {name}. Text saved to {os.path.join(output_dir, output_filename)}", file=sys.stderr)
     
     return final_text
 
+def run_ocr(image_path: str, output_dir: str = "step_outputs/OCR_outputs") -> str:
+    image_name, _ = os.path.splitext(os.path.basename(image_path))
+    return ocr_image(read_image(image_path), image_name, output_dir)
+
+def run_pdf_page_ocr(pdf_path: str, page: int, dpi: int = PDF_SETTINGS["ocr_dpi"],
+                     output_dir: str = "step_outputs/OCR_outputs") -> str:
+    pdf_name, _ = os.path.splitext(os.path.basename(pdf_path))
+    report("pdf_page", page + 1)
+    return ocr_image(render_pdf_page(pdf_path, page, dpi), f"{pdf_name}_page{page + 1}", output_dir)
+
+def handle_job(job: dict) -> str:
+    if "pdf_path" in job:
+        return run_pdf_page_ocr(job["pdf_path"], job["page"], job.get("dpi", PDF_SETTINGS["ocr_dpi"]))
+    return run_ocr(job["image_path"])
+
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        image_path = sys.argv[1]
+    args = sys.argv[1:]
+    result_to = None
+    if len(args) > 1 and args[0] == "--result-to":
+        result_to, args = args[1], args[2:]
+
+    if args and args[0] == "--serve":
+        serve("ocr", handle_job)
+    elif args and args[0] == "--serve-stdin":
+        serve_stdin(handle_job)
+    elif args:
+        image_path = args[0]
         try:
-            extracted_text = run_ocr(image_path)
-            print(extracted_text)
+            if len(args) >= 3 and args[1] == "--pdf-page":
+                dpi = int(args[4]) if len(args) >= 5 and args[3] == "--dpi" else PDF_SETTINGS["ocr_dpi"]
+                extracted_text = run_pdf_page_ocr(image_path, int(args[2]) - 1, dpi)
+            else:
+                extracted_text = run_ocr(image_path)
+            if result_to:
+                write_result(result_to, extracted_text)
+            else:
+                print(extracted_text)
         except Exception as e:
             print(f"Error during OCR execution in trocr_script: {e}", file=sys.stderr)
             sys.exit(1)
     else:
-        print("Usage: python trocr_script.py <path_to_image>", file=sys.stderr)
+        print("Usage: python trocr_script.py [--result-to <spec>] <path_to_image> | "
+              "<path_to_pdf> --pdf-page <page> [--dpi <dpi>] | --serve | --serve-stdin", file=sys.stderr)
         sys.exit(1)
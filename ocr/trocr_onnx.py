@@ -0,0 +1,244 @@
+"""
+TrOCR recognition on ONNX Runtime, for graphs exported with export_onnx.py.
+Needs only numpy, Pillow, onnxruntime and tokenizers, so the OCR stage can
+start without importing torch or transformers. Preprocessing, greedy and
+beam search mirror what TrOCRProcessor and transformers' generate() do with
+the settings in ocr_settings.py, so the texts match the torch backend.
+"""
+import json
+import os
+
+import numpy as np
+import onnxruntime
+from PIL import Image
+from tokenizers import Tokenizer
+
+ENCODER_FILE = "trocr_encoder.onnx"
+DECODER_FILE = "trocr_decoder.onnx"
+# later decoding steps on the cache of the previous ones; exports without it
+# (or with a DECODER_FILE that returns no cache) re-run the whole sequence
+DECODER_WITH_PAST_FILE = "trocr_decoder_with_past.onnx"
+TOKENIZER_FILE = "trocr_tokenizer.json"
+CONFIG_FILE = "trocr_config.json"
+
+
+def log_softmax(x: np.ndarray) -> np.ndarray:
+    x = x - x.max(axis=-1, keepdims=True)
+    return x - np.log(np.exp(x).sum(axis=-1, keepdims=True))
+
+
+def clean_up_tokenization(text: str) -> str:
+    # same replacements as transformers' PreTrainedTokenizerBase.clean_up_tokenization
+    for before, after in ((" .", "."), (" ?", "?"), (" !", "!"), (" ,", ","), (" ' ", "'"),
+                          (" n't", "n't"), (" 'm", "'m"), (" 's", "'s"), (" 've", "'ve"), (" 're", "'re")):
+        text = text.replace(before, after)
+    return text
+
+
+class OnnxTrOCR:
+    """
+    `settings` supplies the generation settings (num_beams, max_length,
+    length_penalty, early_stopping, no_repeat_ngram_size), normally
+    TROCR_SETTINGS; the exported config supplies the image and token settings.
+    """
+
+    quantized = False
+
+    def __init__(self, model_dir: str, settings: dict, num_threads: int = None):
+        paths = [os.path.join(model_dir, name) for name in (ENCODER_FILE, DECODER_FILE, TOKENIZER_FILE, CONFIG_FILE)]
+        missing = [path for path in paths if not os.path.isfile(path)]
+        if missing:
+            raise FileNotFoundError(f"Missing exported TrOCR files {missing}. Export them first with ocr/export_onnx.py")
+        encoder_path, decoder_path, tokenizer_path, config_path = paths
+
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.encoder = onnxruntime.InferenceSession(encoder_path, options, providers=["CPUExecutionProvider"])
+        self.decoder = onnxruntime.InferenceSession(decoder_path, options, providers=["CPUExecutionProvider"])
+        self.decoder_with_past = None
+        present_names = [output.name for output in self.decoder.get_outputs()][1:]
+        decoder_with_past_path = os.path.join(model_dir, DECODER_WITH_PAST_FILE)
+        if present_names and os.path.isfile(decoder_with_past_path):
+            self.decoder_with_past = onnxruntime.InferenceSession(
+                decoder_with_past_path, options, providers=["CPUExecutionProvider"])
+            # present.{layer}.{decoder|encoder}.{key|value} -> past_key_values.*
+            self.past_names = [name.replace("present.", "past_key_values.", 1) for name in present_names]
+            self.self_past_names = [
+                name.replace("present.", "past_key_values.", 1)
+                for name in [output.name for output in self.decoder_with_past.get_outputs()][1:]
+            ]
+            # graphs exported before the cached decoder took the encoder output
+            self.past_takes_encoder = "encoder_hidden_states" in [
+                graph_input.name for graph_input in self.decoder_with_past.get_inputs()]
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        with open(config_path, "r", encoding="utf-8") as f:
+            self.config = {**json.load(f), **settings}
+
+    def preprocess(self, images: list) -> np.ndarray:
+        """Same steps as TrOCRProcessor on RGB arrays: resize, rescale, normalize, CHW."""
+        config = self.config
+        width, height = config["image_size"]
+        mean = np.array(config["image_mean"], dtype=np.float32)
+        std = np.array(config["image_std"], dtype=np.float32)
+        batch = []
+        for image in images:
+            image = Image.fromarray(image).resize((width, height), resample=config["resample"], reducing_gap=None)
+            array = (np.asarray(image, dtype=np.float64) * config["rescale_factor"]).astype(np.float32)
+            batch.append(((array - mean) / std).transpose(2, 0, 1))
+        return np.stack(batch).astype(np.float32)
+
+    def decode(self, sequences) -> list:
+        texts = self.tokenizer.decode_batch([list(map(int, s)) for s in sequences], skip_special_tokens=True)
+        if self.config["clean_up_tokenization_spaces"]:
+            texts = [clean_up_tokenization(text) for text in texts]
+        return texts
+
+    def _encode(self, pixel_values: np.ndarray) -> np.ndarray:
+        return self.encoder.run(None, {"pixel_values": pixel_values})[0]
+
+    def _next_logits(self, sequences: np.ndarray, encoder_hidden_states: np.ndarray, past: dict = None):
+        """
+        Logits of the next token for every sequence, and the decoder cache to
+        pass back in for the next step (None without the cached graphs). The
+        first step (past=None) runs on the whole sequences and starts the
+        cache; later steps feed only their last token.
+        """
+        if past is not None:
+            inputs = {"input_ids": sequences[:, -1:].astype(np.int64), **past}
+            if self.past_takes_encoder:
+                inputs["encoder_hidden_states"] = encoder_hidden_states
+            outputs = self.decoder_with_past.run(None, inputs)
+            return outputs[0].astype(np.float32), {**past, **dict(zip(self.self_past_names, outputs[1:]))}
+
+        outputs = self.decoder.run(None, {
+            "input_ids": sequences.astype(np.int64),
+            "encoder_hidden_states": encoder_hidden_states,
+        })
+        if self.decoder_with_past is None:
+            return outputs[0].astype(np.float32), None
+        return outputs[0].astype(np.float32), dict(zip(self.past_names, outputs[1:]))
+
+    def _reorder_cache(self, past: dict, rows: np.ndarray) -> dict:
+        # beam search: each new beam continues the cache of the beam it came from
+        if past is None:
+            return None
+        return {name: state[rows] if name in self.self_past_names else state for name, state in past.items()}
+
+    def _ban_repeated_ngrams(self, sequences: np.ndarray, scores: np.ndarray) -> None:
+        # NoRepeatNGramLogitsProcessor: a token that would complete an n-gram
+        # already present in the sequence gets -inf
+        n = self.config["no_repeat_ngram_size"]
+        cur_len = sequences.shape[1]
+        if not n or cur_len + 1 < n:
+            return
+        for row, tokens in enumerate(sequences.tolist()):
+            prefix = tuple(tokens[cur_len + 1 - n:])
+            banned = [ngram[-1] for ngram in zip(*[tokens[i:] for i in range(n)]) if ngram[:-1] == prefix]
+            scores[row, banned] = -np.inf
+
+    def greedy_decode(self, pixel_values: np.ndarray):
+        """Returns the greedy texts and each line's mean token probability."""
+        config = self.config
+        encoder_hidden_states = self._encode(pixel_values)
+        batch_size = len(pixel_values)
+        sequences = np.full((batch_size, 1), config["decoder_start_token_id"], dtype=np.int64)
+        unfinished = np.ones(batch_size, dtype=bool)
+        token_log_probs = []
+        past = None
+
+        while unfinished.any() and sequences.shape[1] < config["max_length"]:
+            scores, past = self._next_logits(sequences, encoder_hidden_states, past)
+            self._ban_repeated_ngrams(sequences, scores)
+            tokens = scores.argmax(axis=-1)
+            token_log_probs.append(np.take_along_axis(log_softmax(scores), tokens[:, None], axis=1)[:, 0])
+            tokens = np.where(unfinished, tokens, config["pad_token_id"])
+            sequences = np.concatenate([sequences, tokens[:, None]], axis=1)
+            unfinished &= tokens != config["eos_token_id"]
+
+        generated = sequences[:, 1:]
+        mask = generated != config["pad_token_id"]
+        log_probs = np.stack(token_log_probs, axis=1) if token_log_probs else np.zeros_like(generated, dtype=np.float32)
+        mean_log_probs = (np.where(mask, log_probs, 0.0)).sum(axis=1) / np.maximum(mask.sum(axis=1), 1)
+        return self.decode(sequences), np.exp(mean_log_probs).tolist()
+
+    def beam_decode(self, pixel_values: np.ndarray) -> list:
+        """
+        Beam search with the semantics of transformers' _beam_search:
+        2 * num_beams candidates per step, finished hypotheses scored with
+        sum_logprobs / generated_len ** length_penalty, and with
+        early_stopping a batch item is done once num_beams hypotheses finished.
+        """
+        config = self.config
+        num_beams = config["num_beams"]
+        max_length = config["max_length"]
+        length_penalty = config["length_penalty"]
+        early_stopping = config["early_stopping"]
+        eos = config["eos_token_id"]
+        batch_size = len(pixel_values)
+        beams_to_keep = 2 * num_beams
+        prompt_len = 1
+
+        encoder_hidden_states = np.repeat(self._encode(pixel_values), num_beams, axis=0)
+        fill = config["pad_token_id"] if config["pad_token_id"] is not None else eos
+        running = np.full((batch_size, num_beams, max_length), fill, dtype=np.int64)
+        running[:, :, 0] = config["decoder_start_token_id"]
+        finished = running.copy()
+        running_scores = np.zeros((batch_size, num_beams), dtype=np.float32)
+        running_scores[:, 1:] = -1e9
+        finished_scores = np.full((batch_size, num_beams), -1e9, dtype=np.float32)
+        is_finished = np.zeros((batch_size, num_beams), dtype=bool)
+        top_num_beam_mask = np.arange(beams_to_keep) < num_beams
+        cur_len = prompt_len
+        past = None
+
+        while True:
+            flat = running[:, :, :cur_len].reshape(batch_size * num_beams, cur_len)
+            logits, past = self._next_logits(flat, encoder_hidden_states, past)
+            log_probs = log_softmax(logits)
+            self._ban_repeated_ngrams(flat, log_probs)
+            vocab_size = log_probs.shape[-1]
+            log_probs = log_probs.reshape(batch_size, num_beams, vocab_size) + running_scores[:, :, None]
+            log_probs = log_probs.reshape(batch_size, num_beams * vocab_size)
+
+            # top-k continuations over all beams
+            topk_indices = np.argsort(-log_probs, axis=1, kind="stable")[:, :beams_to_keep]
+            topk_log_probs = np.take_along_axis(log_probs, topk_indices, axis=1)
+            topk_sequences = np.take_along_axis(running, (topk_indices // vocab_size)[:, :, None], axis=1)
+            topk_sequences[:, :, cur_len] = topk_indices % vocab_size
+            hits_stop = (topk_sequences[:, :, cur_len] == eos) | (cur_len + 1 >= max_length)
+
+            # running beams for the next step: best candidates that didn't stop
+            topk_running_log_probs = topk_log_probs + hits_stop * np.float32(-1e9)
+            next_indices = np.argsort(-topk_running_log_probs, axis=1, kind="stable")[:, :num_beams]
+            running = np.take_along_axis(topk_sequences, next_indices[:, :, None], axis=1)
+            running_scores = np.take_along_axis(topk_running_log_probs, next_indices, axis=1)
+            source_beams = np.take_along_axis(topk_indices // vocab_size, next_indices, axis=1)
+            past = self._reorder_cache(past, (np.arange(batch_size)[:, None] * num_beams + source_beams).reshape(-1))
+
+            # merge newly finished hypotheses into the finished set
+            just_finished = hits_stop & top_num_beam_mask[None, :]
+            candidate_scores = topk_log_probs / ((cur_len + 1 - prompt_len) ** length_penalty)
+            beams_full = is_finished.all(axis=1, keepdims=True) & (early_stopping is True)
+            candidate_scores = candidate_scores + beams_full * np.float32(-1e9) + (~just_finished) * np.float32(-1e9)
+            merged_sequences = np.concatenate([finished, topk_sequences], axis=1)
+            merged_scores = np.concatenate([finished_scores, candidate_scores], axis=1)
+            merged_finished = np.concatenate([is_finished, just_finished], axis=1)
+            keep = np.argsort(-merged_scores, axis=1, kind="stable")[:, :num_beams]
+            finished = np.take_along_axis(merged_sequences, keep[:, :, None], axis=1)
+            finished_scores = np.take_along_axis(merged_scores, keep, axis=1)
+            is_finished = np.take_along_axis(merged_finished, keep, axis=1)
+
+            cur_len += 1
+            if early_stopping == "never" and length_penalty > 0.0:
+                best_length = max_length - prompt_len
+            else:
+                best_length = cur_len - prompt_len
+            best_running = running_scores[:, :1] / (best_length ** length_penalty)
+            worst_finished = np.where(is_finished, finished_scores.min(axis=1, keepdims=True), -1.0e9)
+            improvement_possible = (best_running > worst_finished).any()
+            open_beam = not (is_finished.all() and early_stopping is True)
+            if not (improvement_possible and open_beam and not hits_stop.all()):
+                break
+
+        return self.decode(finished[:, 0, :cur_len])
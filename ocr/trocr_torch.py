@@ -0,0 +1,166 @@
+"""
+TrOCR recognition with transformers on the CPU (OCR_BACKEND = "torch").
+trocr_onnx.OnnxTrOCR exposes the same preprocess/beam_decode/greedy_decode
+methods for the ONNX Runtime backend.
+"""
+import os
+import sys
+
+import torch
+from transformers import GenerationConfig, TrOCRProcessor, VisionEncoderDecoderConfig, VisionEncoderDecoderModel
+from transformers.modeling_utils import no_init_weights
+
+from ocr_settings import MMAP_WEIGHTS, TROCR_SETTINGS
+
+MODEL_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "models")
+
+
+def quantized_model_dir(model_name: str) -> str:
+    # state dict keys follow the transformers module layout
+    import transformers
+    return os.path.join(MODEL_CACHE_DIR, f"{model_name.replace('/', '--')}-int8-transformers{transformers.__version__}")
+
+
+def mmap_model_dir(model_name: str) -> str:
+    import transformers
+    return os.path.join(MODEL_CACHE_DIR, f"{model_name.replace('/', '--')}-mmap-transformers{transformers.__version__}")
+
+
+def load_trocr_mmap(model_name: str) -> VisionEncoderDecoderModel:
+    """
+    Loads the fp32 model from a state dict memory-mapped from disk. The
+    module is built without initializing its weights and the mapped tensors
+    are assigned as its parameters, so nothing is unpickled or copied, and
+    processes loading the same model share the pages. (Not built on the meta
+    device: the sinusoidal position embeddings of some TrOCR decoders are
+    computed in __init__ and aren't in the state dict.) The first call
+    converts the from_pretrained weights into .cache/models.
+    """
+    model_dir = mmap_model_dir(model_name)
+    weights_path = os.path.join(model_dir, "model.pt")
+    if not os.path.isfile(weights_path):
+        print(f"Converting {model_name} for memory-mapped loading, cached at {model_dir}", file=sys.stderr)
+        trocr = VisionEncoderDecoderModel.from_pretrained(model_name)
+        trocr.config.save_pretrained(model_dir)
+        trocr.generation_config.save_pretrained(model_dir)
+        # the weights go last: their presence marks a complete conversion
+        tmp_path = f"{weights_path}.{os.getpid()}.tmp"
+        torch.save(trocr.state_dict(), tmp_path)
+        os.replace(tmp_path, weights_path)
+
+    state_dict = torch.load(weights_path, map_location='cpu', mmap=True, weights_only=True)
+    with no_init_weights():
+        trocr = VisionEncoderDecoderModel(VisionEncoderDecoderConfig.from_pretrained(model_dir))
+    trocr.load_state_dict(state_dict, assign=True)
+    trocr.generation_config = GenerationConfig.from_pretrained(model_dir)
+    return trocr
+
+
+def quantize_int8(trocr: VisionEncoderDecoderModel) -> VisionEncoderDecoderModel:
+    return torch.ao.quantization.quantize_dynamic(trocr, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_trocr_quantized(model_name: str) -> VisionEncoderDecoderModel:
+    """
+    Loads TrOCR with dynamic int8 Linear layers. The first call quantizes the
+    from_pretrained model and saves its state dict (packed int8 weights and
+    their scales) with the config in .cache/models; later calls quantize the
+    bare architecture and load that state dict with weights_only, so the
+    cache never unpickles code.
+    """
+    model_dir = quantized_model_dir(model_name)
+    weights_path = os.path.join(model_dir, "model.pt")
+    if not os.path.isfile(weights_path):
+        print(f"Quantizing {model_name} to int8, cached at {model_dir}", file=sys.stderr)
+        trocr = quantize_int8(VisionEncoderDecoderModel.from_pretrained(model_name).to('cpu'))
+        trocr.config.save_pretrained(model_dir)
+        # the weights go last: their presence marks a complete conversion
+        tmp_path = f"{weights_path}.{os.getpid()}.tmp"
+        torch.save(trocr.state_dict(), tmp_path)
+        os.replace(tmp_path, weights_path)
+        return trocr
+
+    with no_init_weights():
+        trocr = VisionEncoderDecoderModel(VisionEncoderDecoderConfig.from_pretrained(model_dir))
+    # uninitialized memory can hold NaNs, which the quantizer's min/max
+    # observers reject; the values are replaced by load_state_dict anyway
+    for module in trocr.modules():
+        if isinstance(module, torch.nn.Linear):
+            torch.nn.init.zeros_(module.weight)
+    trocr = quantize_int8(trocr)
+    trocr.load_state_dict(torch.load(weights_path, map_location='cpu', weights_only=True))
+    return trocr
+
+
+def load_trocr_model(processor: TrOCRProcessor, quantize: bool = TROCR_SETTINGS["quantize"],
+                     mmap: bool = MMAP_WEIGHTS) -> VisionEncoderDecoderModel:
+    """
+    Loads TrOCR on the CPU. With `quantize`, the Linear layers of the encoder
+    and decoder use dynamic int8 quantization (see load_trocr_quantized).
+    Otherwise `mmap` maps the fp32 weights from disk (see load_trocr_mmap).
+    """
+    model_name = TROCR_SETTINGS["model_name"]
+    if not quantize and mmap:
+        trocr = load_trocr_mmap(model_name)
+    elif not quantize:
+        trocr = VisionEncoderDecoderModel.from_pretrained(model_name).to('cpu')
+    else:
+        trocr = load_trocr_quantized(model_name)
+
+    trocr.config.num_beams = TROCR_SETTINGS["num_beams"]
+    trocr.config.early_stopping = TROCR_SETTINGS["early_stopping"]
+    trocr.config.max_length = TROCR_SETTINGS["max_length"]
+    trocr.config.no_repeat_ngram_size = TROCR_SETTINGS["no_repeat_ngram_size"]
+    trocr.config.length_penalty = TROCR_SETTINGS["length_penalty"]
+    trocr.config.decoder_start_token_id = processor.tokenizer.cls_token_id
+    trocr.config.eos_token_id = processor.tokenizer.sep_token_id
+    trocr.config.pad_token_id = processor.tokenizer.pad_token_id
+    # generate() only follows edits to trocr.config while generation_config
+    # still hashes as when it was derived in this process; a model rebuilt
+    # from a cached config doesn't (str hashes are per process), so the int8
+    # model decoded greedily up to 20 tokens. Derive it from the settings
+    # above explicitly.
+    trocr.generation_config = GenerationConfig.from_model_config(trocr.config)
+    return trocr.eval()
+
+
+class TorchTrOCR:
+    def __init__(self, quantize: bool = TROCR_SETTINGS["quantize"], mmap: bool = MMAP_WEIGHTS):
+        self.processor = TrOCRProcessor.from_pretrained(TROCR_SETTINGS["model_name"])
+        self.model = load_trocr_model(self.processor, quantize, mmap)
+        self.quantized = quantize
+
+    def preprocess(self, images: list) -> torch.Tensor:
+        return self.processor(images, return_tensors="pt").pixel_values.to('cpu')
+
+    def beam_decode(self, pixel_values: torch.Tensor) -> list:
+        with torch.no_grad():
+            generated_ids = self.model.generate(pixel_values)
+        return self.processor.batch_decode(generated_ids, skip_special_tokens=True)
+
+    def greedy_decode(self, pixel_values: torch.Tensor):
+        """Returns the greedy texts and each line's mean token probability."""
+        with torch.no_grad():
+            output = self.model.generate(
+                pixel_values,
+                num_beams=1,
+                do_sample=False,
+                early_stopping=False,
+                length_penalty=1.0,
+                output_scores=True,
+                return_dict_in_generate=True,
+            )
+
+        # sequences start with the decoder start token; finished lines are padded.
+        # (compute_transition_scores can't be used: VisionEncoderDecoderConfig
+        # has no vocab_size.)
+        generated = output.sequences[:, 1:]
+        step_log_probs = torch.stack(output.scores, dim=1).log_softmax(dim=-1)
+        log_probs = step_log_probs.gather(2, generated.unsqueeze(-1)).squeeze(-1)
+        mask = generated != self.model.config.pad_token_id
+        # padding steps can be banned (-inf), e.g. by no_repeat_ngram_size, and
+        # -inf * 0 is NaN, so they are masked out instead of multiplied away
+        log_probs = torch.where(mask, log_probs, torch.zeros_like(log_probs))
+        mean_log_probs = log_probs.sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+        texts = self.processor.batch_decode(output.sequences, skip_special_tokens=True)
+        return texts, mean_log_probs.exp().tolist()
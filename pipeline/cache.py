@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from typing import Optional
+
+CACHE_VERSION = 1
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(*parts) -> str:
+    """
+    Content-addressed key for a stage result. Parts must be JSON-serializable;
+    dicts are serialized with sorted keys so settings order does not matter.
+    """
+    payload = json.dumps([CACHE_VERSION, *parts], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class StageCache:
+    """
+    On-disk cache for stage outputs (OCR text, lecture scripts, audio files).
+
+    Entries live under <cache_dir>/<namespace>/<key[:2]>/<key><suffix>. A hit
+    refreshes the entry's mtime. Writes keep a running total of the cache
+    size (from one scan of the directory on the first write); once it
+    exceeds `max_bytes`, the least recently used entries are evicted until
+    the cache fits, never the entry just written. Eviction rescans the
+    directory, which also picks up what other processes sharing the cache
+    wrote.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total = None  # bytes on disk, tracked from the first write
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, namespace: str, key: str, suffix: str = "") -> str:
+        return os.path.join(self.cache_dir, namespace, key[:2], key + suffix)
+
+    def _hit(self, path: str) -> bool:
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _store(self, path: str, write) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            size = os.path.getsize(tmp_path)
+            try:
+                replaced = os.path.getsize(path)
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            if self._total is None:
+                self._total = sum(size for _, size, _ in self._entries())
+            else:
+                self._total += size - replaced
+            over = self._total > self.max_bytes
+        if over:
+            self.evict(keep=path)
+
+    def has_text(self, namespace: str, key: str) -> bool:
+        # existence only: no read, and the entry's mtime is left for get_text
+        return os.path.isfile(self._path(namespace, key, ".txt"))
+
+    def get_text(self, namespace: str, key: str) -> Optional[str]:
+        path = self._path(namespace, key, ".txt")
+        if not self._hit(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            # evicted since the hit, e.g. by another process
+            return None
+
+    def put_text(self, namespace: str, key: str, text: str) -> None:
+        self._store(self._path(namespace, key, ".txt"), lambda f: f.write(text.encode("utf-8")))
+
+    def get_file(self, namespace: str, key: str, dest_path: str, suffix: str = "") -> bool:
+        path = self._path(namespace, key, suffix)
+        if not self._hit(path):
+            return False
+        os.makedirs(os.path.dirname(os.path.abspath(dest_path)), exist_ok=True)
+        try:
+            shutil.copyfile(path, dest_path)
+        except FileNotFoundError:
+            # evicted since the hit, e.g. by another process
+            return False
+        return True
+
+    def put_file(self, namespace: str, key: str, src_path: str, suffix: str = "") -> None:
+        def write(f):
+            with open(src_path, "rb") as src:
+                shutil.copyfileobj(src, f)
+
+        self._store(self._path(namespace, key, suffix), write)
+
+    def _entries(self) -> list:
+        entries = []
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                if filename.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """Removes the least recently used entries (except `keep`) until the cache fits in max_bytes."""
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            if total > self.max_bytes:
+                entries.sort()
+                for _, size, path in entries:
+                    if total <= self.max_bytes:
+                        break
+                    if path == keep:
+                        continue
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        continue
+                    total -= size
+            self._total = total
@@ -0,0 +1,64 @@
+import re
+
+SENTENCE_END = re.compile(r"[.!?…][\"')\]]*(?=\s)")
+TAG = re.compile(r"<(/?)([A-Za-z][\w:-]*)[^>]*?(/?)>")
+ROOT_TAGS = {"speak"}
+
+
+class SentenceChunker:
+    """
+    Splits a stream of LLM tokens into sentence chunks that can be sent to
+    TTS on their own. A split is only made outside SSML tags and outside
+    open SSML elements (other than the <speak> root), so every chunk stays
+    well-formed. Chunks shorter than `min_chars` are merged with the next
+    sentence to avoid paying per-request TTS overhead for fragments.
+    """
+
+    def __init__(self, min_chars: int = 40):
+        self.min_chars = min_chars
+        self.buffer = ""
+
+    def _split_point(self) -> int:
+        depth = 0
+        pos = 0
+        candidates = []
+        for tag in TAG.finditer(self.buffer):
+            if depth == 0:
+                candidates += [m.end() for m in SENTENCE_END.finditer(self.buffer, pos, tag.start())]
+            closing, name, self_closing = tag.groups()
+            if name.lower() not in ROOT_TAGS and not self_closing:
+                depth = max(depth - 1, 0) if closing else depth + 1
+            pos = tag.end()
+
+        tail = self.buffer[pos:]
+        if "<" in tail:
+            # an unterminated tag is still streaming in
+            tail_end = pos + tail.index("<")
+        else:
+            tail_end = len(self.buffer)
+        if depth == 0:
+            candidates += [m.end() for m in SENTENCE_END.finditer(self.buffer, pos, tail_end)]
+
+        for end in candidates:
+            if len(strip_root_tags(self.buffer[:end])) >= self.min_chars:
+                return end
+        return -1
+
+    def feed(self, token: str) -> list:
+        self.buffer += token
+        chunks = []
+        while True:
+            end = self._split_point()
+            if end < 0:
+                return chunks
+            chunk, self.buffer = self.buffer[:end].strip(), self.buffer[end:]
+            if strip_root_tags(chunk):
+                chunks.append(chunk)
+
+    def flush(self) -> list:
+        chunk, self.buffer = self.buffer.strip(), ""
+        return [chunk] if strip_root_tags(chunk) else []
+
+
+def strip_root_tags(text: str) -> str:
+    return re.sub(r"</?speak[^>]*>", "", text).strip()
@@ -0,0 +1,165 @@
+import atexit
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Set by main.py for one-shot stage subprocesses: the stage writes its
+# resource usage and reported details to this file when it exits.
+REPORT_FILE_ENV = "LECTURE_SYNTH_TRACE_FILE"
+
+# How often StageTimer samples the resident set size during a block.
+RSS_SAMPLE_INTERVAL = 0.05
+
+_details = {}
+_details_lock = threading.Lock()
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident set size of this process since it started, in MB (None on
+    Windows). Covers everything the process ran before, not just one stage.
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 1)
+
+
+def current_rss_mb() -> float:
+    """Resident set size of this process now, in MB (None where /proc is missing)."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+
+
+def report(key: str, value) -> None:
+    """Stage side: attaches a detail (e.g. CRAFT sub-timings) to the current job's trace."""
+    with _details_lock:
+        _details[key] = value
+
+
+def take_report() -> dict:
+    with _details_lock:
+        details = dict(_details)
+        _details.clear()
+    return details
+
+
+class StageTimer:
+    """
+    Measures wall time, CPU time and peak RSS of the current process over a
+    block. The block's own peak ("peak_rss_mb") comes from a thread sampling
+    the RSS every RSS_SAMPLE_INTERVAL seconds, so short spikes between
+    samples can be missed; it is None where the RSS can't be read. The
+    process-wide peak since start is recorded as "process_peak_rss_mb".
+    """
+
+    def __enter__(self):
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.record = {}
+        self._peak_rss = current_rss_mb()
+        self._stop = threading.Event()
+        self._sampler = None
+        if self._peak_rss is not None:
+            self._sampler = threading.Thread(target=self._sample_rss, daemon=True)
+            self._sampler.start()
+        return self
+
+    def _sample_rss(self) -> None:
+        while not self._stop.wait(RSS_SAMPLE_INTERVAL):
+            rss = current_rss_mb()
+            if rss is not None and rss > self._peak_rss:
+                self._peak_rss = rss
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            self._peak_rss = max(self._peak_rss, current_rss_mb() or 0.0)
+        self.record = {
+            "wall_s": round(time.perf_counter() - self.wall_start, 4),
+            "cpu_s": round(time.process_time() - self.cpu_start, 4),
+            "peak_rss_mb": self._peak_rss,
+            "process_peak_rss_mb": peak_rss_mb(),
+        }
+        return False
+
+
+class Trace:
+    """
+    Parent side: per-document trace of every stage. Each stage record holds
+    the wall time seen by main.py plus whatever the stage process reported
+    about itself (CPU time, peak RSS, sub-timings) under "process".
+    """
+
+    def __init__(self, **meta):
+        self.meta = meta
+        self.stages = []
+        self.started = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        record = {"stage": name}
+        self.stages.append(record)
+        timer = StageTimer()
+        try:
+            with timer:
+                yield record
+        except Exception as e:
+            record["error"] = str(e)
+            raise
+        finally:
+            record["wall_s"] = timer.record["wall_s"]
+            # stages run in main.py itself have no child report to use
+            record.setdefault("runner", "in-process")
+            record.setdefault("process", {key: value for key, value in timer.record.items() if key != "wall_s"})
+
+    def to_dict(self) -> dict:
+        return {
+            **self.meta,
+            "total_wall_s": round(time.perf_counter() - self.started, 4),
+            "stages": self.stages,
+        }
+
+    def write(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+def read_report_file(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_report_file(path: str) -> None:
+    record = {
+        "cpu_s": round(time.process_time(), 4),
+        "peak_rss_mb": peak_rss_mb(),
+        **take_report(),
+    }
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(record, f)
+    except OSError:
+        pass
+
+
+if os.getenv(REPORT_FILE_ENV):
+    atexit.register(_write_report_file, os.environ[REPORT_FILE_ENV])
@@ -0,0 +1,161 @@
+import os
+import struct
+import sys
+import tempfile
+import uuid
+from multiprocessing import shared_memory
+
+# Stage handoff for the one-shot subprocess path. Text travels as a frame
+# (magic + 8-byte big-endian length + UTF-8 payload) over stdin/stdout, a
+# temp file or a shared-memory segment instead of argv, which is limited by
+# ARG_MAX. The magic lets a reader skip anything a library printed before
+# the frame.
+#
+# Payload specs, as passed on the command line:
+#   -            frame on stdin (input) / stdout (result)
+#   file:<path>  frame in a file
+#   shm:<name>   frame in a shared-memory segment
+
+MAGIC = b"LSF1"
+HEADER = struct.Struct(">4sQ")
+TRANSPORTS = ("stdin", "file", "shm")
+
+
+def frame(data: bytes) -> bytes:
+    return HEADER.pack(MAGIC, len(data)) + data
+
+
+def unframe(buffer) -> memoryview:
+    """Returns a zero-copy view of the payload of the first frame in `buffer`."""
+    view = memoryview(buffer)
+    start = 0 if view[:len(MAGIC)] == MAGIC else bytes(view).find(MAGIC)
+    if start < 0 or len(view) < start + HEADER.size:
+        raise ValueError("No payload frame found.")
+    _, length = HEADER.unpack_from(view, start)
+    begin = start + HEADER.size
+    if len(view) < begin + length:
+        raise ValueError(f"Truncated payload frame: expected {length} bytes, got {len(view) - begin}.")
+    return view[begin:begin + length]
+
+
+def _untrack(segment: shared_memory.SharedMemory) -> None:
+    # Before Python 3.13 every process that opens a segment registers it with
+    # the resource tracker, which unlinks it when that process exits. The
+    # parent owns the lifetime of every segment, so stages opt out.
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(segment._name, "shared_memory")
+    except Exception:
+        pass
+
+
+def _unlink_quietly(segment_name: str) -> None:
+    try:
+        segment = shared_memory.SharedMemory(name=segment_name)
+    except FileNotFoundError:
+        return
+    segment.close()
+    segment.unlink()
+
+
+def export_payload(text: str, transport: str):
+    """
+    Parent side: stages `text` for a child process.
+    Returns (spec, stdin_bytes, cleanup).
+    """
+    data = text.encode("utf-8")
+    if transport == "stdin":
+        return "-", frame(data), lambda: None
+
+    if transport == "file":
+        fd, path = tempfile.mkstemp(prefix="lecture-synth-", suffix=".payload")
+        with os.fdopen(fd, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(data)))
+            f.write(data)
+        return f"file:{path}", None, lambda: os.path.exists(path) and os.remove(path)
+
+    if transport == "shm":
+        segment = shared_memory.SharedMemory(create=True, size=HEADER.size + len(data))
+        HEADER.pack_into(segment.buf, 0, MAGIC, len(data))
+        segment.buf[HEADER.size:HEADER.size + len(data)] = data
+
+        def cleanup():
+            segment.close()
+            segment.unlink()
+
+        return f"shm:{segment.name}", None, cleanup
+
+    raise ValueError(f"Unknown transport: {transport}. Available transports: {list(TRANSPORTS)}")
+
+
+def prepare_result(transport: str):
+    """
+    Parent side: reserves a place for a child's text result.
+    Returns (spec, collect, cleanup), where collect(stdout_bytes) -> str.
+    """
+    if transport == "stdin":
+        return "-", lambda stdout: str(unframe(stdout), "utf-8"), lambda: None
+
+    if transport == "file":
+        fd, path = tempfile.mkstemp(prefix="lecture-synth-", suffix=".result")
+        os.close(fd)
+
+        def collect(stdout):
+            with open(path, "rb") as f:
+                return str(unframe(f.read()), "utf-8")
+
+        return f"file:{path}", collect, lambda: os.path.exists(path) and os.remove(path)
+
+    if transport == "shm":
+        # the child sizes and creates the segment once it knows the length
+        segment_name = f"lsr_{uuid.uuid4().hex[:16]}"
+
+        def collect(stdout):
+            segment = shared_memory.SharedMemory(name=segment_name)
+            try:
+                return str(unframe(segment.buf), "utf-8")
+            finally:
+                segment.close()
+
+        return f"shm:{segment_name}", collect, lambda: _unlink_quietly(segment_name)
+
+    raise ValueError(f"Unknown transport: {transport}. Available transports: {list(TRANSPORTS)}")
+
+
+def read_payload(spec: str) -> str:
+    """Child side: reads the text staged by export_payload."""
+    if spec == "-":
+        return str(unframe(sys.stdin.buffer.read()), "utf-8")
+    if spec.startswith("file:"):
+        with open(spec[len("file:"):], "rb") as f:
+            return str(unframe(f.read()), "utf-8")
+    if spec.startswith("shm:"):
+        segment = shared_memory.SharedMemory(name=spec[len("shm:"):])
+        _untrack(segment)
+        try:
+            return str(unframe(segment.buf), "utf-8")
+        finally:
+            segment.close()
+    raise ValueError(f"Invalid payload spec: '{spec}'.")
+
+
+def write_result(spec: str, text: str) -> None:
+    """Child side: hands a text result back to the parent."""
+    data = text.encode("utf-8")
+    if spec == "-":
+        sys.stdout.flush()
+        sys.stdout.buffer.write(frame(data))
+        sys.stdout.buffer.flush()
+    elif spec.startswith("file:"):
+        with open(spec[len("file:"):], "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(data)))
+            f.write(data)
+    elif spec.startswith("shm:"):
+        segment = shared_memory.SharedMemory(name=spec[len("shm:"):], create=True,
+                                             size=HEADER.size + len(data))
+        _untrack(segment)
+        HEADER.pack_into(segment.buf, 0, MAGIC, len(data))
+        segment.buf[HEADER.size:HEADER.size + len(data)] = data
+        segment.close()
+    else:
+        raise ValueError(f"Invalid payload spec: '{spec}'.")
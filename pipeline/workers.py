@@ -0,0 +1,349 @@
+import functools
+import json
+import os
+import secrets
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import types
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Connection, Listener, answer_challenge, deliver_challenge
+
+from pipeline.trace import StageTimer, take_report
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+WORKER_DIR = os.path.join(PROJECT_ROOT, ".workers")
+# How long worker_available waits for a worker to accept the connection and
+# answer the ping. Workers run one job at a time and accept the next
+# connection only when it is done, so a busy one counts as unavailable and
+# the caller falls back to a subprocess instead of queueing behind the job.
+WORKER_PING_TIMEOUT_S = 1.0
+# Shared by every worker and client of the user (see worker_authkey)
+WORKER_KEY_FILE = os.getenv("LECTURE_SYNTH_WORKER_KEY_FILE",
+                            os.path.join(os.path.expanduser("~"), ".lecture-synthesizer", "worker.key"))
+
+# Job protocol, shared by socket and pipe workers: the client sends one job
+# dict, the worker answers with zero or more {"chunk": ...} messages (when the
+# handler returns a generator) followed by {"ok": True, "result": ...} or
+# {"ok": False, "error": ...}. Final messages carry a "trace" dict with the
+# job's CPU time, the worker's peak RSS and any details the stage reported.
+
+
+class WorkerUnavailable(Exception):
+    """No worker is listening for the requested stage."""
+
+
+class WorkerError(RuntimeError):
+    """The worker accepted the job but failed to complete it."""
+
+
+@functools.lru_cache(maxsize=None)
+def worker_authkey() -> bytes:
+    """
+    The key workers and their clients authenticate each other with. Jobs are
+    pickled, so a client must not be able to connect without it:
+    LECTURE_SYNTH_WORKER_KEY if set, otherwise a random key generated on
+    first use into WORKER_KEY_FILE, readable by the user only.
+    """
+    key = os.getenv("LECTURE_SYNTH_WORKER_KEY")
+    if key:
+        return key.encode("utf-8")
+    try:
+        with open(WORKER_KEY_FILE, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+
+    key_dir = os.path.dirname(WORKER_KEY_FILE)
+    os.makedirs(key_dir, mode=0o700, exist_ok=True)
+    # written in full under a temp name (mkstemp creates it 0600), then linked
+    # into place, so a process starting at the same time never reads a
+    # partial key and the first one to link wins
+    fd, tmp_path = tempfile.mkstemp(dir=key_dir, prefix=".worker-key-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(secrets.token_hex(32).encode("ascii"))
+        try:
+            os.link(tmp_path, WORKER_KEY_FILE)
+        except FileExistsError:
+            pass
+    finally:
+        os.remove(tmp_path)
+    with open(WORKER_KEY_FILE, "rb") as f:
+        return f.read()
+
+
+def worker_address(name: str) -> str:
+    if sys.platform == "win32":
+        return rf"\\.\pipe\lecture-synthesizer-{name}"
+    return os.path.join(WORKER_DIR, f"{name}.sock")
+
+
+def _connect(name: str, timeout: float = None):
+    """
+    Opens an authenticated connection to a stage's worker. With `timeout`,
+    a worker that doesn't accept within that many seconds (busy with a job)
+    is reported unavailable; not supported for Windows pipes, which wait.
+    """
+    if timeout is None or sys.platform == "win32":
+        try:
+            return Client(worker_address(name), authkey=worker_authkey())
+        except (FileNotFoundError, ConnectionRefusedError, OSError) as e:
+            raise WorkerUnavailable(f"No '{name}' worker is running ({e}).")
+        except AuthenticationError as e:
+            # started with another LECTURE_SYNTH_WORKER_KEY: not usable from here
+            raise WorkerUnavailable(f"The '{name}' worker rejected our key ({e}).")
+
+    # Client() with the timeout: the connect returns as soon as the socket is
+    # queued, but the worker only starts the handshake once it accepts
+    sock = socket.socket(socket.AF_UNIX)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(worker_address(name))
+        sock.setblocking(True)
+    except OSError as e:
+        sock.close()
+        raise WorkerUnavailable(f"No '{name}' worker is running ({e}).")
+    conn = Connection(sock.detach())
+    try:
+        if not conn.poll(timeout):
+            raise WorkerUnavailable(f"The '{name}' worker is busy (no answer within {timeout}s).")
+        answer_challenge(conn, worker_authkey())
+        deliver_challenge(conn, worker_authkey())
+    except AuthenticationError as e:
+        conn.close()
+        raise WorkerUnavailable(f"The '{name}' worker rejected our key ({e}).")
+    except (EOFError, OSError) as e:
+        conn.close()
+        raise WorkerUnavailable(f"The '{name}' worker closed the connection ({e}).")
+    except WorkerUnavailable:
+        conn.close()
+        raise
+    return conn
+
+
+def _responses(recv, name: str, trace: dict = None):
+    while True:
+        response = recv()
+        if "chunk" in response:
+            yield response["chunk"]
+            continue
+        if trace is not None:
+            trace.update(response.get("trace", {}))
+        if not response.get("ok"):
+            raise WorkerError(response.get("error", f"'{name}' worker failed without an error message."))
+        return response.get("result")
+
+
+def _drain(responses):
+    try:
+        while True:
+            next(responses)
+    except StopIteration as stop:
+        return stop.value
+
+
+def _run_job(handler, job: dict, send) -> None:
+    take_report()
+    timer = StageTimer()
+    try:
+        with timer:
+            result = handler(job)
+            if isinstance(result, types.GeneratorType):
+                for chunk in result:
+                    send({"chunk": chunk})
+                result = None
+    except Exception as e:
+        send({"ok": False, "error": str(e), "trace": {**timer.record, **take_report()}})
+    else:
+        send({"ok": True, "result": result, "trace": {**timer.record, **take_report()}})
+
+
+def worker_available(name: str, timeout: float = WORKER_PING_TIMEOUT_S) -> bool:
+    """
+    Whether a worker for the stage answers a ping within `timeout` seconds
+    (None waits for as long as it takes, e.g. for a busy worker's job).
+    """
+    try:
+        conn = _connect(name, timeout)
+    except WorkerUnavailable:
+        return False
+    try:
+        conn.send({"ping": True})
+        if timeout is not None and not conn.poll(timeout):
+            return False
+        conn.recv()
+    except (EOFError, OSError):
+        return False
+    finally:
+        conn.close()
+    return True
+
+
+def stream_worker(name: str, job: dict, trace: dict = None):
+    """
+    Sends a job to the warm worker for a stage and yields the chunks it
+    streams back; the generator's return value is the job's final result.
+    If `trace` is given, it is updated with the worker's report for the job.
+    """
+    conn = _connect(name)
+    try:
+        conn.send(job)
+        return (yield from _responses(conn.recv, name, trace))
+    except (EOFError, OSError) as e:
+        raise WorkerError(f"Lost connection to '{name}' worker: {e}")
+    finally:
+        conn.close()
+
+
+def call_worker(name: str, job: dict, trace: dict = None):
+    """
+    Sends a job to the warm worker for a stage and returns its result.
+    Raises WorkerUnavailable when nothing is listening, so callers can fall
+    back to the one-shot subprocess.
+    """
+    return _drain(stream_worker(name, job, trace))
+
+
+class SocketWorker:
+    """Client for a warm worker started with --serve."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def stream(self, job: dict, trace: dict = None):
+        return stream_worker(self.name, job, trace)
+
+    def call(self, job: dict, trace: dict = None):
+        return call_worker(self.name, job, trace)
+
+    def close(self) -> None:
+        pass
+
+    def terminate(self) -> None:
+        # the worker outlives this client; an abandoned job just finishes there
+        pass
+
+
+class PipeWorker:
+    """
+    Client for a stage script started with --serve-stdin. The process lives
+    for as long as the client, so a caller that sends several jobs (e.g. one
+    per streamed sentence) loads the model only once.
+    """
+
+    def __init__(self, argv: list, name: str, env: dict = None):
+        self.name = name
+        self.proc = subprocess.Popen(
+            argv + ["--serve-stdin"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            bufsize=1,
+            env={**os.environ, **env} if env else None,
+        )
+
+    def _recv(self) -> dict:
+        while True:
+            line = self.proc.stdout.readline()
+            if not line:
+                raise WorkerError(f"'{self.name}' process exited with code {self.proc.wait()}.")
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue  # stray output from a library
+            if isinstance(message, dict):
+                return message
+
+    def stream(self, job: dict, trace: dict = None):
+        try:
+            self.proc.stdin.write(json.dumps(job) + "\n")
+            self.proc.stdin.flush()
+        except OSError as e:
+            raise WorkerError(f"Lost connection to '{self.name}' process: {e}")
+        return (yield from _responses(self._recv, self.name, trace))
+
+    def call(self, job: dict, trace: dict = None):
+        return _drain(self.stream(job, trace))
+
+    def close(self) -> None:
+        # closing both pipes also stops a process that is mid-way through a
+        # stream the caller abandoned
+        for pipe in (self.proc.stdin, self.proc.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+        self.proc.wait()
+
+    def terminate(self) -> None:
+        # for a process nobody is waiting on any more, e.g. still loading its
+        # model; a job in flight fails with WorkerError
+        self.proc.kill()
+        self.proc.wait()
+
+
+def serve(name: str, handler) -> None:
+    """
+    Runs a long-lived worker loop for a stage. The model is whatever the
+    calling script loaded at import time; each job is a dict passed to
+    `handler`, and jobs are processed one at a time in arrival order.
+    """
+    address = worker_address(name)
+    if sys.platform != "win32":
+        os.makedirs(WORKER_DIR, exist_ok=True)
+        if os.path.exists(address):
+            # waits out a busy worker rather than removing its socket
+            if worker_available(name, timeout=None):
+                print(f"[ERROR] A '{name}' worker is already listening on {address}.", file=sys.stderr)
+                sys.exit(1)
+            os.remove(address)
+
+    listener = Listener(address, authkey=worker_authkey())
+    # exit through the finally below so the socket file is removed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"[INFO] '{name}' worker listening on {address}", file=sys.stderr)
+    try:
+        while True:
+            try:
+                conn = listener.accept()
+            except (EOFError, OSError, AuthenticationError) as e:
+                # also clients that gave up waiting while a job ran
+                print(f"[WARN] Rejected connection: {e}", file=sys.stderr)
+                continue
+
+            try:
+                job = conn.recv()
+                if job.get("ping"):
+                    conn.send({"ok": True, "result": "pong"})
+                    continue
+                _run_job(handler, job, conn.send)
+            except (EOFError, OSError) as e:
+                print(f"[WARN] Client disconnected: {e}", file=sys.stderr)
+            finally:
+                conn.close()
+    except KeyboardInterrupt:
+        print(f"[INFO] '{name}' worker shutting down.", file=sys.stderr)
+    finally:
+        listener.close()
+
+
+def serve_stdin(handler) -> None:
+    """
+    Same job loop as `serve`, but over JSON lines on stdin/stdout for the
+    lifetime of the parent process. Library prints are moved to stderr so
+    they cannot corrupt the protocol stream.
+    """
+    out = sys.stdout
+    sys.stdout = sys.stderr
+
+    def send(message: dict) -> None:
+        out.write(json.dumps(message) + "\n")
+        out.flush()
+
+    for line in sys.stdin:
+        if line.strip():
+            _run_job(handler, json.loads(line), send)
@@ -0,0 +1,68 @@
+import functools
+import math
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ocr"))
+
+from trocr_torch import TorchTrOCR  # noqa: E402
+
+PAD, EOS = 1, 2
+
+
+class StopRowAt(transformers.LogitsProcessor):
+    """Forces `row` to emit EOS at decoding step `step`, so it finishes early."""
+
+    def __init__(self, row, step):
+        self.row, self.step = row, step
+
+    def __call__(self, input_ids, scores):
+        if input_ids.shape[1] == self.step:
+            scores[self.row] = -float("inf")
+            scores[self.row, EOS] = 0.0
+        return scores
+
+
+class TokenProcessor:
+    def batch_decode(self, sequences, skip_special_tokens=True):
+        return [" ".join(str(t) for t in row.tolist() if t > EOS) for row in sequences]
+
+
+def tiny_trocr(stop_row, stop_step):
+    torch.manual_seed(0)
+    config = transformers.VisionEncoderDecoderConfig.from_encoder_decoder_configs(
+        transformers.ViTConfig(image_size=32, patch_size=8, hidden_size=32, num_hidden_layers=1,
+                               num_attention_heads=2, intermediate_size=64),
+        transformers.TrOCRConfig(vocab_size=50, d_model=32, decoder_layers=1, decoder_attention_heads=2,
+                                 decoder_ffn_dim=64, pad_token_id=PAD, bos_token_id=0, eos_token_id=EOS),
+    )
+    model = transformers.VisionEncoderDecoderModel(config).eval()
+    model.generation_config = transformers.GenerationConfig(
+        decoder_start_token_id=0, eos_token_id=EOS, pad_token_id=PAD,
+        max_length=12, no_repeat_ngram_size=3,
+    )
+    model.config.pad_token_id = PAD
+    model.generate = functools.partial(
+        model.generate, logits_processor=transformers.LogitsProcessorList([StopRowAt(stop_row, stop_step)]))
+
+    trocr = TorchTrOCR.__new__(TorchTrOCR)
+    trocr.model = model
+    trocr.processor = TokenProcessor()
+    return trocr
+
+
+def test_greedy_confidence_of_mixed_length_batch():
+    # the first line finishes after two tokens and is padded for the rest of
+    # the batch; no_repeat_ngram_size then bans the repeated pad token
+    trocr = tiny_trocr(stop_row=0, stop_step=2)
+    texts, confidences = trocr.greedy_decode(torch.randn(3, 3, 32, 32))
+
+    assert len(texts) == len(confidences) == 3
+    for confidence in confidences:
+        assert not math.isnan(confidence)
+        assert 0.0 < confidence <= 1.0
@@ -1,17 +1,38 @@
+import mimetypes
 import os
 import sys
 import uuid
 import subprocess
 import re
+import time
 from pathlib import Path
 
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file
+from flask import Flask, Response, abort, render_template, request, redirect, url_for, flash, send_file, jsonify
+from werkzeug.serving import is_running_from_reloader
 from werkzeug.utils import secure_filename
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from job_queue import JobQueue
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 UPLOAD_DIR = BASE_DIR / "uploads"
 FINAL_OUTPUT_DIR = BASE_DIR / "Final_Output"
 MAIN_SCRIPT = BASE_DIR / "main.py"
+JOBS_DB = BASE_DIR / ".cache" / "webapp_jobs.sqlite3"
+# Number of documents processed at once; the rest wait in the queue
+JOB_WORKERS = int(os.getenv("LECTURE_SYNTH_JOB_WORKERS", "1"))
+
+# main.py log lines that mark the start of each pipeline stage
+STAGE_MARKERS = {
+    "Processing input file": "ocr",
+    "Generating lecture script": "llm",
+    "Converting lecture script to speech": "tts",
+}
+
+# Audio that is still being synthesized is streamed as it grows: read what
+# is there, then poll for more until the job finishes.
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_POLL_INTERVAL = 0.5
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.getenv("LECTURE_SYNTH_SECRET", "change-me")
@@ -64,18 +85,53 @@ def index():
         saved_path = UPLOAD_DIR / saved_filename
         file.save(saved_path)
 
-        try:
-            audio_filename = run_pipeline(saved_path, unique_id)
-        except RuntimeError as exc:  # pragma: no cover - defensive logging path
-            flash(str(exc), "error")
-            return redirect(request.url)
+        job_queue.submit(unique_id, saved_path)
 
-        return redirect(url_for("result", job_id=unique_id, audio_filename=audio_filename))
+        if request.accept_mimetypes.best == "application/json":
+            return jsonify(job_id=unique_id, status_url=url_for("job_status", job_id=unique_id)), 202
+        return redirect(url_for("job_page", job_id=unique_id))
 
     return render_template("index.html")
 
 
-def run_pipeline(input_path: Path, unique_id: str) -> str:
+@app.route("/jobs/<job_id>")
+def job_page(job_id: str):
+    if job_queue.get(job_id) is None:
+        flash("Unknown job. Please start over.", "error")
+        return redirect(url_for("index"))
+
+    return render_template("status.html", job_id=job_id)
+
+
+@app.route("/api/jobs/<job_id>")
+def job_status(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify(error="Unknown job."), 404
+
+    payload = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "position": job.get("position"),
+        "error": job["error"],
+        "updated_at": job["updated_at"],
+    }
+    if job["status"] == "tts":
+        payload["audio_url"] = url_for("listen", job_id=job["id"], filename=audio_filename_for(job["id"]))
+    if job["status"] == "done":
+        payload["result_url"] = url_for("result", job_id=job["id"], audio_filename=job["audio_filename"])
+    return jsonify(payload)
+
+
+def audio_filename_for(job_id: str) -> str:
+    return f"{job_id}_elevenlabs_v2.mp3"
+
+
+def run_job(job: dict, set_status) -> str:
+    return run_pipeline(Path(job["input_path"]), job["id"], set_status)
+
+
+def run_pipeline(input_path: Path, unique_id: str, set_status=None) -> str:
     if not MAIN_SCRIPT.exists():
         raise RuntimeError("main.py not found. Please ensure you are running the app from the project root.")
 
@@ -88,23 +144,32 @@ def run_pipeline(input_path: Path, unique_id: str) -> str:
         "elevenlabs_v2",
     ]
 
-    try:
-        completed_process = subprocess.run(
-            command,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-        )
-    except subprocess.CalledProcessError as exc:
-        error_message = exc.stderr.strip() or "An unknown error occurred while generating the lecture audio."
+    process = subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    # stdout is only read after the pipeline finishes; main.py writes
+    # everything of note to stderr, so its stdout pipe cannot fill up
+    stderr_lines = []
+    for line in process.stderr:
+        stderr_lines.append(line)
+        for marker, stage in STAGE_MARKERS.items():
+            if marker in line and set_status is not None:
+                set_status(stage)
+    stdout = process.stdout.read()
+    process.wait()
+
+    if process.returncode != 0:
+        error_message = "".join(stderr_lines).strip() or "An unknown error occurred while generating the lecture audio."
         raise RuntimeError(error_message)
 
-    audio_filename = f"{unique_id}_elevenlabs_v2.mp3"
+    audio_filename = audio_filename_for(unique_id)
     audio_path = FINAL_OUTPUT_DIR / audio_filename
 
     if not audio_path.exists():
-        stdout_preview = (completed_process.stdout or "").strip().splitlines()[-5:]
+        stdout_preview = (stdout or "").strip().splitlines()[-5:]
         raise RuntimeError(
             "The lecture audio could not be located after processing.\n"
             + "\n".join(stdout_preview)
@@ -121,6 +186,11 @@ def result():
         flash("Missing job information. Please start over.", "error")
         return redirect(url_for("index"))
 
+    job = job_queue.get(job_id)
+    if job is None or job["status"] != "done" or job["audio_filename"] != audio_filename:
+        flash("Unknown job. Please start over.", "error")
+        return redirect(url_for("index"))
+
     audio_path = FINAL_OUTPUT_DIR / audio_filename
     if not audio_path.exists():
         flash("The generated audio file is no longer available. Please run the conversion again.", "error")
@@ -133,24 +203,125 @@ def result():
     )
 
 
-@app.route("/download/<path:filename>")
-def download(filename: str):
-    audio_path = FINAL_OUTPUT_DIR / Path(filename).name
+def job_in_progress(job_id: str) -> bool:
+    job = job_queue.get(job_id)
+    return job is not None and job["status"] not in ("done", "failed")
+
+
+def stream_growing_file(audio_path: Path, job_id: str, start: int = 0):
+    while not audio_path.exists():
+        if not job_in_progress(job_id):
+            return
+        time.sleep(STREAM_POLL_INTERVAL)
+
+    with open(audio_path, "rb") as f:
+        f.seek(start)
+        while True:
+            chunk = f.read(STREAM_CHUNK_SIZE)
+            if chunk:
+                yield chunk
+                continue
+            time.sleep(STREAM_POLL_INTERVAL)
+            # the job status is only looked up once the file stops growing
+            if os.fstat(f.fileno()).st_size > f.tell():
+                continue
+            if not job_in_progress(job_id):
+                # the writer may have added its last bytes after the size check
+                yield from iter(lambda: f.read(STREAM_CHUNK_SIZE), b"")
+                return
+
+
+def send_growing_audio(audio_path: Path, job_id: str, mimetype: str, headers: dict):
+    """
+    Serves a file that is still being written. A single byte range starting
+    within the bytes written so far gets a 206: a closed range is sent up to
+    the last byte written, an open one streams on as the file grows, with an
+    unknown end and length (`bytes N-*/*`). Ranges past the written bytes get
+    a 416. If-Range can't match a file that has no final ETag yet, so it
+    falls back to the whole file, as do multiple ranges.
+    """
+    headers = {**headers, "Cache-Control": "no-store", "Accept-Ranges": "bytes"}
+    byte_range = request.range
+    if byte_range is None or "If-Range" in request.headers or len(byte_range.ranges) != 1:
+        return Response(stream_growing_file(audio_path, job_id), mimetype=mimetype, headers=headers)
+
+    start, stop = byte_range.ranges[0]
+    if start == 0 and stop is None:
+        # what players send first; the whole file, as without a Range
+        return Response(stream_growing_file(audio_path, job_id), mimetype=mimetype, headers=headers)
+
+    written = audio_path.stat().st_size if audio_path.exists() else 0
+    if start < 0 or start >= written:
+        # a suffix range needs the final length, which isn't known yet
+        return Response(status=416, headers={**headers, "Content-Range": "bytes */*"})
+
+    if stop is not None:
+        with open(audio_path, "rb") as f:
+            f.seek(start)
+            body = f.read(min(stop, written) - start)
+        headers["Content-Range"] = f"bytes {start}-{start + len(body) - 1}/*"
+        return Response(body, status=206, mimetype=mimetype, headers=headers)
+
+    headers["Content-Range"] = f"bytes {start}-*/*"
+    return Response(stream_growing_file(audio_path, job_id, start), status=206, mimetype=mimetype, headers=headers)
+
+
+def send_audio(job_id: str, filename: str, as_attachment: bool = False):
+    """
+    Serves the audio of a job: a finished file with Range/ETag/Last-Modified
+    support, so players can seek and downloads can resume. A file whose job
+    is still running has no final length yet and is streamed as it is
+    written (see send_growing_audio). `filename` must be the job's output
+    file, taken from its queue row once it is done.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404)
+    in_progress = job["status"] not in ("done", "failed")
+    expected = audio_filename_for(job_id) if in_progress else job["audio_filename"]
+    if not expected or filename != expected:
+        abort(404)
+
+    audio_path = FINAL_OUTPUT_DIR / expected
+    mimetype = mimetypes.guess_type(expected)[0] or "application/octet-stream"
+
+    if in_progress:
+        headers = {}
+        if as_attachment:
+            headers["Content-Disposition"] = f'attachment; filename="{expected}"'
+        return send_growing_audio(audio_path, job_id, mimetype, headers)
+
     if not audio_path.exists():
         flash("Requested audio file was not found.", "error")
         return redirect(url_for("index"))
 
-    return send_file(audio_path, as_attachment=True)
+    return send_file(
+        audio_path,
+        mimetype=mimetype,
+        as_attachment=as_attachment,
+        conditional=True,
+        etag=True,
+        last_modified=audio_path.stat().st_mtime,
+        max_age=0,
+    )
 
 
-@app.route("/listen/<path:filename>")
-def listen(filename: str):
-    audio_path = FINAL_OUTPUT_DIR / Path(filename).name
-    if not audio_path.exists():
-        flash("Requested audio file was not found.", "error")
-        return redirect(url_for("index"))
+@app.route("/download/<job_id>/<filename>")
+def download(job_id: str, filename: str):
+    return send_audio(job_id, filename, as_attachment=True)
+
+
+@app.route("/listen/<job_id>/<filename>")
+def listen(job_id: str, filename: str):
+    return send_audio(job_id, filename)
+
+
+job_queue = JobQueue(JOBS_DB, run_job, workers=JOB_WORKERS)
 
-    return send_file(audio_path, mimetype="audio/mpeg")
+# Under the debug reloader the module is imported by a watcher process and
+# again by the serving process; only the one that serves drains the queue.
+if __name__ != "__main__" or is_running_from_reloader():
+    job_queue.start()
 
 
 if __name__ == "__main__":
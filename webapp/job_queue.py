@@ -0,0 +1,185 @@
+import sqlite3
+import threading
+import time
+import traceback
+from contextlib import closing
+from pathlib import Path
+from typing import Callable, Optional
+
+# Job lifecycle: "queued", then the pipeline stages in order, then "done" or
+# "failed". A job in one of the stages is being worked on.
+ACTIVE_STATES = ("ocr", "llm", "tts")
+
+# Workers touch heartbeat_at of their jobs every HEARTBEAT_INTERVAL seconds.
+# A job in progress whose heartbeat is older than STALE_AFTER belonged to a
+# server that stopped, and is queued again.
+HEARTBEAT_INTERVAL = 10.0
+STALE_AFTER = 60.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    input_path TEXT NOT NULL,
+    status TEXT NOT NULL,
+    audio_filename TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    heartbeat_at REAL
+)
+"""
+
+
+class JobQueue:
+    """
+    Persistent job queue backed by SQLite, drained by a fixed number of
+    background threads. `run_job(job, set_status)` does the work for one job
+    and returns the audio filename; it calls set_status("ocr"/"llm"/"tts") as
+    the pipeline advances. Jobs that were in progress in a server that
+    stopped (no heartbeat for STALE_AFTER seconds) are put back in the queue,
+    so several server processes can share the database.
+    """
+
+    def __init__(self, db_path: Path, run_job: Callable, workers: int = 1, poll_interval: float = 1.0):
+        self.db_path = Path(db_path)
+        self.run_job = run_job
+        self.workers = max(1, workers)
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._running = set()
+        self._running_lock = threading.Lock()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as db:
+            db.execute(SCHEMA)
+            columns = {row["name"] for row in db.execute("PRAGMA table_info(jobs)")}
+            if "heartbeat_at" not in columns:
+                db.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def submit(self, job_id: str, input_path: Path) -> None:
+        now = time.time()
+        with closing(self._connect()) as db:
+            db.execute(
+                "INSERT INTO jobs (id, input_path, status, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?)",
+                (job_id, str(input_path), now, now),
+            )
+        self._wakeup.set()
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with closing(self._connect()) as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = dict(row)
+            if job["status"] == "queued":
+                job["position"] = db.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at < ?",
+                    (job["created_at"],),
+                ).fetchone()[0]
+        return job
+
+    def _update(self, job_id: str, **fields) -> None:
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with closing(self._connect()) as db:
+            db.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _claim(self) -> Optional[dict]:
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers (or
+        # two server processes) can never claim the same job
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            placeholders = ", ".join("?" for _ in ACTIVE_STATES)
+            db.execute(
+                f"UPDATE jobs SET status = 'queued', updated_at = ? WHERE status IN ({placeholders}) "
+                "AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                (now, *ACTIVE_STATES, now - STALE_AFTER),
+            )
+            row = db.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                db.execute("COMMIT")
+                return None
+            db.execute(
+                "UPDATE jobs SET status = 'ocr', updated_at = ?, heartbeat_at = ? WHERE id = ?",
+                (now, now, row["id"]),
+            )
+            db.execute("COMMIT")
+            with self._running_lock:
+                self._running.add(row["id"])
+            return dict(row)
+        except BaseException:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    def _heartbeat(self) -> None:
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            with self._running_lock:
+                job_ids = list(self._running)
+            if not job_ids:
+                continue
+            placeholders = ", ".join("?" for _ in job_ids)
+            try:
+                with closing(self._connect()) as db:
+                    db.execute(f"UPDATE jobs SET heartbeat_at = ? WHERE id IN ({placeholders})",
+                               (time.time(), *job_ids))
+            except sqlite3.Error:
+                traceback.print_exc()
+
+    def _work(self) -> None:
+        while True:
+            try:
+                job = self._claim()
+            except sqlite3.Error:
+                # e.g. the database is locked for longer than the timeout;
+                # keep the worker alive and try again
+                traceback.print_exc()
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            def set_status(status: str, job_id: str = job["id"]) -> None:
+                if status in ACTIVE_STATES:
+                    self._update(job_id, status=status)
+
+            try:
+                try:
+                    audio_filename = self.run_job(job, set_status)
+                except Exception as exc:
+                    if not isinstance(exc, RuntimeError):
+                        traceback.print_exc()
+                    self._update(job["id"], status="failed", error=str(exc))
+                else:
+                    self._update(job["id"], status="done", audio_filename=audio_filename)
+            except sqlite3.Error:
+                # the job stays in progress; once its heartbeat is stale it is
+                # queued again
+                traceback.print_exc()
+            finally:
+                with self._running_lock:
+                    self._running.discard(job["id"])
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        heartbeat = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+        heartbeat.start()
+        self._threads.append(heartbeat)
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)